@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Times backup.backup_to_file end to end, and measures its peak memory use, for several journal sizes
+
+Each journal is served by a local fake LiveJournal (lj.fakeserver), gzipped as LJ's are, and backed
+up from scratch into a temporary file by a fresh Python process, so that the process's peak
+resident set size is the backup's own.
+
+Results are printed as JSON: for each size, the best time of 'repeats' runs in seconds, and the
+largest peak RSS, in kilobytes.
+
+usage: python benchmarks/backup.py [-s entries:comments,...] [-b sqlite|pickle] [-o results.json]
+"""
+
+import json
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser, SUPPRESS_HELP
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from lj.fakeserver import FakeLJServer
+
+SIZES = '100:1000,500:10000,2000:50000'
+
+
+def peak_rss():
+    """This process's peak resident set size in kilobytes, or None if it can't be told"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def child(url, path, backend):
+    """Runs one backup; prints its time and peak RSS as JSON"""
+    from lj import backup
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    started = time.time()
+    backup.backup_to_file('test', 'test', path, backend, host=url)
+    seconds = time.time() - started
+    sys.stdout = stdout
+    print(json.dumps({'seconds': seconds, 'peak_rss_kb': peak_rss()}))
+
+
+def run(url, backend):
+    directory = tempfile.mkdtemp(prefix='lj-benchmark-')
+    try:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', url,
+                                          os.path.join(directory, 'backup'), backend], cwd=ROOT)
+    finally:
+        shutil.rmtree(directory)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-s', dest='sizes', default=SIZES,
+                      help="Journal sizes to back up, as entries:comments,... (default %s)" % SIZES)
+    parser.add_option('-b', dest='backend', default='sqlite', help="Storage backend: sqlite or pickle (default sqlite)")
+    parser.add_option('-o', dest='output', help="File to write the results to, as well as printing them")
+    parser.add_option('--repeat', type='int', default=3, help="Backups of each size (default 3)")
+    parser.add_option('--child', action='store_true', default=False, help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+    if options.child:
+        child(*args)
+        return
+
+    results = {'backend': options.backend, 'sizes': []}
+    for size in options.sizes.split(','):
+        entries, comments = [int(n) for n in size.split(':')]
+        with FakeLJServer(entries, comments, gzip=True) as fake:
+            runs = [run(fake.url, options.backend) for i in range(options.repeat)]
+        rss = [r['peak_rss_kb'] for r in runs if r['peak_rss_kb'] is not None]
+        results['sizes'].append({'entries': entries,
+                                 'comments': comments,
+                                 'backup_seconds': min(r['seconds'] for r in runs),
+                                 'peak_rss_kb': max(rss) if rss else None})
+
+    output = json.dumps(results, indent=1, sort_keys=True)
+    print(output)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
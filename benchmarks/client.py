@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Times the client's hot paths against a local fake LiveJournal (lj.fakeserver):
+
+ - round trips: authenticated calls (getchallenge + the call itself, as __headers and __request
+   make them), with and without the challenge pool
+ - parse throughput of comment_meta and comment_body export pages, as fetch_comment_meta and
+   fetch_comment_bodies parse them, and the same pages fetched end to end
+ - decoding a getevents_syncitems response, with the standard unmarshaller and with fast_decode
+
+The pages and the getevents response are recorded from the fake server before they're parsed.  With
+-f, they're read from (or, the first time, recorded into) a directory instead, so the same fixtures
+can be used release after release, or replaced with pages saved from the real LiveJournal under the
+same names: comment_meta.xml, comment_body.xml and getevents_syncitems.xml.
+
+Results are printed as JSON.  Times are the best of 'repeats' runs, in seconds.
+
+usage: python benchmarks/client.py [-f fixture directory] [-o results.json]
+"""
+
+import io
+import json
+import os.path
+import sys
+import timeit
+from optparse import OptionParser
+try:
+    import xmlrpc.client as xmlrpclib
+    from urllib.request import Request, urlopen
+except ImportError:
+    import xmlrpclib
+    from urllib2 import Request, urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lj import lj
+from lj.fakeserver import FakeLJServer
+
+USER = 'test'
+PASSWORD = 'test'
+
+
+def record_fixtures(url):
+    """Fetches the raw pages and response the parse and decode benchmarks use from a fake server;
+    returns a dictionary of file name: bytes
+    """
+    def call(method, **args):
+        args.update(username=USER, password=PASSWORD, ver=1)
+        request = Request(url + 'interface/xmlrpc', xmlrpclib.dumps((args,), 'LJ.XMLRPC.' + method).encode('utf-8'),
+                          {'Content-Type': 'text/xml'})
+        return urlopen(request).read()
+
+    session = xmlrpclib.loads(call('sessiongenerate'))[0][0]['ljsession']
+
+    def page(url):
+        return urlopen(Request(url, headers={'Cookie': 'ljsession=' + session})).read()
+
+    return {'comment_meta.xml': page(lj.comment_meta_url(url)),
+            'comment_body.xml': page(lj.comment_bodies_url(url)),
+            'getevents_syncitems.xml': call('getevents', selecttype='syncitems')}
+
+
+def load_fixtures(directory, url):
+    """Reads the fixtures from 'directory', recording any that are missing from the server at 'url'"""
+    fixtures = {}
+    recorded = None
+    for name in ('comment_meta.xml', 'comment_body.xml', 'getevents_syncitems.xml'):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            if recorded is None:
+                recorded = record_fixtures(url)
+            with open(path, 'wb') as f:
+                f.write(recorded[name])
+        with open(path, 'rb') as f:
+            fixtures[name] = f.read()
+    return fixtures
+
+
+def best(function, repeats, number=1):
+    """Returns the fastest time per call of 'function' over 'repeats' runs of 'number' calls"""
+    return min(timeit.repeat(function, number=number, repeat=repeats)) / number
+
+
+def round_trips(url, calls, repeats):
+    server = lj.LJServer('Python-lj.py/benchmark', 'benchmarks/client.py', url)
+    server.login(USER, PASSWORD)
+    results = {'round_trip_seconds': best(server.getfriendgroups, repeats, calls)}
+    server.enable_challenge_pool(size=calls + 1)
+    server.getfriendgroups()
+    results['round_trip_pooled_seconds'] = best(server.getfriendgroups, repeats, calls)
+    server.disable_challenge_pool()
+    server.pool.close()
+    return results
+
+
+def comment_pages(url, fixtures, repeats):
+    meta = fixtures['comment_meta.xml']
+    bodies = fixtures['comment_body.xml']
+    meta_count = len(lj.parse_comment_meta(io.BytesIO(meta))['comments'])
+    body_count = len(lj.parse_comment_bodies(io.BytesIO(bodies)))
+    results = {'comment_meta_bytes': len(meta),
+               'comment_meta_comments': meta_count,
+               'comment_meta_parse_seconds': best(lambda: lj.parse_comment_meta(io.BytesIO(meta)), repeats),
+               'comment_body_bytes': len(bodies),
+               'comment_body_comments': body_count,
+               'comment_body_parse_seconds': best(lambda: lj.parse_comment_bodies(io.BytesIO(bodies)), repeats)}
+    results['comment_meta_parse_per_second'] = meta_count / results['comment_meta_parse_seconds']
+    results['comment_body_parse_per_second'] = body_count / results['comment_body_parse_seconds']
+
+    server = lj.LJServer('Python-lj.py/benchmark', 'benchmarks/client.py', url)
+    server.login(USER, PASSWORD)
+    session = server.sessiongenerate()
+    results['fetch_comment_meta_seconds'] = best(lambda: server.fetch_comment_meta(0, session), repeats)
+    results['fetch_comment_bodies_seconds'] = best(lambda: server.fetch_comment_bodies(0, session), repeats)
+    server.pool.close()
+    return results
+
+
+def getevents_decode(fixtures, repeats):
+    data = fixtures['getevents_syncitems.xml']
+
+    def standard():
+        return [lj.entry_record(event) for event in xmlrpclib.loads(data)[0][0]['events']]
+
+    def fast():
+        return [lj.entry_record(event) for event in lj.fast_loads(data)[0]['events']]
+
+    results = {'getevents_bytes': len(data),
+               'getevents_events': len(fast()),
+               'getevents_decode_seconds': best(standard, repeats),
+               'getevents_fast_decode_seconds': best(fast, repeats)}
+    return results
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-f', dest='fixtures', help="Directory to read recorded pages from (recorded there if missing)")
+    parser.add_option('-o', dest='output', help="File to write the results to, as well as printing them")
+    parser.add_option('--entries', type='int', default=500, help="Entries in the fake journal (default 500)")
+    parser.add_option('--comments', type='int', default=10000, help="Comments in the fake journal (default 10000)")
+    parser.add_option('--calls', type='int', default=200, help="Calls per round trip run (default 200)")
+    parser.add_option('--repeat', type='int', default=5, help="Runs of each benchmark (default 5)")
+    options, args = parser.parse_args()
+
+    with FakeLJServer(options.entries, options.comments) as fake:
+        if options.fixtures:
+            if not os.path.isdir(options.fixtures):
+                os.makedirs(options.fixtures)
+            fixtures = load_fixtures(options.fixtures, fake.url)
+        else:
+            fixtures = record_fixtures(fake.url)
+        results = {'entries': options.entries, 'comments': options.comments, 'calls': options.calls}
+        results.update(round_trips(fake.url, options.calls, options.repeat))
+        results.update(comment_pages(fake.url, fixtures, options.repeat))
+        results.update(getevents_decode(fixtures, options.repeat))
+
+    output = json.dumps(results, indent=1, sort_keys=True)
+    print(output)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Runs every benchmark, each in its own process, and collects their results in one JSON document
+
+With -c, the results are compared against an earlier run's: any of a benchmark's metrics that got
+worse by more than the threshold (higher, for times and memory; lower, for rates) is reported as a
+regression, and the exit status is 1.  Results that aren't listed as metrics, such as the sizes of
+the pages parsed, aren't compared.
+
+usage: python benchmarks/run.py [-o results.json] [-c baseline.json] [-t 0.2] [--quick]
+"""
+
+import json
+import os.path
+import platform
+import subprocess
+import sys
+import time
+from optparse import OptionParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HIGHER_IS_WORSE = 1
+LOWER_IS_WORSE = -1
+
+# Arguments for each benchmark, smaller ones for --quick, and its metrics: result name: which way is worse
+BENCHMARKS = (
+    ('client', ['client.py'], ['client.py', '--repeat', '3', '--calls', '50'],
+     {'round_trip_seconds': HIGHER_IS_WORSE,
+      'round_trip_pooled_seconds': HIGHER_IS_WORSE,
+      'comment_meta_parse_seconds': HIGHER_IS_WORSE,
+      'comment_body_parse_seconds': HIGHER_IS_WORSE,
+      'comment_meta_parse_per_second': LOWER_IS_WORSE,
+      'comment_body_parse_per_second': LOWER_IS_WORSE,
+      'fetch_comment_meta_seconds': HIGHER_IS_WORSE,
+      'fetch_comment_bodies_seconds': HIGHER_IS_WORSE,
+      'getevents_decode_seconds': HIGHER_IS_WORSE,
+      'getevents_fast_decode_seconds': HIGHER_IS_WORSE}),
+    ('backup', ['backup.py'], ['backup.py', '-s', '100:1000,500:10000', '--repeat', '1'],
+     {'backup_seconds': HIGHER_IS_WORSE,
+      'peak_rss_kb': HIGHER_IS_WORSE}),
+)
+
+
+def flatten(results, prefix=''):
+    """Returns {'name.name...': number} for every number in a benchmark's results
+    Lists of dictionaries (e.g. backup's sizes) are keyed by their entries and comments.
+    """
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, list):
+            for item in value:
+                flat.update(flatten(item, '%s%s[%s:%s].' % (prefix, key, item.get('entries'), item.get('comments'))))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def direction(name):
+    """Returns HIGHER_IS_WORSE or LOWER_IS_WORSE for a flattened result name that's one of its
+    benchmark's metrics, or None for one that isn't
+    """
+    benchmark = name.split('.', 1)[0]
+    for key, full, quick, metrics in BENCHMARKS:
+        if key == benchmark:
+            return metrics.get(name.rsplit('.', 1)[-1])
+    return None
+
+
+def regressions(results, baseline, threshold):
+    """Returns [(name, baseline value, new value)...] for the metrics that got worse by more than 'threshold'"""
+    new = flatten(results)
+    old = flatten(baseline)
+    worse = []
+    for name in sorted(set(new) & set(old)):
+        worse_if = direction(name)
+        if worse_if is None or not old[name] or new[name] is None:
+            continue
+        if (float(new[name]) / old[name] - 1) * worse_if > threshold:
+            worse.append((name, old[name], new[name]))
+    return worse
+
+
+def missing(results):
+    """Returns the metrics that no benchmark reported, so that a renamed result isn't silently left unchecked"""
+    reported = set(name.rsplit('.', 1)[-1] for name in flatten(results))
+    return sorted('%s.%s' % (key, name) for key, full, quick, metrics in BENCHMARKS
+                  for name in metrics if key in results and name not in reported)
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-o', dest='output', help="File to write the results to, as well as printing them")
+    parser.add_option('-c', dest='compare', help="Results of an earlier run to compare against")
+    parser.add_option('-t', dest='threshold', type='float', default=0.2,
+                      help="Fraction by which a result must get worse to count as a regression (default 0.2)")
+    parser.add_option('--quick', action='store_true', default=False, help="Run smaller versions of the benchmarks")
+    options, args = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+    try:
+        results['revision'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE,
+                                                      stderr=subprocess.STDOUT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        results['revision'] = None
+    for name, full, quick, metrics in BENCHMARKS:
+        arguments = quick if options.quick else full
+        sys.stderr.write("Running %s\n" % name)
+        output = subprocess.check_output([sys.executable, os.path.join(HERE, arguments[0])] + arguments[1:])
+        results[name] = json.loads(output.decode('utf-8'))
+
+    output = json.dumps(results, indent=1, sort_keys=True)
+    print(output)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+
+    for name in missing(results):
+        sys.stderr.write("Warning: metric %s wasn't in the results\n" % name)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        worse = regressions(results, baseline, options.threshold)
+        for name, old, new in worse:
+            sys.stderr.write("Regression: %s went from %.6g to %.6g\n" % (name, old, new))
+        if worse:
+            sys.exit(1)
+        sys.stderr.write("No regressions against %s\n" % options.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1 @@
-__all__ = ['lj']
+__all__ = ['lj', 'aio', 'transport', 'storage', 'export', 'records', 'threads', 'watch', 'ratelimit', 'fakeserver', 'metrics', 'logincache', 'sessions', 'bulkpost']
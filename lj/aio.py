@@ -0,0 +1,337 @@
+"""asyncio LiveJournal interface
+
+AsyncLJServer offers the same methods as lj.LJServer as coroutines, so one event loop can keep
+thousands of calls for many journals in flight at once.  Requests go through an AsyncHTTPTransport,
+which keeps HTTP/1.1 connections alive, shares them between calls (and between servers, if you
+pass the same transport to several of them) and limits how many requests run against each host.
+
+    async def main():
+        server = AsyncLJServer('Python-PyLJ/0.0.1', 'http://example.com/ljtoy.html; bob@example.com')
+        await server.login('test', 'test')
+        print(await server.getevents_one())
+        await server.close()
+"""
+
+import asyncio
+import ssl as _ssl
+import zlib
+import io
+try:
+    import xmlrpc.client as xmlrpclib
+except ImportError:
+    import xmlrpclib
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+try:
+    from . import lj, transport as _transport
+except ImportError:
+    import lj
+    import transport as _transport
+
+
+class AsyncHTTPTransport:
+    """A small HTTP/1.1 client built on asyncio streams
+
+    limit: the most requests allowed in flight to any one host at a time
+    ssl_context: used for https connections; defaults to ssl.create_default_context()
+
+    Idle connections are kept per host and handed to the next request for that host.  A request
+    that fails on a reused connection (the server having closed it in the meantime) is made again
+    on a new connection if it failed before it was sent, or if it's idempotent and none of the
+    response had arrived; anything else may already have been carried out, so it's raised.
+    """
+
+    def __init__(self, limit=8, ssl_context=None):
+        self.limit = limit
+        self.ssl_context = ssl_context
+        self.semaphores = {}
+        self.idle = {}
+
+    async def request(self, method, url, body=None, headers=None, idempotent=None):
+        """Makes a request, returning (status, headers, body)
+        headers in the result is a dictionary with lowercased keys.  gzip or deflate encoded bodies
+        are decoded.
+        idempotent: whether the request may safely be made twice; by default, true for GET, HEAD
+            and OPTIONS requests
+        """
+        if idempotent is None:
+            idempotent = method in _transport.IDEMPOTENT_METHODS
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        key = (parts.scheme, parts.hostname, parts.port or (443 if secure else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Host: %s' % parts.netloc,
+                 'Accept-Encoding: gzip, deflate']
+        for name, value in (headers or {}).items():
+            lines.append('%s: %s' % (name, value))
+        if body is not None:
+            lines.append('Content-Length: %d' % len(body))
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        semaphore = self.semaphores.get(key)
+        if semaphore is None:
+            semaphore = self.semaphores[key] = asyncio.Semaphore(self.limit)
+        async with semaphore:
+            while True:
+                reused, reader, writer = await self.__connect(key)
+                sent = False
+                try:
+                    writer.write(head + (body or b''))
+                    await writer.drain()
+                    sent = True
+                    status, response_headers, data, keep = await self.__response(reader, method)
+                except (ConnectionError, asyncio.IncompleteReadError) as v:
+                    writer.close()
+                    # A reset after sending may have come after the server acted on the request
+                    if reused and (not sent or (idempotent and no_response(v))):
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+            if keep:
+                self.idle.setdefault(key, []).append((reader, writer))
+            else:
+                writer.close()
+        encoding = response_headers.get('content-encoding', '')
+        if encoding == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                data = zlib.decompress(data, -zlib.MAX_WBITS)
+        return status, response_headers, data
+
+    async def __connect(self, key):
+        idle = self.idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return True, reader, writer
+            writer.close()
+        scheme, host, port = key
+        context = None
+        if scheme == 'https':
+            context = self.ssl_context or _ssl.create_default_context()
+        reader, writer = await asyncio.open_connection(host, port, ssl=context)
+        return False, reader, writer
+
+    async def __response(self, reader, method):
+        try:
+            status_line = await reader.readuntil(b'\r\n')
+        except asyncio.IncompleteReadError as v:
+            if v.partial:
+                raise
+            raise NoResponse('Connection closed without a response')
+        except ConnectionError as v:
+            raise NoResponse(v)
+        if not status_line.strip():
+            raise NoResponse('Empty response')
+        version, status = status_line.split(None, 2)[:2]
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            data = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readuntil(b'\r\n')) != b'\r\n':
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(chunks)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+            keep = False
+        return status, headers, data, keep
+
+    async def close(self):
+        """Closes all idle connections"""
+        idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for reader, writer in connections:
+                writer.close()
+
+
+class NoResponse(ConnectionResetError):
+    """The connection was closed before any of the response arrived"""
+
+
+def no_response(error):
+    """Returns whether a failed request got nothing at all back from the server"""
+    return isinstance(error, NoResponse)
+
+
+class AsyncLJServer:
+    """asyncio counterpart of lj.LJServer
+
+    clientversion, user_agent, host and ssl are as for LJServer.
+    transport: an AsyncHTTPTransport (or anything with the same request coroutine); pass one
+        transport to several servers to share its connections and per-host limits between them.
+    limit: per-host concurrency limit for the transport created when none is passed in
+    fast_decode: as for LJServer
+
+    Every protocol method of LJServer is available here as a coroutine taking the same arguments
+    and returning the same thing.  Arguments are built and validated by an LJServer kept in
+    self.client, which also holds the login state (user, valid, lastupdate).
+    """
+
+    def __init__(self, clientversion, user_agent, host=lj.DEFAULT_HOST, ssl=False, transport=None,
+                 limit=8, fast_decode=False):
+        self.client = lj.LJServer(clientversion, user_agent, host, ssl)
+        self.fast_decode = fast_decode
+        self.user_agent = user_agent
+        self.host = host
+        self.transport = transport or AsyncHTTPTransport(limit)
+        # LJServer picks http or https from the ssl flag alone, whatever the host says
+        parts = urlsplit(host)
+        self.url = '%s://%s%sinterface/xmlrpc' % ('https' if ssl else 'http', parts.netloc, parts.path or '/')
+
+    async def close(self):
+        await self.transport.close()
+
+    async def __request(self, methodname, args):
+        body = xmlrpclib.dumps((args,), 'LJ.XMLRPC.' + methodname, allow_none=True).encode('utf-8')
+        status, headers, data = await self.transport.request(
+            'POST', self.url, body, {'Content-Type': 'text/xml', 'User-Agent': self.user_agent},
+            idempotent=methodname in lj.IDEMPOTENT_METHODS)
+        if status != 200:
+            raise xmlrpclib.ProtocolError(self.url, status, 'HTTP error %d' % status, headers)
+        if self.fast_decode:
+            return lj.fast_loads(data)[0]
+        return xmlrpclib.loads(data)[0][0]
+
+    async def __call(self, method, args, kwds):
+        # Let LJServer build the arguments, as if for a batch, then authenticate and send them here
+        call = self.client._queue(lj.LJBatch(self.client), method, args, kwds)
+        challenge = await self.getchallenge()
+        call.arguments.update(lj.challenge_auth(challenge['challenge'], self.client.password))
+        try:
+            response = await self.__request(call.methodname, call.arguments)
+        except xmlrpclib.Error as v:
+            raise lj.lj_error(v)
+        if call.finish is not None:
+            response = call.finish(response)
+        return response
+
+    async def getchallenge(self):
+        """See LJServer.getchallenge"""
+        try:
+            return await self.__request('getchallenge', {})
+        except xmlrpclib.Error as v:
+            raise lj.lj_error(v)
+
+    async def login(self, user, password, getmoods=None, getmenus=None, getpickws=None, getpickwurls=None):
+        """See LJServer.login"""
+        try:
+            return await self.__call(self.client.login, (user, password),
+                                     dict(getmoods=getmoods, getmenus=getmenus, getpickws=getpickws,
+                                          getpickwurls=getpickwurls))
+        except lj.LJException:
+            self.client.user = None
+            self.client.password = None
+            raise
+
+    async def checkfriends(self, *args, **kwds):
+        """See LJServer.checkfriends"""
+        return await self.__call(self.client.checkfriends, args, kwds)
+
+    async def consolecommand(self, *args, **kwds):
+        """See LJServer.consolecommand"""
+        return await self.__call(self.client.consolecommand, args, kwds)
+
+    async def delevent(self, *args, **kwds):
+        """See LJServer.delevent"""
+        return await self.__call(self.client.delevent, args, kwds)
+
+    async def editfriends(self, *args, **kwds):
+        """See LJServer.editfriends"""
+        return await self.__call(self.client.editfriends, args, kwds)
+
+    async def friendof(self, *args, **kwds):
+        """See LJServer.friendof"""
+        return await self.__call(self.client.friendof, args, kwds)
+
+    async def getdaycounts(self, *args, **kwds):
+        """See LJServer.getdaycounts"""
+        return await self.__call(self.client.getdaycounts, args, kwds)
+
+    async def getevents_one(self, *args, **kwds):
+        """See LJServer.getevents_one"""
+        return await self.__call(self.client.getevents_one, args, kwds)
+
+    async def getevents_lastn(self, *args, **kwds):
+        """See LJServer.getevents_lastn"""
+        return await self.__call(self.client.getevents_lastn, args, kwds)
+
+    async def getevents_day(self, *args, **kwds):
+        """See LJServer.getevents_day"""
+        return await self.__call(self.client.getevents_day, args, kwds)
+
+    async def getevents_syncitems(self, *args, **kwds):
+        """See LJServer.getevents_syncitems"""
+        return await self.__call(self.client.getevents_syncitems, args, kwds)
+
+    async def getfriends(self, *args, **kwds):
+        """See LJServer.getfriends"""
+        return await self.__call(self.client.getfriends, args, kwds)
+
+    async def getfriendgroups(self, *args, **kwds):
+        """See LJServer.getfriendgroups"""
+        return await self.__call(self.client.getfriendgroups, args, kwds)
+
+    async def postevent(self, *args, **kwds):
+        """See LJServer.postevent"""
+        return await self.__call(self.client.postevent, args, kwds)
+
+    async def sessiongenerate(self, *args, **kwds):
+        """See LJServer.sessiongenerate"""
+        return await self.__call(self.client.sessiongenerate, args, kwds)
+
+    async def sessionexpire(self, *args, **kwds):
+        """See LJServer.sessionexpire"""
+        return await self.__call(self.client.sessionexpire, args, kwds)
+
+    async def syncitems(self, *args, **kwds):
+        """See LJServer.syncitems"""
+        return await self.__call(self.client.syncitems, args, kwds)
+
+    async def __request_with_cookie(self, url, session=None):
+        if not session:
+            session = await self.sessiongenerate()
+        status, headers, data = await self.transport.request(
+            'GET', url, None, {'User-Agent': self.user_agent, 'Cookie': 'ljsession=' + session})
+        if status in lj.RATE_LIMIT_STATUSES:
+            raise lj.LJRateLimited('HTTP error %d fetching %s' % (status, url), lj.retry_after(headers))
+        if status != 200:
+            raise lj.LJException('HTTP error %d fetching %s' % (status, url))
+        return io.BytesIO(data)
+
+    async def fetch_comment_meta(self, startid=0, session=None):
+        """See LJServer.fetch_comment_meta"""
+        response = await self.__request_with_cookie(lj.comment_meta_url(self.host, startid), session)
+        return lj.parse_comment_meta(response)
+
+    async def fetch_comment_bodies(self, startid=0, session=None):
+        """See LJServer.fetch_comment_bodies"""
+        response = await self.__request_with_cookie(lj.comment_bodies_url(self.host, startid), session)
+        return lj.parse_comment_bodies(response)
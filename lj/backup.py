@@ -5,51 +5,31 @@ try:
     import configparser
 except ImportError:
     import ConfigParser as configparser
-import pickle
 import datetime
+import logging
+import sqlite3
 import time
-import os.path
 import sys
+import warnings
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from optparse import OptionParser
-import lj
-
-
-"""
-journal backup dictionary structure:
-    { 'last_entry': timestamp of the last journal entry sync'd,
-      'last_comment': id of the last comment sync'd,
-      'login': the dictionary returned by the last login (useful information such as friend groups),
-      'comment_posters': { [posterid]: [postername] }
-      'entries': { [entryid]: {
-          eventtime: timestamp,
-          security: 'private' or 'usemask',
-          allowmask: bitmask of usergroups allowed to see post,
-          subject: subject,
-          event: event text (url-encoded),
-          poster: user who posted the entry (if different from logged-in user),
-          props: dictionary of properties,
-          [other undocumented keys returned in a pseudo-arbitrary fashion by LJ],
-      } }
-      comments: { [commentid]: {
-          'posterid': poster id (map to username with comment_posters),
-          'jitemid': entry id,
-          'parentid': id of parent comment (0 if top-level),
-          'body': text of comment,
-          'date': date comment posted,
-          'subject': subject of comment,
-          [other undocumented keys returned in a pseudo-aritrary fashion by LJ],
-      } }
-    }
-"""
-
-DEFAULT_JOURNAL = {
-    'last_entry': None,
-    'last_comment': '0',
-    'last_comment_meta': None,
-    'entries': {},
-    'comments': {},
-    'comment_posters': {},
-}
+try:
+    from . import lj, storage
+    from .export import CommentExporter, worker_pool
+    from .logincache import LoginCache
+    from .sessions import SessionManager
+    from .metrics import Metrics
+    from .ratelimit import HostRateLimiter, AdaptiveConcurrency
+    from .transport import ConnectionPool
+except ImportError:
+    import lj
+    import storage
+    from export import CommentExporter, worker_pool
+    from logincache import LoginCache
+    from sessions import SessionManager
+    from metrics import Metrics
+    from ratelimit import HostRateLimiter, AdaptiveConcurrency
+    from transport import ConnectionPool
 
 
 def datetime_from_string(s):
@@ -57,159 +37,474 @@ def datetime_from_string(s):
     return datetime.datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
 
 
+def one_second_before(s):
+    return str(datetime_from_string(s) - datetime.timedelta(seconds=1))
+
+
 def days_ago(s):
     return (datetime.datetime.today() - datetime_from_string(s)).days
 
 
-def one_second_before(s):
-    return str(datetime_from_string(s) - datetime.timedelta(seconds=1))
+# The journal dictionary backups used to be kept as, and the functions that read and wrote it; they
+# now live in storage, and are kept here for scripts that still use them
+DEFAULT_JOURNAL = storage.default_journal()
+load_journal = storage.load_journal
+save_journal = storage.save_journal
+
 
+def new_server(pool=None, concurrency=None, host=None, metrics=None, login_cache=None, sessions=None):
+    """Returns an LJServer set up for backups
+    pool, concurrency (a ratelimit.AdaptiveConcurrency), metrics (a metrics.Instrumentation),
+    login_cache (a logincache.LoginCache) and sessions (a sessions.SessionManager) may be shared
+    with other servers.
+    host: the server to back up from, if not livejournal.com (e.g. a fakeserver.FakeLJServer's url)
+    """
+    server = lj.LJServer('lj.py+backup; kemayo@gmail.com', 'Python-lj.py/0.0.1', host or lj.DEFAULT_HOST, pool=pool,
+                         fast_decode=True, concurrency=concurrency, metrics=metrics,
+                         login_cache=login_cache, sessions=sessions)
+    server.enable_challenge_pool()
+    return server
 
-def backup(user, password, journal):
-    server = lj.LJServer('lj.py+backup; kemayo@gmail.com', 'Python-lj.py/0.0.1')
+
+def backup(user, password, store, workers=2, meta_pages=2, meta_recent=5000, host=None, metrics=None,
+           login_cache=None, sessions=None):
+    server = new_server(host=host, metrics=metrics, login_cache=login_cache, sessions=sessions)
     try:
         login = server.login(user, password, getpickws=True, getpickwurls=True)
     except lj.LJException as e:
         sys.exit(e)
 
-    # Load already-cached entries
+    nj, nc = update_journal(server, store, login, workers, meta_pages, meta_recent)
+    print(("Updated %d entries and %d comments" % (nj, nc)))
+
 
-    journal['login'] = login
+def update_journal(server, store, login, workers=2, meta_pages=2, meta_recent=5000, executor=None):
+    """Brings the backup in 'store' up to date, given a logged in server and its login response
+    executor: as for update_journal_entries
+    Returns (number of entries, number of comments) downloaded.
+    """
+    store.set('login', login)
 
     # Sync entries from the server
     print("Downloading journal entries")
-    nj = update_journal_entries(server, journal)
+    nj = update_journal_entries(server, store, workers, executor=executor)
 
     # Sync comments from the server
     print("Downloading comments")
-    nc = update_journal_comments(server, journal)
-
-    print(("Updated %d entries and %d comments" % (nj, nc)))
+    nc = update_journal_comments(server, store, meta_pages, meta_recent, workers, executor=executor)
+    return nj, nc
 
 
-def backup_to_file(user, password, f):
-    journal = load_journal(f)
-    backup(user, password, journal)
-    save_journal(f, journal)
-
-
-def load_journal(f):
-    # f should be a string referring to a file
-    if os.path.exists(f):
+def backup_to_file(user, password, f, backend='sqlite', workers=2, meta_pages=2, meta_recent=5000, host=None,
+                   metrics=None, login_cache=None, sessions=None):
+    """Backs the journal up into the file f, using the named storage backend (see storage.open_store)"""
+    store = storage.open_store(f, backend)
+    try:
+        backup(user, password, store, workers, meta_pages, meta_recent, host, metrics, login_cache, sessions)
+    finally:
+        store.close()
+
+
+def backup_account(account, pool=None, executor=None, concurrency=None, metrics=None, login_cache=None,
+                   sessions=None):
+    """Backs up one journal, as part of backup_accounts
+    account: a dictionary as returned by account_options
+    Returns a summary dictionary: the account's username, the numbers of entries and comments
+    downloaded, the bytes received, the seconds taken, and error (None if all went well).
+    """
+    started = time.time()
+    server = new_server(pool, concurrency, account.get('host'), metrics, login_cache, sessions)
+    summary = {'username': account['username'], 'entries': 0, 'comments': 0, 'error': None}
+    try:
+        store = storage.open_store(account['file'], account['backend'])
         try:
-            j = pickle.load(open(f, 'rb'))
-            return j
-        except EOFError:
-            return DEFAULT_JOURNAL.copy()
-    return DEFAULT_JOURNAL.copy()
-
-
-def save_journal(f, journal):
-    pickle.dump(journal, open(f, 'wb'))
-
-
-def update_journal_entries(server, journal):
-    syncitems = built_syncitems_list(server, journal)
+            login = server.login(account['username'], account['password'], getpickws=True, getpickwurls=True)
+            summary['entries'], summary['comments'] = update_journal(
+                server, store, login, account['workers'], account['meta_pages'], account['meta_recent'], executor)
+        finally:
+            store.close()
+    except (lj.LJException, IOError, sqlite3.Error) as e:
+        summary['error'] = str(e)
+    summary['bytes'] = server.bytes_read
+    summary['seconds'] = time.time() - started
+    return summary
+
+
+def backup_accounts(accounts, concurrency=4, workers=8, rate=5, metrics=None, login_cache=None, sessions=None):
+    """Backs up several journals at once
+    accounts: a list of dictionaries as returned by account_options
+    concurrency: how many journals are backed up at a time
+    workers: the size of the pool of download threads shared by all the journals; each journal
+        queues no more than its own 'workers' setting's worth of entry windows on it at a time (and
+        of comment spans, plus a few read ahead), so a large journal can't crowd out the others
+    rate: the most requests per second sent to any one host, across all the journals
+    metrics: an optional metrics.Instrumentation for every journal's requests
+    login_cache: an optional logincache.LoginCache shared by every journal's login
+    sessions: an optional sessions.SessionManager for every journal's session cookies
+    All the journals share one ConnectionPool, and one AdaptiveConcurrency that lets as many of the
+    download threads make requests at once as the server copes with.  A journal that fails doesn't
+    stop the others.
+    Prints a summary line per journal, and returns the summaries (see backup_account).
+    """
+    pool = ConnectionPool(maxsize=max(4, workers), limiter=HostRateLimiter(rate))
+    adaptive = AdaptiveConcurrency(initial=min(2, workers), maximum=max(1, workers))
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as runner:
+                futures = [runner.submit(backup_account, account, pool, executor, adaptive, metrics,
+                                         login_cache, sessions)
+                           for account in accounts]
+                summaries = [future.result() for future in futures]
+    finally:
+        pool.close()
+    print("%-20s %8s %8s %12s %8s" % ('account', 'entries', 'comments', 'bytes', 'seconds'))
+    for summary in summaries:
+        print("%-20s %8d %8d %12d %8.1f%s" % (summary['username'], summary['entries'], summary['comments'],
+                                               summary['bytes'], summary['seconds'],
+                                               '  failed: ' + summary['error'] if summary['error'] else ''))
+    return summaries
+
+
+def search_backup(f, query, backend='sqlite', limit=20):
+    """Prints the entries and comments in the backup file f that best match 'query'"""
+    store = storage.open_store(f, backend)
+    try:
+        started = time.time()
+        hits = store.search(query, limit)
+        elapsed = time.time() - started
+    finally:
+        store.close()
+    for hit in hits:
+        print("%-7s %8d  %s" % (hit['type'], hit['id'], hit['snippet']))
+    print("%d matches in %.1f ms" % (len(hits), elapsed * 1000))
+
+
+def update_journal_entries(server, store, workers=2, window=100, executor=None):
+    """Downloads new and changed entries
+    The list of entries to fetch is split into windows of 'window' consecutive items, which are
+    fetched by up to 'workers' threads at once.  Keep 'workers' small: the LJ bot policy frowns on
+    clients hammering the servers.
+    Each window is saved as soon as it arrives, and entries still to be fetched are remembered
+    in the store, so an interrupted backup picks up where it left off.
+    executor: a concurrent.futures executor (e.g. one shared between several journals) to fetch the
+        windows on instead of starting 'workers' threads; only 'workers' windows are queued on it
+        at a time, each as another finishes
+    """
+    update_syncitems(server, store)
+    syncitems = store.pending_entries()
     howmany = len(syncitems)
     print(howmany, "entries to download")
-    while len(syncitems) > 0:
-        print("getting entries starting at", syncitems[0][1])
-        sync = server.getevents_syncitems(one_second_before(syncitems[0][1]))
+    windows = (syncitems[start:start + window] for start in range(0, howmany, window))
+    futures = {}
+    with worker_pool(workers, executor) as executor:
+        def fill():
+            while len(futures) < max(1, workers):
+                items = next(windows, None)
+                if items is None:
+                    break
+                futures[executor.submit(fetch_entry_window, server, items)] = items
+        fill()
+        try:
+            while futures:
+                done, waiting = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    items = futures.pop(future)
+                    entries = future.result()
+                    fill()
+                    with store.transaction():
+                        store.put_entries(entries.values())
+                        store.remove_pending_entries([itemid for itemid, time in items])
+        finally:
+            for future in futures:
+                future.cancel()
+    return howmany
+
+
+def fetch_entry_window(server, items):
+    """Fetches the entries for a list of (itemid, time) syncitems
+    Returns a dictionary of itemid: entry, which may include entries from outside the window that
+    happened to come back in the same page.
+    """
+    times = dict(items)
+    pending = set(times)
+    entries = {}
+    while pending:
+        start = min(times[itemid] for itemid in pending)
+        print("getting entries starting at", start)
+        sync = server.getevents_syncitems(one_second_before(start))
+        remaining = len(pending)
         for entry in sync['events']:
             if hasattr(entry, 'data'):
                 entry = entry.data
-            journal['entries'][entry['itemid']] = entry
-            del(syncitems[0])
+            entries[entry['itemid']] = entry
+            pending.discard(entry['itemid'])
+        if len(pending) == remaining:
+            # The server has nothing more to give for this window (e.g. the entries were deleted)
+            break
+    return entries
+
+
+def update_syncitems(server, store, chunk=500):
+    """Adds everything syncitems reports since the last sync to the store's pending entries
+    The syncitems are saved 'chunk' at a time, each chunk with the sync cursor in the same
+    transaction, while the next page is fetched in the background.
+    """
+    chunk_items = []
+    for item in server.iter_syncitems(store.get('last_entry')):
+        chunk_items.append(item)
+        if len(chunk_items) >= chunk:
+            save_syncitems(store, chunk_items)
+            chunk_items = []
+    if chunk_items:
+        save_syncitems(store, chunk_items)
+
+
+def save_syncitems(store, items):
+    journalitems = [(int(e['item'][2:]), e['time']) for e in items if e['item'].startswith('L-')]
+    with store.transaction():
+        if journalitems:
+            store.add_pending_entries(journalitems)
+        store.set('last_entry', max(e['time'] for e in items))
+
+
+def update_journal_comments(server, store, meta_pages=2, meta_recent=5000, workers=2, session=None,
+                            executor=None):
+    """Downloads new comments and refreshes the metadata of some older ones
+    session: the session cookie to fetch comment pages with; by default the server's
+        SessionManager's is used, or if it has none, one is generated for the run and expired at
+        the end of it
+    executor: as for update_journal_entries
+    Returns the number of new comments.
+    """
+    expire = session is None and server.sessions is None
+    if expire:
+        session = server.sessiongenerate()
+    last_comment = store.get('last_comment', '0')
+    maxid, changed = get_meta_since(last_comment, server, session, store, meta_recent)
+    if int(maxid) > int(last_comment):
+        exporter = CommentExporter(server, session, workers, executor=executor, progress=print_export_progress)
+        exporter.export(last_comment, maxid, store)
+        if exporter.elapsed:
+            print("Downloaded %d comments in %d pages (%.1f pages/sec, %.1f comments/sec)"
+                  % (exporter.comments, exporter.pages, exporter.pages / exporter.elapsed,
+                     exporter.comments / exporter.elapsed))
+    changed += refresh_comment_meta(server, session, store, maxid, meta_pages, meta_recent)
+    if changed:
+        print("Updated metadata for %d comments" % changed)
+    howmany = int(store.get('last_comment', '0')) - int(last_comment)
+    if expire:
+        server.sessionexpire(session)
     return howmany
 
 
-def built_syncitems_list(server, journal):
-    all = []
-    count = 0
-    total = None
-    while count != total:
-        sync = server.syncitems(journal.get('last_entry'))
-        count = sync['count']
-        total = sync['total']
-        journalitems = [(int(e['item'][2:]), e['time']) for e in sync['syncitems'] if e['item'].startswith('L-')]
-        if journalitems:
-            all.extend(journalitems)
-            journal['last_entry'] = all[-1][1]
-    return all
-
-
-def update_journal_comments(server, journal):
-    session = server.sessiongenerate()
-    initial_meta = get_meta_since(journal['last_comment'], server, session)
-    journal['comment_posters'].update(initial_meta['usermaps'])
-    if initial_meta['maxid'] > journal['last_comment']:
-        bodies = get_bodies_since(journal['last_comment'], initial_meta['maxid'], server, session)
-        journal['comments'].update(bodies)
-    if len(journal['comments']) == 0 \
-           or journal['last_comment_meta'] is None \
-           or days_ago(journal['last_comment_meta']) > 30:
-        # update metadata every 30 days
-        all_meta = get_meta_since('0', server, session)
-        journal['comment_posters'].update(all_meta['usermaps'])
-        if len(journal['comments']) > 0:
-            for id, data in list(all_meta['comments'].items()):
-                journal['comments'][id]['posterid'] = data[0]
-                journal['comments'][id]['state'] = data[1]
-        journal['last_comment_meta'] = str(datetime.datetime.today())
-    howmany = int(initial_meta['maxid']) - int(journal['last_comment'])
-    journal['last_comment'] = initial_meta['maxid']
-    server.sessionexpire(session)
-    return howmany
+def print_export_progress(exporter, downloaded):
+    print("Downloaded %d comments so far" % downloaded)
+
+
+def fetch_meta_page(server, startid, session, store, update=False):
+    """Fetches one page of comment metadata, saving its poster names and, if 'update' is set,
+    applying changed poster ids and states to stored comments.
+    Returns (highest comment id on the page or None if it was empty, maxid, number of comments changed).
+    """
+    return save_meta_page(server.fetch_comment_meta(startid, session), store, update)
+
+
+def save_meta_page(meta, store, update=False):
+    """Saves a page of comment metadata as fetch_meta_page does, and returns the same"""
+    highest = max([int(id) for id in meta['comments']] or [None])
+    changed = 0
+    with store.transaction():
+        store.put_posters(meta['usermaps'])
+        if update:
+            changed = store.update_comment_meta(meta['comments'])
+    return highest, int(meta['maxid']), changed
+
+
+def get_meta_since(highest, server, session, store, recent=0):
+    """Walks the comment metadata after 'highest', saving the poster names from each page
+    The walk starts 'recent' ids before 'highest', and changed poster ids and states are applied
+    to the stored comments in that stretch, so the same pages serve both to find the new comments
+    and to re-check the most recent old ones.
+    Returns (the highest comment id, the number of stored comments whose metadata changed).
+    """
+    maxid = int(highest) + 1
+    changed = 0
+    for meta in server.iter_comment_meta_pages(max(0, int(highest) - recent), session):
+        page_highest, maxid, page_changed = save_meta_page(meta, store, update=recent > 0)
+        changed += page_changed
+    return str(maxid), changed
+
+
+def refresh_comment_meta(server, session, store, maxid, pages=2, recent=5000):
+    """Re-checks a bounded amount of older stored comment metadata for changed poster ids and states
+    Comments get screened, unscreened and deleted mostly while they're new, so get_meta_since
+    re-checks the last 'recent' comment ids every run.  This checks up to 'pages' pages of the
+    metadata before those, starting from a cursor ('meta_cursor') that works its way through the
+    rest of the comments over successive runs and starts again from the beginning once it reaches
+    the end; last_comment_meta records when it last did.
+    Only comments whose metadata actually changed are written.  Returns how many did.
+    """
+    changed = 0
+    recent_start = max(0, int(maxid) - recent)
+    cursor = int(store.get('meta_cursor', 0))
+    for page in range(pages):
+        if cursor >= recent_start:
+            # Everything older than the recent window has been checked; go round again
+            cursor = 0
+            store.set('last_comment_meta', str(datetime.datetime.today()).split('.')[0])
+            break
+        highest, maxid, page_changed = fetch_meta_page(server, cursor, session, store, update=True)
+        changed += page_changed
+        cursor = recent_start if highest is None else highest + 1
+    store.set('meta_cursor', cursor)
+    return changed
 
 
-def get_meta_since(highest, server, session):
-    all = {'comments': {}, 'usermaps': {}}
-    maxid = str(int(highest) + 1)
-    while highest < maxid:
-        meta = server.fetch_comment_meta(highest, session)
-        maxid = meta['maxid']
-        for id, data in list(meta['comments'].items()):
-            if int(id) > int(highest):
-                highest = id
-            all['comments'][id] = data
-        all['usermaps'].update(meta['usermaps'])
-    all['maxid'] = maxid
-    return all
+def built_syncitems_list(server, journal):
+    """Deprecated: use LJServer.iter_syncitems, or update_syncitems with a store
+    Returns (itemid, time) for every entry created or changed since journal['last_entry'], and
+    moves journal['last_entry'] on to the last of them.
+    """
+    warnings.warn("built_syncitems_list is deprecated; use LJServer.iter_syncitems", DeprecationWarning, 2)
+    items = []
+    for item in server.iter_syncitems(journal.get('last_entry'), prefetch=False):
+        if item['item'].startswith('L-'):
+            items.append((int(item['item'][2:]), item['time']))
+            journal['last_entry'] = item['time']
+    return items
 
 
 def get_bodies_since(highest, maxid, server, session):
-    all = {}
-    while highest != maxid:
-        meta = server.fetch_comment_bodies(highest, session)
-        for id, data in list(meta.items()):
-            if int(id) > int(highest):
-                highest = id
-            all[id] = data
-        if maxid in meta:
+    """Deprecated: use export.CommentExporter, or LJServer.iter_comment_bodies
+    Returns a dictionary of the comments after 'highest', up to 'maxid', by id.
+    """
+    warnings.warn("get_bodies_since is deprecated; use export.CommentExporter", DeprecationWarning, 2)
+    comments = {}
+    while int(highest) < int(maxid):
+        page_highest = None
+        for id, comment in server.iter_comment_bodies(int(highest) + 1, session):
+            comments[id] = comment
+            if page_highest is None or int(id) > page_highest:
+                page_highest = int(id)
+        if page_highest is None:
             break
-        print("Downloaded %d comments so far" % len(all))
-    return all
+        highest = page_highest
+    return comments
+
+
+def account_options(cp, section, options):
+    """Reads one account's settings from a section of a config file
+    Settings missing from the section come from the command line options.  Returns a dictionary
+    with the keys username, password, file, backend, workers, meta_pages, meta_recent and host.
+    """
+    def get(name, default, getter=cp.get):
+        return getter(section, name) if cp.has_option(section, name) else default
+    return {'username': cp.get(section, "username"),
+            'password': cp.get(section, "password"),
+            'file': cp.get(section, "file"),
+            'backend': get("backend", options.backend),
+            'workers': get("workers", options.workers, cp.getint),
+            'meta_pages': get("meta_pages", options.meta_pages, cp.getint),
+            'meta_recent': get("meta_recent", options.meta_recent, cp.getint),
+            'host': get("host", options.host)}
+
+
+def read_accounts(path, options):
+    """Returns account_options for every section of the config file at 'path' that has a username"""
+    cp = configparser.ConfigParser()
+    cp.read(path)
+    return [account_options(cp, section, options) for section in cp.sections() if cp.has_option(section, "username")]
 
 
 def __dispatch():
-    parser = OptionParser(version="%%prog %s" % __revision__, usage="usage: %prog -u Username -p Password -f backup.pkl")
+    parser = OptionParser(version="%%prog %s" % __revision__, usage="usage: %prog -u Username -p Password -f backup.sqlite\n"
+                          "       %prog -u Username -p Password -f backup.sqlite watch\n"
+                          "       %prog -c config [watch]\n"
+                          "       %prog -f backup.sqlite search query...")
     parser.add_option('-u', dest='user', help="Username")
     parser.add_option('-p', dest='password', help="Password")
-    parser.add_option('-f', dest='file', help="Backup filename")
+    parser.add_option('-f', dest='file', help="Backup filename (a .pkl backup is migrated to .sqlite alongside it)")
     parser.add_option('-c', dest='config', help="Config file")
+    parser.add_option('-H', dest='host', help="Server to back up from (default %s)" % lj.DEFAULT_HOST)
+    parser.add_option('-b', dest='backend', default='sqlite',
+                      help="Storage backend, 'sqlite' (default) or 'pickle'")
+    parser.add_option('-w', dest='workers', type='int', default=2,
+                      help="Number of entry or comment pages to download at once (default 2)")
+    parser.add_option('--meta-pages', dest='meta_pages', type='int', default=2,
+                      help="Pages of older comment metadata to re-check per run (default 2)")
+    parser.add_option('--meta-recent', dest='meta_recent', type='int', default=5000,
+                      help="Number of most recent comments whose metadata is re-checked every run (default 5000)")
+    parser.add_option('-n', dest='limit', type='int', default=20,
+                      help="Number of search results to show (default 20)")
+    parser.add_option('-i', dest='interval', type='int', default=600,
+                      help="In watch mode, seconds between checks for new entries and comments (default 600)")
+    parser.add_option('-j', dest='concurrency', type='int', default=4,
+                      help="Number of journals to back up at once, with a config file listing several (default 4)")
+    parser.add_option('--rate', dest='rate', type='float', default=5,
+                      help="Most requests per second to send to any one host, with several journals (default 5)")
+    parser.add_option('--metrics', dest='metrics',
+                      help="Write request timings, byte counts and errors to this file, in Prometheus' text format")
+    parser.add_option('--login-cache', dest='login_cache',
+                      help="Cache moods and userpic keywords from login in this file, for a day, between runs")
+    parser.add_option('--session-cache', dest='session_cache',
+                      help="Keep a session cookie in this file to reuse between runs, instead of a new one each run")
 
     options, args = parser.parse_args(sys.argv[1:])
-    if options.config:
-        cp = configparser.ConfigParser()
-        cp.read(options.config)
-        username = cp.get("login", "username")
-        password = cp.get("login", "password")
-        filename = cp.get("login", "file")
-        backup_to_file(username, password, filename)
-    elif options.user and options.password and options.file:
-        backup_to_file(options.user, options.password, options.file)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    metrics = Metrics() if options.metrics else None
+    login_cache = LoginCache(options.login_cache) if options.login_cache else None
+    sessions = SessionManager(options.session_cache) if options.session_cache else None
+    if args and args[0] == 'search':
+        if len(args) < 2:
+            parser.error("search needs a query")
+        filename, backend = options.file, options.backend
+        if options.config:
+            cp = configparser.ConfigParser()
+            cp.read(options.config)
+            filename = cp.get("login", "file")
+            backend = cp.get("login", "backend") if cp.has_option("login", "backend") else options.backend
+        if not filename:
+            parser.error("search needs the backup file, from -f or a config file")
+        search_backup(filename, ' '.join(args[1:]), backend, options.limit)
+    elif args and args[0] == 'watch':
+        try:
+            from . import watch
+        except ImportError:
+            import watch
+        if options.config:
+            accounts = read_accounts(options.config, options)
+        elif options.user and options.password and options.file:
+            accounts = [{'username': options.user, 'password': options.password, 'file': options.file,
+                         'backend': options.backend, 'workers': options.workers,
+                         'meta_pages': options.meta_pages, 'meta_recent': options.meta_recent,
+                         'host': options.host}]
+        else:
+            parser.error("watch needs a config file, or -u, -p, and -f")
+        watch.watch_accounts(accounts, options.interval, metrics=metrics, login_cache=login_cache,
+                             sessions=sessions)
     else:
-        parser.error("If a config file is not being used, -u, -p, and -f must all be present.")
+        if options.config:
+            # Every section with a username is a journal to back up
+            accounts = read_accounts(options.config, options)
+            if len(accounts) == 1:
+                account = accounts[0]
+                backup_to_file(account['username'], account['password'], account['file'], account['backend'],
+                               account['workers'], account['meta_pages'], account['meta_recent'], account['host'],
+                               metrics, login_cache, sessions)
+            elif accounts:
+                backup_accounts(accounts, options.concurrency, max(options.workers, options.concurrency * 2),
+                                options.rate, metrics, login_cache, sessions)
+            else:
+                parser.error("No section of %s has a username" % options.config)
+        elif options.user and options.password and options.file:
+            backup_to_file(options.user, options.password, options.file, options.backend, options.workers,
+                           options.meta_pages, options.meta_recent, options.host, metrics, login_cache,
+                           sessions)
+        else:
+            parser.error("If a config file is not being used, -u, -p, and -f must all be present.")
+    if metrics is not None:
+        with open(options.metrics, 'w') as f:
+            f.write(metrics.prometheus())
 
 if __name__ == "__main__":
     __dispatch()
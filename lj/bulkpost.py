@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""Posting many entries at once, e.g. to move an archive into a journal
+
+BulkPoster takes a stream of entries, each a dictionary of postevent's arguments (event, subject,
+e_datetime, security, props, usejournal, lineendings), and posts them from several threads,
+several to a request (as one system.multicall, authenticated with challenges fetched together),
+no faster than a set rate.
+
+Progress is kept in a PostJournal, a file with a line per event that's flushed to disk as it's
+written, so an import that's interrupted can be run again and pick up where it left off:
+
+ - entries already posted are skipped
+ - entries whose request may or may not have reached LJ (the connection dropped, say) are looked
+   for among the journal's entries for that day; the ones that turn up are recorded as posted,
+   and the rest are posted again
+ - entries LJ refused are tried again
+
+Entries are told apart by their 'id', if they have one, or else by their position in the stream,
+so the stream must be given in the same order each time if its entries have no ids.
+
+From the command line, the entries are read from a file of JSON objects, one per line:
+
+    python bulkpost.py -u Username -p Password -j progress.jsonl entries.jsonl
+"""
+
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from optparse import OptionParser
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+try:
+    from . import lj
+    from .ratelimit import TokenBucket
+except ImportError:
+    import lj
+    from ratelimit import TokenBucket
+
+# postevent's arguments, which are all an entry may contain besides its 'id'
+ENTRY_KEYS = ('event', 'subject', 'e_datetime', 'security', 'props', 'usejournal', 'lineendings')
+
+DATETIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+
+def parse_datetime(value):
+    """Turns an e_datetime from JSON, such as '2007-11-19 12:24:01', into a datetime.datetime"""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    value = value.rstrip('Z')
+    for format in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError("Can't read the date and time %r" % value)
+
+
+def read_entries(f):
+    """Yields the entries in a file of JSON objects, one per line; blank lines are skipped"""
+    for number, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError as e:
+            raise ValueError("Line %d: %s" % (number, e))
+        if not isinstance(entry, dict) or 'event' not in entry:
+            raise ValueError("Line %d: not an entry with an 'event'" % number)
+        yield entry
+
+
+class PostJournal:
+    """A durable record of which entries have been posted
+
+    path: the file to keep it in; it's appended to, and read back when an import is resumed
+    sync: whether to fsync after each line, so that a record survives the machine going down as
+        well as the process
+
+    Each line is a JSON object with the entry's key and its state:
+     'posting': about to be posted, with the eventtime, subject and usejournal to find it by
+     'posted': posted, with the itemid, anum and url LJ returned
+     'failed': refused by LJ, with the error
+    An entry's last line is the one that counts.  done, pending and failed hold the latest record of
+    the entries in each state.
+    """
+
+    def __init__(self, path, sync=True):
+        self.path = path
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.done = {}
+        self.pending = {}
+        self.failed = {}
+        if os.path.exists(path):
+            self.__load()
+        self.file = open(path, 'a')
+
+    def __load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may have been cut short when the previous run was stopped
+                    continue
+                key = record['key']
+                for records in (self.done, self.pending, self.failed):
+                    records.pop(key, None)
+                {'posted': self.done, 'posting': self.pending, 'failed': self.failed}[record['state']][key] = record
+
+    def __write(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            if self.sync:
+                os.fsync(self.file.fileno())
+            for records in (self.done, self.pending, self.failed):
+                records.pop(record['key'], None)
+            {'posted': self.done, 'posting': self.pending, 'failed': self.failed}[record['state']][record['key']] = record
+
+    def posting(self, key, eventtime, subject=None, usejournal=None):
+        self.__write({'key': key, 'state': 'posting', 'eventtime': eventtime, 'subject': subject or '',
+                      'usejournal': usejournal})
+
+    def posted(self, key, response):
+        self.__write({'key': key, 'state': 'posted', 'itemid': response.get('itemid'),
+                      'anum': response.get('anum'), 'url': response.get('url')})
+
+    def failed_with(self, key, error):
+        self.__write({'key': key, 'state': 'failed', 'error': str(error)})
+
+    def forget(self, key):
+        """Drops an entry's 'posting' record, so that it's posted again"""
+        with self.lock:
+            self.pending.pop(key, None)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class BulkPoster:
+    """Posts a stream of entries through a logged in LJServer
+
+    server: the lj.LJServer to post through, already logged in
+    journal: the PostJournal to record progress in
+    workers: how many requests may be in flight at once
+    rate: the most entries to post per second, or None for no limit
+    batch: how many entries to send in each request
+    backdate: mark entries as backdated (props 'opt_backdated'), as LJ requires for entries dated
+        before the journal's latest, unless they say otherwise
+    retries: how many times to send entries again that definitely weren't posted: those LJ turned
+        away for coming too fast, and those never sent because something before them failed.  Only
+        those are sent again; entries that may have been posted are left for reconcile()
+    progress: print progress every this many entries; 0 for never
+
+    After run(), posted, failed, skipped and uncertain count the entries in each case, and
+    seconds holds how long the run took.
+    """
+
+    def __init__(self, server, journal, workers=4, rate=None, batch=10, backdate=False, retries=3, progress=100):
+        self.server = server
+        self.journal = journal
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(rate, max(batch, rate)) if rate else None
+        self.batch = max(1, batch)
+        self.backdate = backdate
+        self.retries = retries
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.posted = 0
+        self.failed = 0
+        self.skipped = 0
+        self.uncertain = 0
+        self.seconds = 0
+        self.started = None
+
+    def reconcile(self):
+        """Settles entries a previous run started posting but never heard back about: each one that
+        can be found among the journal's entries for its day is recorded as posted, and the rest are
+        forgotten, to be posted again.  run() does this first.
+        """
+        claimed = set(record.get('itemid') for record in self.journal.done.values())
+        days = {}
+        for key, record in sorted(self.journal.pending.items()):
+            days.setdefault((record.get('usejournal'), record['eventtime'][:10]), []).append(record)
+        for (usejournal, day), records in sorted(days.items(), key=lambda item: (item[0][0] or '', item[0][1])):
+            year, month, date = [int(part) for part in day.split('-')]
+            arguments = {'usejournal': usejournal} if usejournal else {}
+            events = self.server.getevents_day(year, month, date, **arguments).get('events', [])
+            for record in records:
+                for event in events:
+                    if event['itemid'] not in claimed and str(event['eventtime'])[:16] == record['eventtime'][:16] \
+                            and (event.get('subject') or '') == (lj.post_subject(record['subject']) or ''):
+                        claimed.add(event['itemid'])
+                        self.journal.posted(record['key'], {'itemid': event['itemid'], 'anum': event.get('anum'),
+                                                            'url': event.get('url')})
+                        break
+                else:
+                    self.journal.forget(record['key'])
+
+    def __arguments(self, entry):
+        arguments = dict((key, entry[key]) for key in ENTRY_KEYS if entry.get(key) is not None)
+        # Fixed now rather than left to postevent, so the entry can be found again if need be
+        arguments['e_datetime'] = parse_datetime(arguments.get('e_datetime')) or datetime.datetime.now()
+        if self.backdate:
+            props = arguments['props'] = dict(arguments.get('props') or {})
+            props.setdefault('opt_backdated', 1)
+        return arguments
+
+    def __pending(self, entries):
+        """Yields (key, postevent arguments) for the entries that still need posting"""
+        for number, entry in enumerate(entries):
+            key = str(entry.get('id', number))
+            if key in self.journal.done:
+                with self.lock:
+                    self.skipped += 1
+                continue
+            yield key, self.__arguments(entry)
+
+    def __chunks(self, entries):
+        chunk = []
+        for item in self.__pending(entries):
+            chunk.append(item)
+            if len(chunk) >= self.batch:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def __send(self, chunk):
+        """Posts a chunk of entries, returning a list of each one's (response or exception, sent), where
+        sent is as for lj.LJBatchCall
+        """
+        batch = self.server.batch(len(chunk))
+        calls = [batch.postevent(**arguments) for key, arguments in chunk]
+        try:
+            batch.execute()
+        except (lj.LJException, IOError, httplib.HTTPException):
+            # Each call has its own outcome
+            pass
+        outcomes = []
+        for call in calls:
+            if not call.done:
+                outcomes.append((lj.LJException('No outcome for the request'), None))
+            elif call.error is not None:
+                outcomes.append((call.error, call.sent))
+            else:
+                outcomes.append((call.response, True))
+        return outcomes
+
+    def __post(self, chunk):
+        if self.bucket is not None:
+            self.bucket.acquire(len(chunk))
+        for key, arguments in chunk:
+            # Recorded as postevent will send it, so that reconcile() can find the entry by it
+            self.journal.posting(key, arguments['e_datetime'].strftime('%Y-%m-%d %H:%M'),
+                                 lj.post_subject(arguments.get('subject')), arguments.get('usejournal'))
+        posted = failed = uncertain = 0
+        remaining = chunk
+        for attempt in range(self.retries + 1):
+            retry = []
+            for (key, arguments), (result, sent) in zip(remaining, self.__send(remaining)):
+                if not isinstance(result, Exception):
+                    self.journal.posted(key, result)
+                    posted += 1
+                elif sent is False or lj.error_class(result) == 'rate_limited':
+                    # LJ never saw it, or turned it away: it wasn't posted, so it's safe to send again
+                    retry.append(((key, arguments), result))
+                elif lj.error_class(result) == 'fault':
+                    self.journal.failed_with(key, result)
+                    failed += 1
+                else:
+                    # It may or may not have been posted, so it's left as 'posting', for reconcile()
+                    # to look for, rather than risk posting it twice
+                    uncertain += 1
+            if not retry:
+                break
+            if attempt == self.retries:
+                for (key, arguments), result in retry:
+                    self.journal.failed_with(key, result)
+                    failed += 1
+                break
+            remaining = [item for item, result in retry]
+            delays = [result.retry_after for item, result in retry if getattr(result, 'retry_after', None)]
+            time.sleep(delays[0] if delays else 2 ** attempt)
+        with self.lock:
+            self.posted += posted
+            self.failed += failed
+            self.uncertain += uncertain
+            done = self.posted + self.failed + self.uncertain
+            if self.progress and done // self.progress != (done - len(chunk)) // self.progress:
+                elapsed = time.time() - self.started
+                print("Posted %d entries (%.1f posts/sec), %d failed" % (self.posted, self.posted / elapsed, self.failed))
+
+    def run(self, entries):
+        """Posts every entry in 'entries' (an iterable of dictionaries) that hasn't been posted already
+        Returns a summary dictionary of the posted, failed, skipped and uncertain counts, the seconds
+        taken, and the rate in posts per second.
+        """
+        self.started = time.time()
+        if self.journal.pending:
+            self.reconcile()
+        futures = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for chunk in self.__chunks(entries):
+                # Only read as far ahead of the requests in flight as it takes to keep them going
+                while len(futures) >= self.workers * 2:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                futures.add(executor.submit(self.__post, chunk))
+            for future in futures:
+                future.result()
+        self.seconds = time.time() - self.started
+        return self.summary()
+
+    def summary(self):
+        return {'posted': self.posted, 'failed': self.failed, 'skipped': self.skipped,
+                'uncertain': self.uncertain, 'seconds': self.seconds,
+                'rate': self.posted / self.seconds if self.seconds else 0.0}
+
+
+def bulk_post(server, entries, journal_path, workers=4, rate=None, batch=10, backdate=False, progress=100):
+    """Posts 'entries' through the logged in 'server', keeping progress in the file 'journal_path';
+    returns the summary from BulkPoster.run
+    """
+    journal = PostJournal(journal_path)
+    try:
+        return BulkPoster(server, journal, workers, rate, batch, backdate, progress=progress).run(entries)
+    finally:
+        journal.close()
+
+
+def __dispatch():
+    parser = OptionParser(usage="usage: %prog -u Username -p Password -j progress.jsonl entries.jsonl\n\n"
+                                "entries.jsonl holds one JSON object per line, with postevent's arguments:\n"
+                                "event, and optionally subject, e_datetime ('2007-11-19 12:24'), security,\n"
+                                "props, usejournal and lineendings, and an id to know the entry by.\n"
+                                "Give - to read the entries from standard input.")
+    parser.add_option('-u', dest='user', help="Username")
+    parser.add_option('-p', dest='password', help="Password")
+    parser.add_option('-j', dest='journal', help="File to record progress in, and resume from")
+    parser.add_option('-H', dest='host', help="Server to post to (default %s)" % lj.DEFAULT_HOST)
+    parser.add_option('-w', dest='workers', type='int', default=4, help="Requests to keep in flight (default 4)")
+    parser.add_option('--rate', dest='rate', type='float', default=5,
+                      help="Most entries to post per second (default 5; 0 for no limit)")
+    parser.add_option('--batch', dest='batch', type='int', default=10,
+                      help="Entries to send in each request (default 10)")
+    parser.add_option('--backdate', action='store_true', default=False,
+                      help="Mark entries as backdated, so they can be older than the journal's latest")
+    options, args = parser.parse_args(sys.argv[1:])
+    if not (options.user and options.password and options.journal and len(args) == 1):
+        parser.error("-u, -p, -j and a file of entries must all be given")
+
+    server = lj.LJServer('Python-lj.py/0.0.1', 'lj.py+bulkpost', options.host or lj.DEFAULT_HOST, fast_decode=True)
+    try:
+        server.login(options.user, options.password)
+    except lj.LJException as e:
+        sys.exit(e)
+    server.enable_challenge_pool(size=max(10, options.workers * 2), background=True)
+    f = sys.stdin if args[0] == '-' else open(args[0])
+    try:
+        summary = bulk_post(server, read_entries(f), options.journal, options.workers, options.rate or None,
+                            options.batch, options.backdate)
+    finally:
+        server.disable_challenge_pool()
+        if f is not sys.stdin:
+            f.close()
+    print("Posted %(posted)d entries in %(seconds).1f seconds (%(rate).1f posts/sec); "
+          "%(skipped)d already posted, %(failed)d failed, %(uncertain)d uncertain" % summary)
+
+if __name__ == "__main__":
+    __dispatch()
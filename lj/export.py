@@ -0,0 +1,116 @@
+"""Pipelined comment export
+
+CommentExporter downloads comment bodies for a range of comment ids over several connections at
+once.  The id range is cut into spans which worker threads fetch and parse (each page is parsed as
+it streams in), while the calling thread saves finished spans to a storage.JournalStore in order,
+so downloading, parsing and writing all overlap.
+"""
+
+import collections
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+@contextlib.contextmanager
+def worker_pool(workers, executor=None):
+    """Yields 'executor' if there is one, otherwise a new ThreadPoolExecutor with 'workers' threads
+    that's shut down afterwards
+    """
+    if executor is not None:
+        yield executor
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            yield executor
+
+
+class CommentExporter:
+    """Downloads comment bodies with a pipeline of worker threads
+
+    server: a logged in lj.LJServer
+    session: the session cookie to use for the export pages
+    workers: how many spans are downloaded at once
+    span: how many comment ids each worker fetches at a time; about a page's worth works best
+    ahead: how many finished spans may wait to be saved before the workers are held back
+    executor: a concurrent.futures executor to fetch spans on, e.g. one shared by several exports;
+        by default each export starts its own 'workers' threads
+    progress: optional callable, called with this exporter and the number of comments downloaded
+        so far by the current export() each time a span has been saved
+
+    After export() returns, pages, comments and elapsed hold the totals for the run.
+    """
+
+    def __init__(self, server, session, workers=2, span=1000, ahead=4, executor=None, progress=None):
+        self.server = server
+        self.session = session
+        self.workers = max(1, workers)
+        self.span = span
+        self.ahead = ahead
+        self.executor = executor
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.pages = 0
+        self.comments = 0
+        self.elapsed = 0
+
+    def spans(self, last, maxid):
+        """Yields (start, end) id ranges covering the comments after 'last' up to 'maxid'"""
+        for start in range(last + 1, maxid + 1, self.span):
+            yield start, min(start + self.span, maxid + 1)
+
+    def fetch_span(self, start, end):
+        """Fetches every comment with start <= id < end, returning a dictionary of id: comment"""
+        comments = {}
+        while start < end:
+            page_highest = None
+            for id, comment in self.server.iter_comment_bodies(start, self.session):
+                number = int(id)
+                if page_highest is None or number > page_highest:
+                    page_highest = number
+                if start <= number < end:
+                    comments[id] = comment
+            with self.lock:
+                self.pages += 1
+            if page_highest is None or page_highest >= end - 1:
+                break
+            start = page_highest + 1
+        return comments
+
+    def export(self, last, maxid, store):
+        """Downloads the comments after 'last', up to 'maxid', into 'store'
+        Spans are saved in id order, each in its own transaction along with the last_comment cursor,
+        so an interrupted export resumes after the last span saved.
+        Returns the number of comments downloaded.
+        """
+        last = int(last)
+        maxid = int(maxid)
+        started = time.time()
+        spans = self.spans(last, maxid)
+        pending = collections.deque()
+        downloaded = 0
+        with worker_pool(self.workers, self.executor) as executor:
+            def fill():
+                while len(pending) < self.workers + self.ahead:
+                    span = next(spans, None)
+                    if span is None:
+                        break
+                    pending.append((span, executor.submit(self.fetch_span, *span)))
+            fill()
+            try:
+                while pending:
+                    (start, end), future = pending.popleft()
+                    comments = future.result()
+                    fill()
+                    with store.transaction():
+                        store.put_comments(comments)
+                        store.set('last_comment', str(end - 1))
+                    downloaded += len(comments)
+                    if self.progress is not None:
+                        self.progress(self, downloaded)
+            finally:
+                for span, future in pending:
+                    future.cancel()
+        self.comments += downloaded
+        self.elapsed += time.time() - started
+        return downloaded
@@ -0,0 +1,648 @@
+#!/usr/bin/env python3
+"""A fake LiveJournal server for testing and benchmarking offline
+
+FakeLJServer serves the LJ.XMLRPC methods this library uses, and the export_comments.bml pages,
+from a threaded HTTP server on localhost.  Journals are generated from a seed rather than stored,
+so a journal of millions of comments costs no memory or start-up time, and the same settings
+always give the same data; only posted, edited and deleted entries, and changed comment states,
+are kept.
+
+    with FakeLJServer(entries=1000, comments=100000, latency=0.005) as fake:
+        server = lj.LJServer('Python-PyLJ/0.0.1', 'test', host=fake.url)
+        server.login('test', 'test')
+
+or, from the command line, serve until interrupted:
+
+    python fakeserver.py --entries 1000 --comments 1000000 --port 8080 --gzip
+
+Every account given to users (by default just test/test) sees a journal of the same shape, with
+its own text.  Requests can be slowed down, gzipped, or made to fail at random: see FakeLJServer.
+"""
+
+import datetime
+import gzip as _gzip
+import random
+import re
+import threading
+import time
+from hashlib import md5
+from optparse import OptionParser
+from xml.sax.saxutils import escape, quoteattr
+try:
+    import xmlrpc.client as xmlrpclib
+    from xmlrpc.server import SimpleXMLRPCDispatcher
+except ImportError:
+    import xmlrpclib
+    from SimpleXMLRPCServer import SimpleXMLRPCDispatcher
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+try:
+    from urllib.parse import urlsplit, parse_qs
+except ImportError:
+    from urlparse import urlsplit, parse_qs
+
+WORDS = ('the', 'journal', 'today', 'cat', 'coffee', 'rain', 'friends', 'music', 'book', 'train', 'night',
+         'work', 'dream', 'garden', 'letter', 'snow', 'summer', 'city', 'film', 'tea', 'walk', 'sea', 'window',
+         'quiet', 'long', 'strange', 'happy', 'tired', 'new', 'old', 'little', 'bright')
+TAGS = ('life', 'music', 'books', 'travel', 'food', 'cats', 'work', 'photos')
+MOODS = ('happy', 'sad', 'tired', 'excited', 'calm', 'annoyed', 'creative', 'sleepy')
+
+# Matches the method names in an XML-RPC request, including each call in a system.multicall
+METHOD_NAMES = re.compile(br'>LJ\.XMLRPC\.(\w+)<')
+
+# Time of the first generated entry; each entry after it is six hours later
+EPOCH = datetime.datetime(2005, 1, 1)
+
+
+def mix(*values):
+    """A deterministic 32 bit hash of some integers"""
+    h = 0x9e3779b9
+    for value in values:
+        h = (h ^ (value & 0xffffffff)) * 0x85ebca6b & 0xffffffff
+        h ^= h >> 13
+        h = h * 0xc2b2ae35 & 0xffffffff
+        h ^= h >> 16
+    return h
+
+
+def words(seed, count):
+    return ' '.join(WORDS[mix(seed, i) % len(WORDS)] for i in range(count))
+
+
+def lj_time(when):
+    return when.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class FakeJournal:
+    """One account's journal: generated entries and comments, plus whatever's been changed since
+
+    Entry itemids run from 1 to entries.  Comments are spread over the entries in consecutive
+    blocks of ids, each replying either to the entry or to an earlier comment in its block.
+    """
+
+    def __init__(self, username, password, seed, entries, comments, posters):
+        self.username = username
+        self.password = password
+        self.seed = seed
+        self.entries = entries
+        self.comments = comments
+        self.posters = posters
+        self.lock = threading.Lock()
+        # itemid: entry dictionary (with a 'synctime') for posted or edited entries, None if deleted
+        self.changed = {}
+        self.states = {}
+        # Comments per entry; comments added later all go on the last entry
+        self.block = max(1, -(-comments // max(1, entries)))
+        self.clock = EPOCH + datetime.timedelta(hours=6 * (entries + 1))
+
+    def tick(self):
+        """Returns a sync time later than any so far"""
+        self.clock += datetime.timedelta(minutes=1)
+        return lj_time(self.clock)
+
+    def entry(self, itemid):
+        """Returns entry 'itemid' (with its 'synctime'), or None if there isn't one"""
+        if itemid in self.changed:
+            return self.changed[itemid]
+        if not 1 <= itemid <= self.entries:
+            return None
+        h = mix(self.seed, itemid)
+        eventtime = lj_time(EPOCH + datetime.timedelta(hours=6 * itemid))
+        entry = {'itemid': itemid,
+                 'anum': h % 256,
+                 'eventtime': eventtime,
+                 'synctime': eventtime,
+                 'subject': words(h, 1 + h % 5).capitalize(),
+                 'event': words(h + 1, 20 + h % 200) + '.',
+                 'props': {'taglist': ', '.join(sorted(set(TAGS[mix(h, i) % len(TAGS)] for i in range(h % 4)))),
+                           'current_mood': MOODS[h % len(MOODS)]}}
+        if h % 10 == 0:
+            entry['security'] = 'private'
+        elif h % 10 == 1:
+            entry['security'] = 'usemask'
+            entry['allowmask'] = 1
+        return entry
+
+    def itemids(self):
+        return sorted(set(range(1, self.entries + 1)) | set(self.changed))
+
+    def entries_since(self, lastsync=None, limit=None):
+        """Returns (up to 'limit' of the entries changed after 'lastsync', oldest change first, and
+        the number of them there are in all)
+        """
+        # Generated entries were all "posted" at their eventtime, in itemid order, before anything
+        # was posted or edited through the server, so they can be counted without looking at them
+        start = 1
+        if lastsync:
+            since = datetime.datetime.strptime(lastsync, '%Y-%m-%d %H:%M:%S') - EPOCH
+            start = max(1, int(since.total_seconds() // (6 * 3600)) + 1)
+        changed = sorted((entry for entry in self.changed.values()
+                          if entry is not None and (lastsync is None or entry['synctime'] > lastsync)),
+                         key=lambda entry: (entry['synctime'], entry['itemid']))
+        total = max(0, self.entries - start + 1) - sum(1 for itemid in self.changed if start <= itemid <= self.entries)
+        total += len(changed)
+        found = []
+        itemid = start
+        while itemid <= self.entries and (limit is None or len(found) < limit):
+            if itemid not in self.changed:
+                found.append(self.entry(itemid))
+            itemid += 1
+        found.extend(changed)
+        return found[:limit], total
+
+    def comment_meta(self, id):
+        """Returns comment 'id' as (posterid, state), without generating its text"""
+        h = mix(self.seed, id, 7)
+        state = self.states.get(id)
+        if state is None:
+            state = 'D' if h % 97 == 0 else 'S' if h % 89 == 0 else 'A'
+        return h % self.posters, state
+
+    def comment(self, id):
+        """Returns comment 'id' as (jitemid, parentid, posterid, state, subject, body, date)"""
+        block = self.block
+        first = (id - 1) // block * block + 1
+        h = mix(self.seed, id, 7)
+        jitemid = min((id - 1) // block + 1, max(1, self.entries))
+        parentid = 0 if id == first or h % 3 == 0 else first + h % (id - first)
+        posterid, state = self.comment_meta(id)
+        date = (EPOCH + datetime.timedelta(hours=6 * jitemid, minutes=id - first + 1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        subject = words(h, 1 + h % 3) if h % 4 == 0 else ''
+        body = '' if state == 'D' else words(h + 2, 5 + h % 60)
+        return jitemid, parentid, posterid, state, subject, body, date
+
+    def username_of(self, posterid):
+        return 'poster%d' % posterid if posterid else ''
+
+
+class FakeLJServer:
+    """A fake LiveJournal server on localhost
+
+    entries, comments: how many of each every journal has to begin with
+    users: dictionary of username: password; defaults to {'test': 'test'}
+    seed: changes the generated text; the same seed always gives the same journals
+    posters: how many different people the comments come from
+    latency: seconds every request is delayed by
+    gzip: gzip response bodies for clients that accept it
+    error_rate: fraction of requests answered with HTTP 503 (with Retry-After: 1)
+    fault_rate: fraction of XML-RPC calls answered with a fault
+    drop_rate: fraction of requests whose connection is closed without any response
+    multicall: whether system.multicall is offered
+    host, port: where to listen; port 0 picks a free port.  url gives the address to pass to LJServer.
+    meta_page, body_page, sync_page, events_page: page sizes, as LJ's own
+
+    calls counts the requests received, by method (and by 'comment_meta' and 'comment_body' for
+    export pages).  add_comments() and set_comment_state() change the journals as a backup runs, and
+    fail() makes particular requests fail.
+    """
+
+    def __init__(self, entries=100, comments=1000, users=None, seed=0, posters=50, latency=0, gzip=False,
+                 error_rate=0, fault_rate=0, drop_rate=0, multicall=True, host='127.0.0.1', port=0,
+                 meta_page=10000, body_page=1000, sync_page=500, events_page=100):
+        self.latency = latency
+        self.gzip = gzip
+        self.error_rate = error_rate
+        self.fault_rate = fault_rate
+        self.drop_rate = drop_rate
+        self.meta_page = meta_page
+        self.body_page = body_page
+        self.sync_page = sync_page
+        self.events_page = events_page
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.challenges = {}
+        self.sessions = {}
+        self.failing = {}
+        self.journals = {}
+        for number, (username, password) in enumerate(sorted((users or {'test': 'test'}).items())):
+            self.journals[username] = FakeJournal(username, password, mix(seed, number), entries, comments, posters)
+
+        self.dispatcher = SimpleXMLRPCDispatcher(allow_none=True, encoding='utf-8')
+        for name in ('getchallenge', 'login', 'checkfriends', 'consolecommand', 'editevent', 'editfriends',
+                     'friendof', 'getdaycounts', 'getevents', 'getfriends', 'getfriendgroups', 'postevent',
+                     'sessiongenerate', 'sessionexpire', 'syncitems'):
+            self.dispatcher.register_function(self.__counted(name, getattr(self, 'rpc_' + name)),
+                                              'LJ.XMLRPC.' + name)
+        if multicall:
+            self.dispatcher.register_multicall_functions()
+
+        self.httpd = FakeHTTPServer((host, port), FakeRequestHandler)
+        self.httpd.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        """Starts serving on a background thread"""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-lj')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def fail(self, method, times=1, status=503):
+        """Answers the next 'times' XML-RPC requests calling 'method' (on its own or in a multicall)
+        with HTTP 'status' instead of carrying them out
+        """
+        with self.lock:
+            self.failing[method] = (times, status)
+
+    def failure(self, data):
+        """Returns the HTTP status to fail an XML-RPC request body with, or None to carry it out"""
+        if not self.failing:
+            return None
+        with self.lock:
+            for method in METHOD_NAMES.findall(data):
+                method = method.decode('ascii')
+                times, status = self.failing.get(method, (0, None))
+                if times:
+                    if times > 1:
+                        self.failing[method] = (times - 1, status)
+                    else:
+                        del self.failing[method]
+                    return status
+        return None
+
+    def add_comments(self, count, username=None):
+        """Adds 'count' new comments to every journal (or just 'username's)"""
+        for journal in self.journals.values():
+            if username is None or journal.username == username:
+                with journal.lock:
+                    journal.comments += count
+
+    def set_comment_state(self, id, state, username=None):
+        """Screens ('S'), deletes ('D') or unscreens ('A') a comment in every journal (or just 'username's)"""
+        for journal in self.journals.values():
+            if username is None or journal.username == username:
+                with journal.lock:
+                    journal.states[id] = state
+
+    # XML-RPC methods
+
+    def __counted(self, name, method):
+        def counted(args=None):
+            self.count(name)
+            if self.chance(self.fault_rate):
+                raise xmlrpclib.Fault(500, 'Server error: injected fault')
+            return method(args or {})
+        return counted
+
+    def __auth(self, args):
+        """Checks a call's credentials, returning the journal it's for"""
+        journal = self.journals.get(args.get('username'))
+        if journal is None:
+            raise xmlrpclib.Fault(100, 'Invalid username')
+        method = args.get('auth_method', 'clear')
+        if method == 'challenge':
+            with self.lock:
+                expires = self.challenges.pop(args.get('auth_challenge'), 0)
+            expected = md5((args.get('auth_challenge', '') +
+                            md5(journal.password.encode('utf-8')).hexdigest()).encode('utf-8')).hexdigest()
+            if expires < time.time() or args.get('auth_response') != expected:
+                raise xmlrpclib.Fault(101, 'Invalid password')
+        elif method == 'clear':
+            if args.get('password') != journal.password and \
+                    args.get('hpassword') != md5(journal.password.encode('utf-8')).hexdigest():
+                raise xmlrpclib.Fault(101, 'Invalid password')
+        else:
+            raise xmlrpclib.Fault(101, 'Invalid password')
+        return journal
+
+    def rpc_getchallenge(self, args):
+        now = int(time.time())
+        challenge = 'c0:%d:%d:60:%s' % (now, self.random.getrandbits(32), md5(str(now).encode()).hexdigest()[:16])
+        with self.lock:
+            self.challenges[challenge] = now + 60
+        return {'auth_scheme': 'c0', 'challenge': challenge, 'server_time': now, 'expire_time': now + 60}
+
+    def rpc_login(self, args):
+        journal = self.__auth(args)
+        response = {'fullname': journal.username.capitalize(),
+                    'userid': mix(journal.seed) % 1000000,
+                    'usejournals': [],
+                    'friendgroups': [{'id': 1, 'name': 'Close friends', 'public': 0, 'sortorder': 5}]}
+        if 'getmoods' in args:
+            response['moods'] = [{'id': id, 'name': name, 'parent': 0} for id, name in enumerate(MOODS, 1)
+                                 if id > int(args['getmoods'] or 0)]
+        if args.get('getpickws'):
+            response['pickws'] = ['default', 'cat']
+            if args.get('getpickwurls'):
+                response['pickwurls'] = ['http://example.com/default.png', 'http://example.com/cat.png']
+        return response
+
+    def rpc_checkfriends(self, args):
+        self.__auth(args)
+        lastupdate = lj_time(EPOCH)
+        return {'lastupdate': lastupdate, 'interval': 90, 'new': int(bool(args.get('lastupdate')) and
+                                                                    args['lastupdate'] < lastupdate)}
+
+    def rpc_consolecommand(self, args):
+        self.__auth(args)
+        return {'results': [{'success': 0, 'output': [['error', 'Not available here']]}
+                            for command in args.get('commands', [])]}
+
+    def rpc_editfriends(self, args):
+        self.__auth(args)
+        return {'added': [{'username': friend[0], 'fullname': friend[0]} for friend in args.get('add', [])]}
+
+    def rpc_friendof(self, args):
+        self.__auth(args)
+        return {'friendofs': []}
+
+    def rpc_getfriends(self, args):
+        self.__auth(args)
+        return {'friends': []}
+
+    def rpc_getfriendgroups(self, args):
+        self.__auth(args)
+        return {'friendgroups': [{'id': 1, 'name': 'Close friends', 'public': 0, 'sortorder': 5}]}
+
+    def rpc_getdaycounts(self, args):
+        journal = self.__auth(args)
+        counts = {}
+        with journal.lock:
+            for entry in journal.entries_since()[0]:
+                day = entry['eventtime'][:10]
+                counts[day] = counts.get(day, 0) + 1
+        return {'daycounts': [{'date': day, 'count': count} for day, count in sorted(counts.items())]}
+
+    def rpc_syncitems(self, args):
+        journal = self.__auth(args)
+        with journal.lock:
+            page, total = journal.entries_since(args.get('lastsync'), self.sync_page)
+        return {'syncitems': [{'item': 'L-%d' % entry['itemid'],
+                               'action': 'update' if entry['synctime'] != entry['eventtime'] else 'create',
+                               'time': entry['synctime']} for entry in page],
+                'count': len(page),
+                'total': total}
+
+    def rpc_getevents(self, args):
+        journal = self.__auth(args)
+        selecttype = args.get('selecttype')
+        with journal.lock:
+            if selecttype == 'syncitems':
+                events = journal.entries_since(args.get('lastsync'), self.events_page)[0]
+            elif selecttype == 'one':
+                itemid = int(args.get('itemid', -1))
+                if itemid == -1:
+                    itemids = journal.itemids()
+                    itemid = itemids[-1] if itemids else 0
+                events = [event for event in [journal.entry(itemid)] if event is not None]
+            elif selecttype == 'lastn':
+                events = [event for event in map(journal.entry, journal.itemids()) if event is not None and
+                          (not args.get('beforedate') or event['eventtime'] < args['beforedate'])]
+                events = events[-min(int(args.get('howmany', 20)), 50):][::-1]
+            elif selecttype == 'day':
+                day = '%04d-%02d-%02d' % (int(args['year']), int(args['month']), int(args['day']))
+                events = [event for event in map(journal.entry, journal.itemids())
+                          if event is not None and event['eventtime'].startswith(day)]
+            else:
+                raise xmlrpclib.Fault(200, 'Missing required argument(s)')
+        return {'events': [dict((key, value) for key, value in event.items() if key != 'synctime')
+                           for event in events]}
+
+    def rpc_postevent(self, args):
+        journal = self.__auth(args)
+        if not args.get('event'):
+            raise xmlrpclib.Fault(200, 'Missing required argument(s)')
+        with journal.lock:
+            itemid = max(journal.itemids() or [0]) + 1
+            synctime = journal.tick()
+            eventtime = '%04d-%02d-%02d %02d:%02d:00' % tuple(int(args.get(key, 0)) for key in
+                                                             ('year', 'mon', 'day', 'hour', 'min'))
+            entry = {'itemid': itemid, 'anum': itemid % 256, 'eventtime': eventtime, 'synctime': synctime,
+                     'event': args['event']}
+            for key in ('subject', 'security', 'allowmask', 'props'):
+                if key in args:
+                    entry[key] = args[key]
+            journal.changed[itemid] = entry
+        return {'itemid': itemid, 'anum': entry['anum'],
+                'url': 'http://%s.example.com/%d.html' % (journal.username, itemid * 256 + entry['anum'])}
+
+    def rpc_editevent(self, args):
+        journal = self.__auth(args)
+        itemid = int(args.get('itemid', 0))
+        with journal.lock:
+            entry = journal.entry(itemid)
+            if entry is None:
+                raise xmlrpclib.Fault(302, 'Can\'t edit post: no such item')
+            if not args.get('event'):
+                journal.changed[itemid] = None
+                return {'itemid': itemid}
+            entry = dict(entry)
+            for key in ('event', 'subject', 'security', 'allowmask', 'props'):
+                if key in args:
+                    entry[key] = args[key]
+            entry['synctime'] = journal.tick()
+            journal.changed[itemid] = entry
+        return {'itemid': itemid, 'anum': entry['anum']}
+
+    def rpc_sessiongenerate(self, args):
+        journal = self.__auth(args)
+        with self.lock:
+            id = len(self.sessions) + 1
+            session = 'ws:%s:%d:%08x' % (journal.username, id, self.random.getrandbits(32))
+            self.sessions[session] = journal
+        return {'ljsession': session}
+
+    def rpc_sessionexpire(self, args):
+        journal = self.__auth(args)
+        with self.lock:
+            for session in list(self.sessions):
+                expire = [str(expire) for expire in args.get('expire', [])]
+                if self.sessions[session] is journal and (args.get('expireall') or session in expire or
+                                                          session.split(':')[2] in expire):
+                    del self.sessions[session]
+        return {}
+
+    # export_comments.bml
+
+    def export_comments(self, query, session):
+        """Returns the body of an export_comments.bml page, or None if the session isn't valid"""
+        with self.lock:
+            journal = self.sessions.get(session)
+        if journal is None:
+            return None
+        startid = max(1, int(query.get('startid', ['0'])[0]))
+        with journal.lock:
+            maxid = journal.comments
+            if query.get('get', [''])[0] == 'comment_meta':
+                self.count('comment_meta')
+                return self.__comment_meta(journal, startid, maxid)
+            self.count('comment_body')
+            return self.__comment_body(journal, startid, maxid)
+
+    def __comment_meta(self, journal, startid, maxid):
+        lines = ["<?xml version='1.0' encoding='utf-8'?>", '<livejournal>', '<maxid>%d</maxid>' % maxid,
+                 '<comments>']
+        posters = set()
+        for id in range(startid, min(maxid, startid + self.meta_page - 1) + 1):
+            posterid, state = journal.comment_meta(id)
+            posters.add(posterid)
+            lines.append("<comment id='%d' posterid='%d'%s />"
+                         % (id, posterid, " state='%s'" % state if state != 'A' else ''))
+        lines.append('</comments>')
+        lines.append('<usermaps>')
+        for posterid in sorted(posters):
+            if posterid:
+                lines.append("<usermap id='%d' user='%s' />" % (posterid, journal.username_of(posterid)))
+        lines.append('</usermaps>')
+        lines.append('</livejournal>')
+        return '\n'.join(lines).encode('utf-8')
+
+    def __comment_body(self, journal, startid, maxid):
+        lines = ["<?xml version='1.0' encoding='utf-8'?>", '<livejournal>', '<comments>']
+        for id in range(startid, min(maxid, startid + self.body_page - 1) + 1):
+            jitemid, parentid, posterid, state, subject, body, date = journal.comment(id)
+            attributes = "id='%d' jitemid='%d' posterid='%d'" % (id, jitemid, posterid)
+            if parentid:
+                attributes += " parentid='%d'" % parentid
+            if state != 'A':
+                attributes += " state=%s" % quoteattr(state)
+            parts = ['<comment %s>' % attributes]
+            if subject:
+                parts.append('<subject>%s</subject>' % escape(subject))
+            if body:
+                parts.append('<body>%s</body>' % escape(body))
+            parts.append('<date>%s</date>' % date)
+            parts.append('</comment>')
+            lines.append(''.join(parts))
+        lines.append('</comments>')
+        lines.append('</livejournal>')
+        return '\n'.join(lines).encode('utf-8')
+
+
+class FakeHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, every reply waits on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def __misbehave(self):
+        """Applies the server's latency and injected failures; returns True if the request is dealt with"""
+        fake = self.server.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.chance(fake.drop_rate):
+            self.close_connection = True
+            return True
+        if fake.chance(fake.error_rate):
+            self.__reply(503, b'Service temporarily unavailable', 'text/plain', {'Retry-After': '1'})
+            return True
+        return False
+
+    def __reply(self, status, body, content_type='text/xml', headers=None):
+        if self.server.fake.gzip and 'gzip' in self.headers.get('Accept-Encoding', '') and body:
+            body = _gzip.compress(body)
+            headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.__misbehave():
+            return
+        if urlsplit(self.path).path != '/interface/xmlrpc':
+            self.__reply(404, b'Not found', 'text/plain')
+            return
+        status = self.server.fake.failure(data)
+        if status is not None:
+            self.__reply(status, b'Injected failure', 'text/plain', {'Retry-After': '1'})
+            return
+        self.__reply(200, self.server.fake.dispatcher._marshaled_dispatch(data))
+
+    def do_GET(self):
+        if self.__misbehave():
+            return
+        parts = urlsplit(self.path)
+        if parts.path != '/export_comments.bml':
+            self.__reply(404, b'Not found', 'text/plain')
+            return
+        session = None
+        for cookie in self.headers.get('Cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == 'ljsession':
+                session = value
+        body = self.server.fake.export_comments(parse_qs(parts.query), session)
+        if body is None:
+            self.__reply(403, b'Invalid session', 'text/plain')
+        else:
+            self.__reply(200, body)
+
+
+def __dispatch():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('--entries', type='int', default=100, help="Entries per journal (default 100)")
+    parser.add_option('--comments', type='int', default=1000, help="Comments per journal (default 1000)")
+    parser.add_option('-u', dest='users', action='append', default=[],
+                      help="An account, as username:password; may be given more than once (default test:test)")
+    parser.add_option('--seed', type='int', default=0, help="Seed for the generated journals")
+    parser.add_option('--latency', type='float', default=0, help="Seconds to delay every request by")
+    parser.add_option('--gzip', action='store_true', default=False, help="Gzip responses")
+    parser.add_option('--error-rate', dest='error_rate', type='float', default=0,
+                      help="Fraction of requests to answer with HTTP 503")
+    parser.add_option('--fault-rate', dest='fault_rate', type='float', default=0,
+                      help="Fraction of XML-RPC calls to answer with a fault")
+    parser.add_option('--drop-rate', dest='drop_rate', type='float', default=0,
+                      help="Fraction of connections to drop without answering")
+    parser.add_option('--no-multicall', dest='multicall', action='store_false', default=True,
+                      help="Don't offer system.multicall")
+    parser.add_option('--port', type='int', default=8080, help="Port to listen on (default 8080)")
+    options, args = parser.parse_args()
+    users = dict(user.split(':', 1) for user in options.users) or None
+    fake = FakeLJServer(options.entries, options.comments, users, options.seed, latency=options.latency,
+                        gzip=options.gzip, error_rate=options.error_rate, fault_rate=options.fault_rate,
+                        drop_rate=options.drop_rate, multicall=options.multicall, port=options.port)
+    print("Serving a fake LiveJournal at %s" % fake.url)
+    try:
+        fake.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.httpd.server_close()
+        print(fake.calls)
+
+if __name__ == "__main__":
+    __dispatch()
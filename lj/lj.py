@@ -21,25 +21,400 @@ try:
 except ImportError:
     import xmlrpclib
 try:
-    import urllib.request as urllib2
+    import http.client as httplib
 except ImportError:
-    import urllib2
-import io
-import gzip
+    import httplib
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+import functools
 import datetime
-from xml.dom.minidom import parse
+import re
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import XMLPullParser
+try:
+    from .transport import ConnectionPool, DecodedResponse
+    from .records import Entry, Comment, Lazy
+except ImportError:
+    from transport import ConnectionPool, DecodedResponse
+    from records import Entry, Comment, Lazy
+
+
+# The server LJServer talks to unless told otherwise
+DEFAULT_HOST = 'https://www.livejournal.com/'
 
 
 class LJException(Exception):
     pass
 
 
+class LJRateLimited(LJException):
+    """The server turned a request away for coming too fast (HTTP 429 or 503)
+    retry_after: the seconds the server asked us to wait, if it said, otherwise None
+    """
+
+    def __init__(self, message, retry_after=None):
+        LJException.__init__(self, message)
+        self.retry_after = retry_after
+
+
+# HTTP statuses LJ (or whatever's in front of it) uses to say "slow down"
+RATE_LIMIT_STATUSES = (429, 503)
+
+# Methods that only read (or, like sessionexpire, change nothing when repeated), so the connection
+# pool may send them again if a kept-alive connection drops before their response arrives
+IDEMPOTENT_METHODS = frozenset(['getchallenge', 'login', 'checkfriends', 'friendof', 'getdaycounts', 'getevents',
+                                'getfriendgroups', 'getfriends', 'syncitems', 'sessionexpire'])
+# Matches the method names in a request body, including each call in a system.multicall
+REQUEST_METHODS = re.compile(br'>LJ\.XMLRPC\.(\w+)<')
+
+# How servers word the fault for a method they don't have, such as system.multicall (-32601 is the
+# code the XML-RPC fault interoperability spec gives "requested method not found")
+UNKNOWN_METHOD_CODE = -32601
+UNKNOWN_METHOD = re.compile(r'not supported|not found|unknown method|no such method|failed to locate method', re.I)
+
+# The longest subject LJ accepts, in characters
+SUBJECT_LENGTH = 100
+
+# HTTP statuses an export page is refused with when its session cookie isn't (or is no longer) valid
+SESSION_REJECTED_STATUSES = (401, 403)
+
+
+def retry_after(headers):
+    """Returns the Retry-After header from 'headers' in seconds, or None"""
+    for name, value in (headers or {}).items():
+        if name.lower() == 'retry-after':
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def post_subject(subject):
+    """Returns the subject postevent sends for 'subject': no more than SUBJECT_LENGTH characters"""
+    return subject[:SUBJECT_LENGTH] if subject else subject
+
+
+def unknown_method(fault):
+    """Returns whether 'fault' says the method called doesn't exist, rather than that it failed"""
+    return fault.faultCode == UNKNOWN_METHOD_CODE or bool(UNKNOWN_METHOD.search(str(fault.faultString)))
+
+
+def lj_error(error):
+    """Wraps an xmlrpclib.Error in an LJException, or an LJRateLimited if that's what it was"""
+    if isinstance(error, xmlrpclib.ProtocolError) and error.errcode in RATE_LIMIT_STATUSES:
+        return LJRateLimited(error, retry_after(error.headers))
+    return LJException(error)
+
+
+def error_class(error):
+    """Names the kind of failure an exception from a request represents, for instrumentation:
+    'fault' (an XML-RPC fault, such as a bad password), 'rate_limited' (HTTP 429 or 503),
+    'http' (any other unexpected HTTP status), 'network' (connection errors and timeouts),
+    or the exception's class name for anything else
+    """
+    if isinstance(error, LJRateLimited):
+        return 'rate_limited'
+    if isinstance(error, LJException) and error.args and isinstance(error.args[0], Exception):
+        error = error.args[0]
+    if isinstance(error, xmlrpclib.Fault):
+        return 'fault'
+    if isinstance(error, xmlrpclib.ProtocolError):
+        return 'rate_limited' if error.errcode in RATE_LIMIT_STATUSES else 'http'
+    if isinstance(error, (IOError, httplib.HTTPException)):
+        return 'network'
+    if isinstance(error, LJException) and str(error).startswith('HTTP error'):
+        return 'http'
+    return error.__class__.__name__
+
+
+def decode_text(value):
+    """Decodes base64 text an LJ response carried as bytes: to str, or left as bytes if it isn't UTF-8"""
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value
+
+
+def fast_loads(data):
+    """Like xmlrpclib.loads with use_builtin_types (as LJServer's fast_decode uses); returns just the params"""
+    return xmlrpclib.loads(data, use_builtin_types=True)[0]
+
+
 class LJTransport(xmlrpclib.Transport):
-    pass
+    """XML-RPC transport that sends its requests over a (possibly shared) ConnectionPool,
+    so it can safely be used from several threads at once
 
+    fast_decode: decode responses into builtin types (bytes and datetime.datetime) rather than
+        xmlrpclib.Binary and DateTime
 
-class LJSafeTransport(xmlrpclib.SafeTransport):
-    pass
+    on_response, if set, is called with each PooledResponse once it has been read and closed.
+    on_parse, if set, is called with the seconds spent parsing each response (not counting the
+    time spent waiting for it to arrive).
+    """
+
+    scheme = 'http'
+    on_response = None
+    on_parse = None
+
+    def __init__(self, pool=None, fast_decode=False):
+        xmlrpclib.Transport.__init__(self, use_builtin_types=fast_decode)
+        self.pool = pool or ConnectionPool()
+        self.fast_decode = fast_decode
+
+    def request(self, host, handler, request_body, verbose=False):
+        headers = {'Content-Type': 'text/xml',
+                   'User-Agent': self.user_agent,
+                   'Accept-Encoding': 'gzip'}
+        methods = REQUEST_METHODS.findall(request_body)
+        idempotent = bool(methods) and all(method.decode('ascii') in IDEMPOTENT_METHODS for method in methods)
+        response = self.pool.request('POST', '%s://%s%s' % (self.scheme, host, handler), request_body, headers,
+                                     idempotent=idempotent)
+        try:
+            if response.status != 200:
+                raise xmlrpclib.ProtocolError(host + handler, response.status, response.reason,
+                                              dict(response.getheaders()))
+            self.verbose = verbose
+            return self.parse_response(response)
+        finally:
+            response.close()
+            if self.on_response is not None:
+                self.on_response(response)
+
+    def parse_response(self, response):
+        if self.on_parse is None:
+            return xmlrpclib.Transport.parse_response(self, response)
+        stream = DecodedResponse(response, response.getheader('Content-Encoding', ''))
+        parser, unmarshaller = self.getparser()
+        parsing = 0
+        while True:
+            data = stream.read(65536)
+            started = time.perf_counter()
+            if not data:
+                parser.close()
+                result = unmarshaller.close()
+                self.on_parse(parsing + time.perf_counter() - started)
+                return result
+            parser.feed(data)
+            parsing += time.perf_counter() - started
+
+
+class LJSafeTransport(LJTransport):
+    scheme = 'https'
+
+
+def challenge_auth(challenge, password):
+    """Returns the auth_* arguments that answer 'challenge' for the given password"""
+    return {'auth_method': 'challenge',
+            'auth_challenge': challenge,
+            'auth_response': md5(
+                (challenge + md5(
+                    password.encode('ascii')).hexdigest()).encode('ascii')).hexdigest(),
+            }
+
+
+class ChallengePool:
+    """A stock of prefetched auth challenges, so authenticated calls don't each need their own
+    getchallenge round trip first.
+
+    fetch: callable taking a count and returning a list of getchallenge responses
+    size: how many challenges to hold after a refill
+    low_water: refill once fewer than this many usable challenges are left
+    margin: seconds before a challenge's expiry at which it is no longer handed out
+    background: refill from a daemon thread rather than on the thread asking for a challenge
+
+    Every challenge is handed out exactly once.  Lifetimes are worked out from the server's own
+    expire_time - server_time and applied to the local clock, so clock skew doesn't matter.
+    """
+
+    def __init__(self, fetch, size=10, low_water=3, margin=5, background=False):
+        self.fetch = fetch
+        self.size = size
+        self.low_water = min(low_water, size)
+        self.margin = margin
+        self.challenges = collections.deque()
+        self.lock = threading.Lock()
+        self.wanted = threading.Event()
+        self.closed = False
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self.__run, name='lj-challenges')
+            self.thread.daemon = True
+            self.thread.start()
+            self.wanted.set()
+
+    def __len__(self):
+        with self.lock:
+            self.__discard_expired()
+            return len(self.challenges)
+
+    def __discard_expired(self):
+        now = time.time()
+        while self.challenges and self.challenges[0][1] <= now:
+            self.challenges.popleft()
+
+    def __fetch(self, wanted):
+        """Fetches 'wanted' challenges, without holding the lock, and returns them as (challenge, usable until)
+        A challenge stops being handed out 'margin' seconds before it expires, or halfway through its
+        life if that's shorter than 'margin', so a pool never hands out one that has already expired.
+        """
+        fetched = time.time()
+        challenges = []
+        for challenge in self.fetch(wanted):
+            lifetime = int(challenge['expire_time']) - int(challenge['server_time'])
+            if lifetime > 0:
+                challenges.append((challenge['challenge'], fetched + lifetime - min(self.margin, lifetime / 2.0)))
+        return challenges
+
+    def __merge(self, challenges):
+        self.challenges.extend(challenges)
+        if len(self.challenges) > 1:
+            # Refills running at once may finish out of order
+            self.challenges = collections.deque(sorted(self.challenges, key=lambda challenge: challenge[1]))
+        self.__discard_expired()
+
+    def __take(self):
+        challenge = self.challenges.popleft()[0]
+        if self.thread is not None and len(self.challenges) < self.low_water:
+            self.wanted.set()
+        return challenge
+
+    def get(self):
+        """Returns an unused challenge string, fetching more from the server if the pool has run low
+        The lock isn't held while fetching, so other callers can carry on using what's left meanwhile.
+        """
+        with self.lock:
+            self.__discard_expired()
+            if self.challenges and (self.thread is not None or len(self.challenges) >= self.low_water):
+                return self.__take()
+            wanted = self.size - len(self.challenges)
+        challenges = self.__fetch(max(wanted, 1))
+        with self.lock:
+            self.__merge(challenges)
+            if not self.challenges:
+                raise LJException('The server returned no usable challenges')
+            return self.__take()
+
+    def close(self):
+        """Stops the background refill thread, if there is one, and drops any held challenges"""
+        self.closed = True
+        self.wanted.set()
+        with self.lock:
+            self.challenges.clear()
+
+    def __run(self):
+        while not self.closed:
+            self.wanted.wait(self.margin)
+            if self.closed:
+                break
+            self.wanted.clear()
+            with self.lock:
+                self.__discard_expired()
+                if len(self.challenges) >= self.low_water:
+                    continue
+                wanted = self.size - len(self.challenges)
+            try:
+                challenges = self.__fetch(wanted)
+            except (LJException, xmlrpclib.Error, IOError):
+                # get() falls back to fetching on the calling thread; try again next time round
+                continue
+            with self.lock:
+                if not self.closed:
+                    self.__merge(challenges)
+
+
+class LJBatchCall:
+    """The eventual outcome of a call queued on an LJBatch
+
+    sent, once the batch has been executed, says whether the call reached the server: True if it
+    was answered (with a response or a fault), False if it was never sent (fetching challenges for
+    the batch failed, or, on a server without multicall, an earlier call failed first), and None
+    if the request failed on the way, so that the server may or may not have carried it out.
+    """
+
+    def __init__(self, methodname, arguments, finish=None):
+        self.methodname = methodname
+        self.arguments = arguments
+        self.finish = finish
+        self.done = False
+        self.sent = None
+        self.response = None
+        self.error = None
+
+    def result(self):
+        """Returns what the LJServer method would have returned, or raises the LJException it would have raised"""
+        if not self.done:
+            raise LJException('Batch has not been executed yet')
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class LJBatch:
+    """Queues calls to an LJServer and sends them to the server together, as system.multicall requests
+
+    Get one from LJServer.batch() and call the usual LJServer methods on it.  Each call returns an
+    LJBatchCall straight away; the calls are actually made when the batch is executed, which happens
+    automatically at the end of a with block:
+
+        with server.batch() as b:
+            first = b.getevents_one(1)
+            last = b.getevents_one(-1)
+        print(first.result(), last.result())
+
+    size: the most calls to send in a single multicall request
+
+    Servers that don't understand system.multicall get the calls one after another instead.
+    login and getchallenge can't be batched.
+    """
+
+    methods = ('checkfriends', 'consolecommand', 'delevent', 'editfriends', 'friendof', 'getdaycounts',
+               'getevents_one', 'getevents_lastn', 'getevents_day', 'getevents_syncitems', 'getfriends',
+               'getfriendgroups', 'postevent', 'sessiongenerate', 'sessionexpire', 'syncitems')
+
+    def __init__(self, server, size=50):
+        self.server = server
+        self.size = size
+        self.calls = []
+        self.results = None
+
+    def __getattr__(self, name):
+        if name not in self.methods:
+            raise AttributeError("'%s' can't be called in a batch" % name)
+        method = getattr(self.server, name)
+
+        def queue(*args, **kwds):
+            return self.server._queue(self, method, args, kwds)
+        queue.__doc__ = method.__doc__
+        return queue
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def execute(self):
+        """Sends every queued call to the server
+        Returns a list, in the order the calls were queued, holding each call's result or the
+        LJException it raised.  The same list is kept as self.results.
+        If a request fails on the way, each of its calls gets the error (see LJBatchCall.sent for
+        whether it reached the server) and the error is raised; calls in later requests aren't made.
+        """
+        calls, self.calls = self.calls, []
+        for start in range(0, len(calls), self.size):
+            self.server._execute(calls[start:start + self.size])
+        self.results = [call.error if call.error is not None else call.response for call in calls]
+        return self.results
 
 
 class LJServer:
@@ -53,17 +428,54 @@ class LJServer:
         it is assumed everything on this server is in the same location as it is on
         livejournal.com.
     ssl: Transport/SafeTransport for http/s
+    pool: a transport.ConnectionPool to make requests through; pass the same pool to several servers
+        to share kept-alive connections between them.  Defaults to a pool of this server's own.
+    fast_decode: decode responses into builtin types: base64 values become bytes and dates
+        datetime.datetime, rather than xmlrpclib.Binary and DateTime wrappers.
+
+    limiter: a ratelimit.RequestLimiter every request waits on, for its host and method; pass the same
+        limiter to several servers to limit them together
+    concurrency: a ratelimit.AdaptiveConcurrency limiting how many requests are in flight at once
+        (again, possibly shared between servers).  Rate limit responses, network errors and slow
+        responses lower the limit; prompt answers raise it.
+
+    metrics: a metrics.Instrumentation (such as a metrics.Metrics) told about every request: its
+        method, time taken, bytes sent and received, retries, parse time, the time spent getting
+        challenges, and the class of error when one fails.  Without it nothing is timed.
+
+    login_cache: a logincache.LoginCache; login() then only asks for moods newer than the ones
+        cached, and reuses cached userpic keywords and menus until they expire.
+    sessions: a sessions.SessionManager.  Comment export requests made without a session cookie
+        then share its cached cookie instead of generating one each, and if the server rejects the
+        cookie they're retried, once, with a new one.
+
+    bytes_read counts the (still compressed) bytes of every response received so far.
+
+    Rate limit responses (HTTP 429 or 503) are raised as LJRateLimited, a kind of LJException.
 
     All data transmitted should be in UTF-8.  All data received WILL be in UTF-8.
     """
 
-    def __init__(self, clientversion, user_agent, host='https://www.livejournal.com/', ssl=False):
+    def __init__(self, clientversion, user_agent, host=DEFAULT_HOST, ssl=False, pool=None,
+                 fast_decode=False, limiter=None, concurrency=None, metrics=None, login_cache=None,
+                 sessions=None):
+        self.pool = pool or ConnectionPool()
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.hostname = urlsplit(host).hostname
         if ssl:
-            transport = LJSafeTransport()
+            transport = LJSafeTransport(self.pool, fast_decode)
         else:
-            transport = LJTransport()
+            transport = LJTransport(self.pool, fast_decode)
 
         transport.user_agent = user_agent
+        transport.on_response = self.__received
+        if metrics is not None:
+            transport.on_parse = self.__parsed
+        self.metrics = metrics
+        self.measuring = threading.local()
+        self.login_cache = login_cache
+        self.sessions = sessions
         self.user_agent = user_agent
         self.host = host
         self.server = xmlrpclib.ServerProxy(host + 'interface/xmlrpc', transport)
@@ -73,6 +485,23 @@ class LJServer:
         self.password = None
         self.lastupdate = None
         self.valid = {}
+        self.challenges = None
+        self.multicall_supported = None
+        self.batching = threading.local()
+        self.bytes_read = 0
+        self.bytes_lock = threading.Lock()
+
+    def __received(self, response, method=None):
+        with self.bytes_lock:
+            self.bytes_read += response.bytes_read
+        if self.metrics is not None:
+            method = method or self.measuring.method
+            self.metrics.on_bytes(method, response.bytes_sent, response.bytes_read)
+            if response.retries:
+                self.metrics.on_retry(method, response.retries)
+
+    def __parsed(self, seconds):
+        self.metrics.on_parse(self.measuring.method, seconds)
 
     def __request(self, methodname, args):
         """__request(methodname, arguments)
@@ -82,25 +511,216 @@ class LJServer:
         """
         method = getattr(self.server.LJ.XMLRPC, methodname)
 
-        response = method(args)
+        response = self.__send([methodname], method, args)
+        return response
+
+    def __send(self, methodnames, send, *args):
+        """__send(methodnames, send, *args)
+        Internal function that calls send(*args) to make a request for the named methods, once the
+        limiter and the concurrency controller allow it, and reports it to self.metrics.
+        """
+        if self.limiter is not None:
+            for methodname in methodnames:
+                self.limiter.acquire(self.hostname, methodname)
+        if self.metrics is None:
+            return self.__send_limited(send, *args)
+        method = self.measuring.method = methodnames[0] if len(methodnames) == 1 else 'system.multicall'
+        started = time.perf_counter()
+        try:
+            response = self.__send_limited(send, *args)
+        except Exception as v:
+            self.metrics.on_request(method, time.perf_counter() - started, error_class(v))
+            raise
+        self.metrics.on_request(method, time.perf_counter() - started)
+        return response
+
+    def __send_limited(self, send, *args):
+        if self.concurrency is None:
+            return send(*args)
+        started = self.concurrency.acquire()
+        ok = False
+        try:
+            response = send(*args)
+            ok = True
+            return response
+        except xmlrpclib.ProtocolError:
+            raise
+        except xmlrpclib.Error:
+            # The server answered, just not with what we wanted
+            ok = True
+            raise
+        finally:
+            self.concurrency.release(started, ok)
+
+    def __multicall(self, calls):
+        """__multicall(calls)
+        Internal function that submits several requests in a single system.multicall round trip.
+        calls is a list of (methodname, args) tuples
+        Returns a list holding, in order, either each response or the xmlrpclib.Fault it raised.
+        If the server says it has no system.multicall, the calls are sent one at a time instead
+        (and multicall isn't tried again); any other fault for the multicall as a whole is raised,
+        like an error from a single call.  One at a time, if a call fails other than with a fault,
+        the list ends with the exception it raised, and the calls after it aren't sent; those before
+        it were carried out, so the list still says how they went.  The calls aren't pipelined: each
+        waits for the one before it to be answered, so that none is sent after one has failed.
+        """
+        if self.multicall_supported is not False and len(calls) > 1:
+            try:
+                responses = self.__send(
+                    [methodname for methodname, args in calls], self.server.system.multicall,
+                    [{'methodName': 'LJ.XMLRPC.' + methodname, 'params': [args]} for methodname, args in calls])
+            except xmlrpclib.Fault as v:
+                if not unknown_method(v):
+                    raise
+                self.multicall_supported = False
+            else:
+                self.multicall_supported = True
+                return [r[0] if isinstance(r, list) else xmlrpclib.Fault(r['faultCode'], r['faultString'])
+                        for r in responses]
+        results = []
+        for methodname, args in calls:
+            try:
+                results.append(self.__request(methodname, args))
+            except xmlrpclib.Fault as v:
+                results.append(v)
+            except (xmlrpclib.Error, IOError, httplib.HTTPException) as v:
+                results.append(v)
+                break
+        return results
+
+    def __getchallenges(self, count):
+        started = time.perf_counter()
+        try:
+            challenges = self.__multicall([('getchallenge', {})] * count)
+        except xmlrpclib.Error as v:
+            raise lj_error(v)
+        if self.metrics is not None:
+            self.metrics.on_challenge(time.perf_counter() - started)
+        for challenge in challenges:
+            if isinstance(challenge, xmlrpclib.Error):
+                raise lj_error(challenge)
+            if isinstance(challenge, Exception):
+                raise challenge
+        return challenges
+
+    def enable_challenge_pool(self, size=10, low_water=3, background=False):
+        """Starts keeping a pool of prefetched challenges for authenticating requests
+        Without it every authenticated call costs two round trips: one for getchallenge, one for the
+        call itself.  With it, challenges are fetched 'size' at a time (in one round trip, if the server
+        supports system.multicall) whenever fewer than 'low_water' are left.  If 'background' is
+        true the refills happen on a separate thread, so callers normally never wait for them.
+        Returns the ChallengePool.
+        """
+        self.disable_challenge_pool()
+        self.challenges = ChallengePool(self.__getchallenges, size=size, low_water=low_water, background=background)
+        return self.challenges
+
+    def disable_challenge_pool(self):
+        """Goes back to fetching a fresh challenge for every authenticated call"""
+        if self.challenges is not None:
+            self.challenges.close()
+            self.challenges = None
+
+    def __call(self, methodname, arguments, finish=None):
+        """__call(methodname, arguments, finish)
+        Internal function that makes a request on behalf of one of the protocol methods below, or queues
+        it if that method was called through an LJBatch.
+        finish, if given, turns the raw response into what the method returns.
+        """
+        batch = getattr(self.batching, 'batch', None)
+        if batch is not None:
+            call = LJBatchCall(methodname, arguments, finish)
+            batch.calls.append(call)
+            return call
+        try:
+            response = self.__request(methodname, arguments)
+        except xmlrpclib.Error as v:
+            raise lj_error(v)
+        if finish is not None:
+            response = finish(response)
         return response
 
+    def batch(self, size=50):
+        """Returns an LJBatch, which sends calls made through it to the server together
+        size is the most calls to send in a single multicall request.
+        """
+        return LJBatch(self, size)
+
+    def _queue(self, batch, method, args, kwds):
+        self.batching.batch = batch
+        try:
+            return method(*args, **kwds)
+        finally:
+            self.batching.batch = None
+
+    def _execute(self, calls):
+        """Runs a list of LJBatchCalls, authenticating them all with challenges fetched together
+        Every call is done afterwards, with a response or an error, even if this raises.
+        """
+        try:
+            if self.challenges is not None:
+                challenges = [self.challenges.get() for call in calls]
+            else:
+                challenges = [challenge['challenge'] for challenge in self.__getchallenges(len(calls))]
+        except (LJException, xmlrpclib.Error, IOError, httplib.HTTPException) as v:
+            error = lj_error(v) if isinstance(v, xmlrpclib.Error) else v
+            for call in calls:
+                call.error = error
+                call.sent = False
+                call.done = True
+            raise error
+        for call, challenge in zip(calls, challenges):
+            call.arguments.update(challenge_auth(challenge, self.password))
+        try:
+            responses = self.__multicall([(call.methodname, call.arguments) for call in calls])
+        except (xmlrpclib.Error, IOError, httplib.HTTPException) as v:
+            error = lj_error(v) if isinstance(v, xmlrpclib.Error) else v
+            for call in calls:
+                call.error = error
+                call.done = True
+            raise error
+        failure = None
+        for number, call in enumerate(calls):
+            if number >= len(responses):
+                call.error = LJException('Not sent, since an earlier call in the batch failed')
+                call.sent = False
+            elif isinstance(responses[number], xmlrpclib.Fault):
+                call.error = LJException(responses[number])
+                call.sent = True
+            elif isinstance(responses[number], Exception):
+                # Sent one at a time, and this one failed on the way
+                failure = call.error = lj_error(responses[number]) \
+                    if isinstance(responses[number], xmlrpclib.Error) else responses[number]
+            else:
+                call.response = responses[number] if call.finish is None else call.finish(responses[number])
+                call.sent = True
+            call.done = True
+        if failure is not None:
+            raise failure
+
     def __loggedin(self):
         if self.user is None or self.password is None:
             raise LJException('Must be logged in to access LiveJournal')
 
     def __headers(self):
         self.__loggedin()
-        challenge = self.getchallenge()
         args = {'ver': 1,
                 'clientversion': self.clientversion,
-                'auth_method': 'challenge',
-                'auth_challenge': challenge['challenge'],
-                'auth_response': md5(
-                    (challenge['challenge'] + md5(
-                        self.password.encode('ascii')).hexdigest()).encode('ascii')).hexdigest(),
                 'username': self.user,
                 }
+        if getattr(self.batching, 'batch', None) is None:
+            # batched calls are authenticated when the batch is sent
+            if self.challenges is not None:
+                challenge = self.challenges.get()
+            else:
+                started = time.perf_counter()
+                try:
+                    challenge = self.getchallenge()['challenge']
+                except xmlrpclib.Error as v:
+                    raise lj_error(v)
+                if self.metrics is not None:
+                    self.metrics.on_challenge(time.perf_counter() - started)
+            args.update(challenge_auth(challenge, self.password))
         return args
 
     def login(self, user, password, getmoods=None, getmenus=None, getpickws=None, getpickwurls=None):
@@ -108,7 +728,8 @@ class LJServer:
         Requires username and password.
         Optional arguments are:
             getmoods - send the id of the highest mood the client has cached (LJ *really* wants
-                you to cache this.
+                you to cache this.  With a login_cache, it does: send 0, and only moods newer than
+                the cached ones are downloaded, though 'moods' still lists them all.)
             getmenus - send something (they don't care what)
             getpickws - send something
             getpickwurls - send something, must have set getpickws
@@ -150,28 +771,68 @@ class LJServer:
         The class appropriates a few bits of this data for use in validating input to other methods.  Because
         of this if any changes are made to data on LJ servers (e.g. adding posting access to other journals,
         or changing userpic keywords) via another client or the web interface, they won't affect the class
-        until login is run again.
+        until login is run again (or, with a login_cache, until the cached keywords expire).
         """
         if self.valid:
             self.valid = {}
         self.user = user
         self.password = password
         arguments = self.__headers()
-        if getmoods:
-            arguments['getmoods'] = getmoods
-        if getmenus:
-            arguments['getmenus'] = getmenus
-        if getpickws:
-            arguments['getpickws'] = getpickws
-        if getpickwurls:
-            arguments['getpickwurls'] = getpickwurls
+        finish = self.__login_done
+        if self.login_cache is not None:
+            finish = self.__cached_login(arguments, user, getmoods, getmenus, getpickws, getpickwurls)
+        else:
+            if getmoods:
+                arguments['getmoods'] = getmoods
+            if getmenus:
+                arguments['getmenus'] = getmenus
+            if getpickws:
+                arguments['getpickws'] = getpickws
+            if getpickwurls:
+                arguments['getpickwurls'] = getpickwurls
 
         try:
-            response = self.__request('login', arguments)
-        except xmlrpclib.Error as v:
+            return self.__call('login', arguments, finish)
+        except LJException:
             self.user = None
             self.password = None
-            raise LJException(v)
+            raise
+
+    def __cached_login(self, arguments, user, getmoods, getmenus, getpickws, getpickwurls):
+        """__cached_login(arguments, user, getmoods, getmenus, getpickws, getpickwurls)
+        Internal function that fills in login arguments with the help of self.login_cache: moods are
+        asked for from the highest one cached, and metadata that's still fresh in the cache isn't
+        asked for at all.  Returns the function that completes the response from the cache.
+        """
+        cache = self.login_cache
+        wanted = [key for key, asked in (('pickws', getpickws), ('pickwurls', getpickws and getpickwurls),
+                                         ('defaultpicurl', getpickws and getpickwurls), ('menus', getmenus))
+                  if asked]
+        stale = [key for key in wanted if not cache.fresh(user, self.host, key)]
+        if getmoods is not None:
+            arguments['getmoods'] = max(int(getmoods or 0), cache.highest_mood(user, self.host))
+        if 'menus' in stale:
+            arguments['getmenus'] = getmenus
+        if 'pickws' in stale or 'pickwurls' in stale:
+            arguments['getpickws'] = getpickws
+            if getpickwurls:
+                arguments['getpickwurls'] = getpickwurls
+
+        fetched = [key for key, argument in (('pickws', 'getpickws'), ('pickwurls', 'getpickwurls'),
+                                             ('defaultpicurl', 'getpickwurls'), ('menus', 'getmenus'))
+                   if arguments.get(argument)]
+
+        def finish(response):
+            cached = cache.update(user, self.host, response, fetched)
+            if getmoods is not None:
+                response['moods'] = cached.get('moods', [])
+            for key in wanted:
+                if key not in response and key in cached:
+                    response[key] = cached[key]
+            return self.__login_done(response)
+        return finish
+
+    def __login_done(self, response):
         if 'usejournals' in response:
             self.valid['usejournals'] = response['usejournals']
         if 'pickws' in response:
@@ -195,10 +856,9 @@ class LJServer:
             arguments['mask'] = mask
         if self.lastupdate is not None:
             arguments['lastupdate'] = self.lastupdate
-        try:
-            response = self.__request('checkfriends', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
+        return self.__call('checkfriends', arguments, self.__checkfriends_done)
+
+    def __checkfriends_done(self, response):
         self.lastupdate = response['lastupdate']
         return response
 
@@ -213,11 +873,7 @@ class LJServer:
         """
         arguments = self.__headers()
         arguments['commands'] = commands
-        try:
-            response = self.__request('consolecommand', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('consolecommand', arguments)
 
     def editevent(self, itemid, event, subject=None, e_datetime=None, security=None, allowmask=None, props=None,
                   usejournal=None, lineendings=None):
@@ -226,11 +882,7 @@ class LJServer:
     def delevent(self, itemid):
         arguments = self.__headers()
         arguments['itemid'] = itemid
-        try:
-            response = self.__request('editevent', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('editevent', arguments)
 
     def editfriendgroups(self, groupmasks, set=None, delete=None):
         pass
@@ -254,11 +906,7 @@ class LJServer:
             arguments['add'] = friends
         elif delete:
             arguments['delete'] = friends
-        try:
-            response = self.__request('editfriends', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('editfriends', arguments)
 
     def friendof(self, limit=None):
         """Fetches a list of users who list the logged in user as their friend
@@ -273,11 +921,7 @@ class LJServer:
         arguments = self.__headers()
         if limit:
             arguments['friendoflimit'] = limit
-        try:
-            response = self.__request('friendof', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('friendof', arguments)
 
     def getchallenge(self):
         """Fetches a challenge for auth_challenge
@@ -307,11 +951,7 @@ class LJServer:
         arguments = self.__headers()
         if usejournal and usejournal in self.valid['usejournals']:
             arguments['usejournal'] = usejournal
-        try:
-            response = self.__request('getdaycounts', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('getdaycounts', arguments)
 
     def _getevents(self, **kwds):
         """Fetches a number of entries from the server
@@ -322,7 +962,8 @@ class LJServer:
          truncate - if >=4 returns the entry text truncated to (truncate-3) in length, plus '...'.
          prefersubject - if true no subjects are returned, the event text is the subject if one exists
          noprops - if true no metadata properties are returned
-        Returns: List of dictionaries with keys:
+        Returns: a dictionary whose 'events' key holds a list of records.Entry, which read like
+        dictionaries, with keys:
          itemid - integer item id
          eventtime - time the user posted the entry
          security - 'private' or 'usemask'
@@ -338,10 +979,11 @@ class LJServer:
         # if usejournal and usejournal in self.valid['usejournals']:
         # if truncate and truncate > 4:
 
-        try:
-            response = self.__request('getevents', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
+        return self.__call('getevents', arguments, self.__getevents_done)
+
+    def __getevents_done(self, response):
+        if 'events' in response:
+            response['events'] = [entry_record(event) for event in response['events']]
         return response
 
     def getevents_one(self, itemid=-1, **kwds):
@@ -387,26 +1029,18 @@ class LJServer:
             arguments['friendlimit'] = limit
             if friendof:
                 arguments['friendoflimit'] = limit
-        try:
-            response = self.__request('getfriends', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('getfriends', arguments)
 
     def getfriendgroups(self):
         arguments = self.__headers()
-        try:
-            response = self.__request('getfriendgroups', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('getfriendgroups', arguments)
 
     def postevent(self, event, subject=None, e_datetime=None, props=None, security=None, usejournal=None, lineendings=None):
         """Posts an entry to the server
         Requires:
         event: string - text of the entry
         Optional:
-        subject: string, less than 100 characters long
+        subject: string; LJ takes at most 100 characters, so a longer one is cut short (see post_subject)
         e_datetime: datetime.datetime - date and time of the event, only read up to the minute
         props: dictionaries, with keys as described in http://www.livejournal.com/doc/server/ljp.csp.proplist.html
         lineendings: string ('unix', 'pc', 'mac') - only necessary if using mac line endings
@@ -429,7 +1063,8 @@ class LJServer:
         except AttributeError:
             raise TypeError('e_datetime must be datetime.datetime, or similar')
 
-        if subject and len(subject) <= 100:
+        subject = post_subject(subject)
+        if subject:
             arguments['subject'] = subject
         if props:
             # validate this?
@@ -438,8 +1073,8 @@ class LJServer:
             if security in ('public', 'private'):
                 arguments['security'] = security
             elif security == 'friends':
-                arguments['security'] == 'usemask'
-                arguments['allowmask'] == 1
+                arguments['security'] = 'usemask'
+                arguments['allowmask'] = 1
             else:
                 # Check whether it's referencing a valid group?
                 arguments['security'] = 'usemask'
@@ -451,11 +1086,7 @@ class LJServer:
             arguments['usejournal'] = usejournal
         if lineendings in ('unix', 'pc', 'mac'):
             arguments['lineendings'] = lineendings
-        try:
-            response = self.__request('postevent', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('postevent', arguments)
 
     def sessiongenerate(self, expiration='short', ipfixed=False):
         """Generates a session cookie to use when directly accessing LJ
@@ -469,11 +1100,7 @@ class LJServer:
         arguments['expiration'] = expiration
         if ipfixed:
             arguments['ipfixed'] = 1
-        try:
-            response = self.__request('sessiongenerate', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response['ljsession']
+        return self.__call('sessiongenerate', arguments, lambda response: response['ljsession'])
 
     def sessionexpire(self, expire):
         """Expires previously generated sessions
@@ -489,11 +1116,7 @@ class LJServer:
             if type(expire) == str:
                 expire = [expire, ]
             arguments['expire'] = expire
-        try:
-            response = self.__request('sessionexpire', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return True
+        return self.__call('sessionexpire', arguments, lambda response: True)
 
     def syncitems(self, lastsync=None):
         """Fetches a list of items to synchronise with a local cache
@@ -515,26 +1138,46 @@ class LJServer:
         arguments = self.__headers()
         if lastsync:
             arguments['lastsync'] = lastsync
-        try:
-            response = self.__request('syncitems', arguments)
-        except xmlrpclib.Error as v:
-            raise LJException(v)
-        return response
+        return self.__call('syncitems', arguments)
 
     def __request_with_cookie(self, url, session=None):
+        """__request_with_cookie(url, session)
+        Internal function that fetches a page using a session cookie.
+        Returns a DecodedResponse to read the (decompressed) page from as it arrives; its byte counts
+        are this request's own, while self.bytes_read and self.metrics count every request's.
+        """
         if not session:
-            session = self.sessiongenerate()
-
-        request = urllib2.Request(url)
-        request.add_header('Accept-encoding', 'gzip')
-        request.add_header('User-agent', self.user_agent)
-        request.add_header('Cookie', 'ljsession=' + session)
-        response = urllib2.urlopen(request)
-        data = io.StringIO(response.read().decode('utf8'))
-        response.close()
-        if response.headers.get('content-encoding', '') == 'gzip':
-            data = gzip.GzipFile(fileobj=data, mode='w')
-        return data
+            if self.sessions is not None:
+                session = self.sessions.get(self)
+            else:
+                session = self.sessiongenerate()
+
+        def fetch():
+            headers = {'Accept-encoding': 'gzip, deflate',
+                       'User-agent': self.user_agent,
+                       'Cookie': 'ljsession=' + session}
+            response = self.pool.request('GET', url, headers=headers)
+            if response.status in RATE_LIMIT_STATUSES:
+                response.close()
+                raise LJRateLimited('HTTP error %d %s fetching %s' % (response.status, response.reason, url),
+                                    retry_after(dict(response.getheaders())))
+            return response
+        try:
+            response = self.__send(['export_comments'], fetch)
+            if response.status in SESSION_REJECTED_STATUSES and self.sessions is not None:
+                # The session has expired, or been expired by someone else; try once more with a new one
+                response.close()
+                session = self.sessions.renew(self, session)
+                response = self.__send(['export_comments'], fetch)
+        except (IOError, httplib.HTTPException) as v:
+            raise LJException(v)
+        if response.status != 200:
+            response.close()
+            raise LJException('HTTP error %d %s fetching %s' % (response.status, response.reason, url))
+
+        def transferred(stream):
+            self.__received(response, 'export_comments')
+        return DecodedResponse(response, response.getheader('content-encoding', ''), transferred)
 
     def fetch_comment_meta(self, startid=0, session=None):
         """Fetch comment metadata
@@ -543,7 +1186,8 @@ class LJServer:
 
         arguments:
          startid - The first comment to fetch data for
-         session - A session cookie, if you've already generated one (if not, one will be generated for you)
+         session - A session cookie, if you've already generated one (if not, one will be generated for you,
+            or taken from the server's SessionManager)
 
         returns a dictionary with these keys:
          maxid - The highest comment id; if this is higher than the largest comment id whose
@@ -559,20 +1203,25 @@ class LJServer:
 
         LJ encourages you to cache this data, but it can change occasionally.
         """
-        response = self.__request_with_cookie(
-            self.host + "export_comments.bml?get=comment_meta&startid=%d" % int(startid), session)
-        d = parse(response).getElementsByTagName('livejournal')[0]
-        response.close()
-        data = {'comments': {}, 'usermaps': {}, 'maxid': get_text_from_single(d, 'maxid')}
-        for comment in d.getElementsByTagName('comment'):
-            state = comment.getAttribute('state')
-            if state == '':
-                state = 'A'
-            data['comments'][comment.getAttribute('id')] = (comment.getAttribute('posterid'), state)
-        for usermap in d.getElementsByTagName('usermap'):
-            data['usermaps'][usermap.getAttribute('id')] = usermap.getAttribute('user')
-        d.unlink()
-        return data
+        response = self.__request_with_cookie(comment_meta_url(self.host, startid), session)
+        try:
+            return parse_comment_meta(response)
+        finally:
+            response.close()
+
+    def iter_comment_meta(self, startid=0, session=None):
+        """Like fetch_comment_meta, but a generator that yields the page piece by piece as it's downloaded
+        Yields tuples of (kind, key, value):
+         ('maxid', None, maxid)
+         ('comment', comment id, (posterid, state))
+         ('usermap', posterid, username)
+        """
+        response = self.__request_with_cookie(comment_meta_url(self.host, startid), session)
+        try:
+            for item in iterparse_comment_meta(response):
+                yield item
+        finally:
+            response.close()
 
     def fetch_comment_bodies(self, startid=0, session=None):
         """Fetch comment bodies
@@ -581,9 +1230,11 @@ class LJServer:
 
         arguments:
          startid - The first comment to fetch data for
-         session - A session cookie, if you've already generated one (if not, one will be generated for you)
+         session - A session cookie, if you've already generated one (if not, one will be generated for you,
+            or taken from the server's SessionManager)
 
-        returns a dictionary whose key is the comment id and whose value is a dictionary in the form:
+        returns a dictionary whose key is the comment id and whose value is a records.Comment, which
+        reads like a dictionary in the form:
          posterid - poster id, mapped per usermaps in the metadata
          state - as per state from _meta
          jitemid - journal item id the comment was posted to
@@ -596,36 +1247,274 @@ class LJServer:
 
         This should be very, very cached.  All information that might change is returned by fetch_comment_meta.
         """
-        response = self.__request_with_cookie(
-            self.host + "export_comments.bml?get=comment_body&startid=%d" % int(startid), session)
-        d = parse(response).getElementsByTagName('livejournal')[0]
-        response.close()
-        data = {}
-        for comment in d.getElementsByTagName('comment'):
-            c = {
-                'posterid': comment.getAttribute('posterid'),
-                'state': comment.getAttribute('state'),
-                'jitemid': comment.getAttribute('jitemid'),
-                'parentid': comment.getAttribute('parentid'),
-                'body': get_text_from_single(comment, 'body'),
-                'subject': get_text_from_single(comment, 'subject'),
-                'date': get_text_from_single(comment, 'date'),
-            }
-            if c['subject'] == '':
-                c['subject'] = 'A'
-            data[comment.getAttribute('id')] = c
-        d.unlink()
-        return data
+        response = self.__request_with_cookie(comment_bodies_url(self.host, startid), session)
+        try:
+            return parse_comment_bodies(response)
+        finally:
+            response.close()
+
+    def iter_comment_bodies(self, startid=0, session=None):
+        """Like fetch_comment_bodies, but a generator that yields (comment id, comment dictionary) pairs
+        as the page is downloaded, rather than holding the whole page in memory
+        """
+        response = self.__request_with_cookie(comment_bodies_url(self.host, startid), session)
+        try:
+            for item in iterparse_comment_bodies(response):
+                yield item
+        finally:
+            response.close()
+
+    def iter_syncitems(self, lastsync=None, prefetch=True):
+        """Yields every syncitem since 'lastsync', oldest first, however many pages it takes
+        Each is a dictionary like those in the 'syncitems' list syncitems returns: item ('L-123' for
+        entry 123), action ('create' or 'update') and time.  Since they come in time order, the
+        time of the last one handled is where to carry on from next time.
+        If 'prefetch' is true, the next page is fetched in the background while the current one is
+        worked through; only those two pages are held at once.
+        """
+        pages = self.__syncitems_pages(lastsync)
+        for page in (prefetched(pages) if prefetch else pages):
+            for item in page:
+                yield item
+
+    def __syncitems_pages(self, lastsync):
+        while True:
+            sync = self.syncitems(lastsync)
+            items = sync['syncitems']
+            if items:
+                yield items
+            last = max(item['time'] for item in items) if items else lastsync
+            if sync['count'] >= sync['total'] or last == lastsync:
+                return
+            lastsync = last
+
+    def iter_events_since(self, lastsync=None, prefetch=True, window=100):
+        """Yields every entry created or changed since 'lastsync', as a records.Entry, in the order
+        iter_syncitems lists them (entries deleted in the meantime are left out)
+        Entries are fetched with getevents_syncitems, for 'window' syncitems at a time; with
+        'prefetch', the next window is fetched in the background while the current one is worked
+        through.
+        """
+        windows = self.__event_windows(lastsync, window)
+        for entries in (prefetched(windows) if prefetch else windows):
+            for entry in entries:
+                yield entry
+
+    def __event_windows(self, lastsync, size):
+        # Entries that came back early, in a page fetched for an earlier window
+        early = {}
+        window = []
+        for item in self.iter_syncitems(lastsync, prefetch=False):
+            if item['item'].startswith('L-'):
+                window.append((int(item['item'][2:]), item['time']))
+                if len(window) >= size:
+                    yield self.__events_window(window, early)
+                    window = []
+        if window:
+            yield self.__events_window(window, early)
+
+    def __events_window(self, window, early):
+        """__events_window(window, early)
+        Internal function that fetches the entries for a list of (itemid, synctime) pairs, taking
+        any already in 'early' from there, and putting any later ones that come back into it.
+        Returns the entries in the window's order.
+        """
+        times = dict(window)
+        found = dict((itemid, early.pop(itemid)) for itemid in times if itemid in early)
+        pending = set(times) - set(found)
+        while pending:
+            start = min(times[itemid] for itemid in pending)
+            before = datetime.datetime.strptime(start, '%Y-%m-%d %H:%M:%S') - datetime.timedelta(seconds=1)
+            events = self.getevents_syncitems(before)['events']
+            remaining = len(pending)
+            for entry in events:
+                itemid = int(entry['itemid'])
+                if itemid in pending:
+                    found[itemid] = entry
+                    pending.discard(itemid)
+                elif itemid not in times and len(early) < 10 * len(times):
+                    early[itemid] = entry
+            if len(pending) == remaining:
+                # The server has nothing more to give for this window (e.g. the entries were deleted)
+                break
+        return [found[itemid] for itemid, time in window if itemid in found]
+
+    def iter_comments(self, startid=0, session=None, prefetch=True):
+        """Yields (comment id, comment) for every comment from 'startid' on, in id order, fetching
+        comment_body pages as needed; the comments are as fetch_comment_bodies returns them
+        With 'prefetch', the next page is downloaded and parsed in the background while the current
+        one is worked through; only those two pages are held at once.
+        Without a session cookie, one is taken from the server's SessionManager, or generated for
+        the walk and expired at the end of it.
+        """
+        pages = self.__comment_pages(startid, session)
+        for page in (prefetched(pages) if prefetch else pages):
+            for item in page:
+                yield item
+
+    def iter_comment_meta_pages(self, startid=0, session=None, prefetch=True):
+        """Yields each comment_meta page from 'startid' on, as fetch_comment_meta returns them, up to
+        the one holding the highest comment id; the last page may have no comments, but it still
+        gives maxid.
+        session and prefetch: as for iter_comments
+        """
+        pages = self.__comment_meta_pages(startid, session)
+        return prefetched(pages) if prefetch else pages
+
+    def __walk_session(self, session):
+        if session or self.sessions is not None:
+            return session, False
+        return self.sessiongenerate(), True
+
+    def __comment_pages(self, startid, session):
+        session, expire = self.__walk_session(session)
+        try:
+            while True:
+                page = sorted(self.fetch_comment_bodies(startid, session).items(), key=lambda item: int(item[0]))
+                if not page:
+                    return
+                yield page
+                startid = int(page[-1][0]) + 1
+        finally:
+            if expire:
+                self.sessionexpire(session)
+
+    def __comment_meta_pages(self, startid, session):
+        session, expire = self.__walk_session(session)
+        try:
+            while True:
+                meta = self.fetch_comment_meta(startid, session)
+                yield meta
+                highest = max([int(id) for id in meta['comments']] or [None])
+                if highest is None or highest >= int(meta['maxid'] or 0):
+                    return
+                startid = highest + 1
+        finally:
+            if expire:
+                self.sessionexpire(session)
+
+
+def prefetched(iterable):
+    """Iterates over 'iterable' with its next item always being worked out on a background thread,
+    so that producing it (e.g. downloading the next page) overlaps with the caller's use of this one
+    Exceptions are raised where the item would have been.
+    """
+    iterator = iter(iterable)
+    end = object()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        upcoming = executor.submit(next, iterator, end)
+        try:
+            while True:
+                item = upcoming.result()
+                if item is end:
+                    return
+                upcoming = executor.submit(next, iterator, end)
+                yield item
+        finally:
+            # Let a fetch that's under way finish, then tidy up the underlying generator
+            upcoming.cancel()
+            try:
+                upcoming.result()
+            except Exception:
+                pass
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+
+def comment_meta_url(host, startid=0):
+    return host + "export_comments.bml?get=comment_meta&startid=%d" % int(startid)
+
+
+def comment_bodies_url(host, startid=0):
+    return host + "export_comments.bml?get=comment_body&startid=%d" % int(startid)
+
+
+def iterparse_export(stream, tags, chunk_size=65536):
+    """Reads an export_comments.bml page from a file-like object a chunk at a time, yielding each
+    element named in 'tags' as soon as it's complete.  Elements are thrown away once the consumer
+    moves on, so memory use doesn't grow with the size of the page.
+    """
+    parser = XMLPullParser(events=('start', 'end'))
+    open_elements = []
+    while True:
+        data = stream.read(chunk_size)
+        if data:
+            parser.feed(data)
+        else:
+            parser.close()
+        for event, element in parser.read_events():
+            if event == 'start':
+                open_elements.append(element)
+                continue
+            open_elements.pop()
+            if element.tag in tags:
+                yield element
+                element.clear()
+                if open_elements:
+                    open_elements[-1].remove(element)
+        if not data:
+            break
+
+
+def iterparse_comment_meta(stream):
+    """Parses a comment_meta export page incrementally; see LJServer.iter_comment_meta"""
+    for element in iterparse_export(stream, ('maxid', 'comment', 'usermap')):
+        if element.tag == 'comment':
+            yield 'comment', element.get('id', ''), (element.get('posterid', ''), element.get('state') or 'A')
+        elif element.tag == 'usermap':
+            yield 'usermap', element.get('id', ''), element.get('user', '')
+        else:
+            yield 'maxid', None, element.text or ''
+
+
+def iterparse_comment_bodies(stream):
+    """Parses a comment_body export page incrementally; see LJServer.iter_comment_bodies"""
+    for element in iterparse_export(stream, ('comment',)):
+        c = {
+            'posterid': element.get('posterid', ''),
+            'state': element.get('state') or 'A',
+            'jitemid': element.get('jitemid', ''),
+            'parentid': element.get('parentid', ''),
+            'body': element.findtext('body', ''),
+            'subject': element.findtext('subject', ''),
+            'date': element.findtext('date', ''),
+        }
+        yield element.get('id', ''), Comment(c)
+
+
+def entry_record(event):
+    """Turns an event from a getevents response into a records.Entry
+    An event or subject that came as base64 (as bytes, with fast_decode) is decoded to text when
+    it's first looked up.
+    """
+    return Entry((key, Lazy(functools.partial(decode_text, value))
+                  if key in ('event', 'subject') and isinstance(value, bytes) else value)
+                 for key, value in event.items())
+
+
+def parse_comment_meta(stream):
+    """Parses a comment_meta export page from a file-like object; see LJServer.fetch_comment_meta"""
+    data = {'comments': {}, 'usermaps': {}, 'maxid': ''}
+    for kind, key, value in iterparse_comment_meta(stream):
+        if kind == 'comment':
+            data['comments'][key] = value
+        elif kind == 'usermap':
+            data['usermaps'][key] = value
+        else:
+            data['maxid'] = value
+    return data
+
+
+def parse_comment_bodies(stream):
+    """Parses a comment_body export page from a file-like object; see LJServer.fetch_comment_bodies"""
+    return dict(iterparse_comment_bodies(stream))
 
 
 # Stole this function wholesale from the python.org minidom example.
 # The necessity of this function helps explain why I hate the DOM.
 def get_text(nodelist):
-    rc = ""
-    for node in nodelist:
-        if node.nodeType == node.TEXT_NODE:
-            rc = rc + node.data
-    return rc
+    return ''.join(node.data for node in nodelist if node.nodeType == node.TEXT_NODE)
 
 
 def get_text_from_single(dom, tag):
@@ -0,0 +1,112 @@
+"""Caching what login returns between runs
+
+Every login can ask for the account's moods, userpic keywords (pickws) and their urls, and the web
+menus.  None of these change often, and LJ asks clients to cache moods in particular, sending the
+highest mood id they already have so that only newer moods come back.  A LoginCache keeps them,
+for each user on each host, in memory and optionally in a file; give one to an LJServer
+(login_cache=...) and its login() will:
+
+ - send getmoods with the highest cached mood id, and merge the new moods into the cached ones
+ - while the cached pickws, pickwurls and menus are younger than the cache's ttl, not ask for them
+   again, and return the cached ones instead
+
+usejournals and friendgroups come back with every login anyway, so they're always fresh.
+"""
+
+import os
+import pickle
+import threading
+import time
+
+# Login response keys the cache keeps, other than moods
+CACHED = ('pickws', 'pickwurls', 'defaultpicurl', 'menus')
+
+
+class LoginCache:
+    """Login metadata for each (user, host), kept for up to 'ttl' seconds
+
+    path: file to keep the cache in between runs; None keeps it in memory only
+    ttl: seconds the cached pickws, pickwurls and menus are used for before they're fetched again;
+        moods are kept indefinitely, since new ones are fetched incrementally
+
+    Safe to share between threads (and LJServers).  The file is rewritten, atomically, whenever an
+    entry changes.
+    """
+
+    def __init__(self, path=None, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self.entries = pickle.load(f)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                # An unreadable cache is no worse than no cache
+                self.entries = {}
+
+    def get(self, user, host):
+        """Returns a copy of the cached entry for 'user' on 'host' (an empty dictionary if there's none):
+        'moods', a list of moods; 'updated', a dictionary of when each of CACHED was last fetched;
+        and those of CACHED that the server returned
+        """
+        with self.lock:
+            return dict(self.entries.get((user, host), {}))
+
+    def fresh(self, user, host, key):
+        """Returns whether 'key' was fetched for 'user' on 'host' less than the ttl ago"""
+        with self.lock:
+            updated = self.entries.get((user, host), {}).get('updated')
+            # Caches written before keys had their own times have a single number here
+            if not isinstance(updated, dict) or key not in updated:
+                return False
+            return time.time() - updated[key] < self.ttl
+
+    def highest_mood(self, user, host):
+        """Returns the highest mood id cached for 'user' on 'host', or 0"""
+        with self.lock:
+            moods = self.entries.get((user, host), {}).get('moods', ())
+            return max([int(mood['id']) for mood in moods] or [0])
+
+    def update(self, user, host, response, fetched=None):
+        """Merges a login response for 'user' on 'host' into the cache, and returns the cached entry
+        New moods are added to the cached ones.  Each of CACHED that was fetched replaces the cached
+        value (or, if the server left it out, removes it) and is fresh again; the others keep
+        their values and their age.
+        fetched: which of CACHED the login asked for; by default, those in the response
+        """
+        with self.lock:
+            entry = dict(self.entries.get((user, host), {}))
+            if 'moods' in response:
+                moods = dict((int(mood['id']), dict(mood.items())) for mood in entry.get('moods', ()))
+                moods.update((int(mood['id']), dict(mood.items())) for mood in response['moods'])
+                entry['moods'] = [moods[id] for id in sorted(moods)]
+            if fetched is None:
+                fetched = [key for key in CACHED if key in response]
+            updated = entry.get('updated')
+            updated = dict(updated) if isinstance(updated, dict) else {}
+            now = time.time()
+            for key in fetched:
+                if key in response:
+                    entry[key] = response[key]
+                else:
+                    entry.pop(key, None)
+                updated[key] = now
+            entry['updated'] = updated
+            self.entries[(user, host)] = entry
+            self.__save()
+            return dict(entry)
+
+    def forget(self, user, host):
+        with self.lock:
+            if self.entries.pop((user, host), None) is not None:
+                self.__save()
+
+    def __save(self):
+        if not self.path:
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
@@ -0,0 +1,237 @@
+"""Instrumentation for LJServer
+
+Give an LJServer an Instrumentation (metrics=...) and it reports, for every request it makes:
+
+ - on_request: the method, the seconds it took and, if it failed, the class of error (see lj.error_class)
+ - on_bytes: the bytes sent and received for it
+ - on_retry: connections that had to be reopened to get it through
+ - on_parse: the seconds spent parsing the XML-RPC response (part of on_request's time)
+ - on_challenge: the seconds spent fetching challenges to authenticate requests with
+
+Several calls sent together in a multicall are reported as 'system.multicall'.  export_comments
+pages are parsed while they're downloaded, so their on_request time runs until the response headers
+arrive, and they have no separate parse time.
+
+Instrumentation does nothing with these; subclass it to send them somewhere.  Metrics keeps them,
+as counters and histograms labelled by method, and can write them out as a log summary or in the
+Prometheus text format.  An LJServer without instrumentation doesn't time anything.
+"""
+
+import bisect
+import logging
+import threading
+
+# Upper bounds, in seconds, of the buckets for Metrics' histograms
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Instrumentation:
+    """Receives an LJServer's measurements; every method does nothing unless overridden
+    Methods may be called from any thread that makes requests.
+    """
+
+    def on_request(self, method, seconds, error=None):
+        pass
+
+    def on_bytes(self, method, sent, received):
+        pass
+
+    def on_retry(self, method, retries):
+        pass
+
+    def on_parse(self, method, seconds):
+        pass
+
+    def on_challenge(self, seconds):
+        pass
+
+
+class Histogram:
+    """Counts of observations falling into each of a fixed set of buckets
+
+    buckets: the buckets' upper bounds, in increasing order; one more bucket takes anything larger
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates the q'th quantile (0 <= q <= 1), assuming observations are spread evenly
+        within each bucket; anything in the last, unbounded bucket counts as the largest bound
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics(Instrumentation):
+    """An Instrumentation that keeps counters and histograms of everything reported to it
+
+    buckets: bucket bounds for the time histograms
+    prefix: put in front of every metric name
+
+    One Metrics can be shared between several LJServers.  These are kept, labelled by method:
+     request_seconds (histogram), request_errors_total (also labelled by error class),
+     bytes_sent_total, bytes_received_total, connection_retries_total, parse_seconds (histogram)
+    and, unlabelled, challenge_seconds (histogram).
+    """
+
+    HELP = {
+        'request_seconds': 'Time taken by requests',
+        'request_errors_total': 'Requests that failed, by class of error',
+        'bytes_sent_total': 'Request body bytes sent',
+        'bytes_received_total': 'Response body bytes received, before decompression',
+        'connection_retries_total': 'Requests retried on a new connection after the old one was dropped',
+        'parse_seconds': 'Time spent parsing XML-RPC responses',
+        'challenge_seconds': 'Time spent getting challenges to authenticate requests',
+    }
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='lj_'):
+        self.buckets = buckets
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        """Adds 'amount' to the counter 'name' with the given labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Records 'value' in the histogram 'name' with the given labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def on_request(self, method, seconds, error=None):
+        self.observe('request_seconds', seconds, method=method)
+        if error is not None:
+            self.inc('request_errors_total', method=method, error=error)
+
+    def on_bytes(self, method, sent, received):
+        if sent:
+            self.inc('bytes_sent_total', sent, method=method)
+        if received:
+            self.inc('bytes_received_total', received, method=method)
+
+    def on_retry(self, method, retries):
+        self.inc('connection_retries_total', retries, method=method)
+
+    def on_parse(self, method, seconds):
+        self.observe('parse_seconds', seconds, method=method)
+
+    def on_challenge(self, seconds):
+        self.observe('challenge_seconds', seconds)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """Returns a copy of everything recorded so far, as a dictionary of
+        (name, labels): value for counters and (name, labels): (bucket counts, count, sum) for
+        histograms, where labels is a tuple of (label, value) pairs
+        """
+        with self.lock:
+            snapshot = dict(self.counters)
+            for key, histogram in self.histograms.items():
+                snapshot[key] = (list(histogram.counts), histogram.count, histogram.sum)
+        return snapshot
+
+    def summary(self):
+        """Returns a dictionary of method: dictionary of requests, errors, mean, p50 and p95 (in
+        seconds), bytes_sent, bytes_received, retries and parse_seconds
+        """
+        methods = {}
+        with self.lock:
+            for (name, labels), histogram in self.histograms.items():
+                labels = dict(labels)
+                if name == 'request_seconds':
+                    method = methods.setdefault(labels['method'], {})
+                    method.update(requests=histogram.count, mean=histogram.sum / histogram.count,
+                                  p50=histogram.quantile(0.5), p95=histogram.quantile(0.95))
+                elif name == 'parse_seconds':
+                    methods.setdefault(labels['method'], {})['parse_seconds'] = histogram.sum
+            for (name, labels), value in self.counters.items():
+                method = methods.setdefault(dict(labels).get('method'), {})
+                field = {'request_errors_total': 'errors', 'bytes_sent_total': 'bytes_sent',
+                         'bytes_received_total': 'bytes_received',
+                         'connection_retries_total': 'retries'}.get(name, name)
+                method[field] = method.get(field, 0) + value
+        return methods
+
+    def log(self, logger=None, level=logging.INFO):
+        """Logs a line for each method summarising its requests so far, and one for challenges"""
+        logger = logger or logging.getLogger('lj.metrics')
+        for method, stats in sorted(self.summary().items()):
+            if 'requests' not in stats:
+                continue
+            logger.log(level, "%s: %d requests, %d errors, mean %.1fms, p50 %.1fms, p95 %.1fms, "
+                              "%d bytes sent, %d received, %.1fms parsing",
+                       method, stats['requests'], stats.get('errors', 0), stats['mean'] * 1000,
+                       stats['p50'] * 1000, stats['p95'] * 1000, stats.get('bytes_sent', 0),
+                       stats.get('bytes_received', 0), stats.get('parse_seconds', 0) * 1000)
+        with self.lock:
+            challenges = self.histograms.get(('challenge_seconds', ()))
+            if challenges is not None:
+                logger.log(level, "challenges: %d fetches, %.1fms in all", challenges.count, challenges.sum * 1000)
+
+    def prometheus(self):
+        """Returns everything recorded so far in the Prometheus text exposition format"""
+        lines = []
+        snapshot = self.snapshot()
+        for name in sorted(set(name for name, labels in snapshot)):
+            full = self.prefix + name
+            if name in self.HELP:
+                lines.append('# HELP %s %s' % (full, self.HELP[name]))
+            items = sorted((labels, value) for (n, labels), value in snapshot.items() if n == name)
+            if name.endswith('_total'):
+                lines.append('# TYPE %s counter' % full)
+                for labels, value in items:
+                    lines.append('%s%s %s' % (full, format_labels(labels), format_value(value)))
+                continue
+            lines.append('# TYPE %s histogram' % full)
+            for labels, (counts, count, total) in items:
+                cumulative = 0
+                for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket
+                    le = '+Inf' if bound == float('inf') else format_value(bound)
+                    lines.append('%s_bucket%s %d' % (full, format_labels(labels + (('le', le),)), cumulative))
+                lines.append('%s_sum%s %s' % (full, format_labels(labels), format_value(total)))
+                lines.append('%s_count%s %d' % (full, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                                            .replace('\n', '\\n'))
+                             for name, value in labels)
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
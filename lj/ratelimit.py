@@ -0,0 +1,186 @@
+"""Request rate limiting and concurrency control
+
+TokenBucket lets requests through at a steady average rate, with short bursts allowed.
+HostRateLimiter keeps a TokenBucket for each host, and can be given to a transport.ConnectionPool
+so that every request through the pool, whichever LJServer it comes from, counts against its host's
+rate.  RequestLimiter, given to an LJServer, adds limits for particular methods.
+
+AdaptiveConcurrency works out how many requests to keep in flight: it allows more while responses
+keep coming back promptly, and fewer as soon as the server pushes back.
+"""
+
+import contextlib
+import threading
+import time
+
+
+class TokenBucket:
+    """A thread-safe token bucket
+
+    rate: tokens added per second
+    burst: the most tokens the bucket holds; defaults to one second's worth (at least one)
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Takes 'tokens' if they're there; returns whether it did"""
+        with self.lock:
+            self.__refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Takes 'tokens', waiting for them if need be; returns the number of seconds waited
+        Waiters are served in turn: each one reserves its tokens, possibly taking the bucket below
+        zero, and sleeps until the bucket would have refilled that far.
+        """
+        with self.lock:
+            self.__refill(time.monotonic())
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class HostRateLimiter:
+    """A TokenBucket per host
+
+    rate, burst: for each host's bucket
+    rates: optional dictionary of host: rate for hosts that should get a different rate
+    """
+
+    def __init__(self, rate, burst=None, rates=None):
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.waited = 0
+
+    def bucket(self, host):
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rates.get(host, self.rate), self.burst)
+            return bucket
+
+    def acquire(self, host):
+        """Waits until a request to 'host' is allowed; returns the number of seconds waited"""
+        wait = self.bucket(host).acquire()
+        if wait:
+            with self.lock:
+                self.waited += wait
+        return wait
+
+
+class RequestLimiter:
+    """Limits requests per host, and per method on each host
+
+    host_rate: the most requests per second to any one host, or None for no limit
+    method_rates: dictionary of method name: the most requests per second for that method on any
+        one host; methods not listed are only held to host_rate
+    burst: as for TokenBucket
+
+    Pass one RequestLimiter to several LJServers to hold them all to the same rates.
+    """
+
+    def __init__(self, host_rate=None, method_rates=None, burst=None):
+        self.hosts = HostRateLimiter(host_rate, burst) if host_rate else None
+        self.method_rates = method_rates or {}
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host, method):
+        """Waits until a 'method' request to 'host' is allowed; returns the number of seconds waited"""
+        wait = 0
+        rate = self.method_rates.get(method)
+        if rate:
+            with self.lock:
+                bucket = self.buckets.get((host, method))
+                if bucket is None:
+                    bucket = self.buckets[(host, method)] = TokenBucket(rate, self.burst)
+            wait += bucket.acquire()
+        if self.hosts is not None:
+            wait += self.hosts.acquire(host)
+        return wait
+
+
+class AdaptiveConcurrency:
+    """An AIMD (additive increase, multiplicative decrease) limit on requests in flight
+
+    initial, minimum, maximum: the starting limit and the bounds it moves between
+    decrease: the limit is multiplied by this after a failed or slow request
+    tolerance: a request counts as slow when it takes more than this many times the baseline
+        latency (the fastest recently seen)
+
+    While requests succeed at a steady latency the limit grows by about one for every 'limit'
+    requests, so it keeps probing for more throughput; a failure (a rate limit response, a
+    network error) or a slow response cuts it back.  Only requests started after the last cut can
+    cause another, so a burst of failures from requests that were already in flight counts once.
+
+    Use acquire() before a request and release() after it, or the slot() context manager.
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=16, decrease=0.5, tolerance=2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.baseline = None
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Waits for room under the limit; returns a start time to give to release()"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+        return time.monotonic()
+
+    def release(self, started, ok=True):
+        """Records the outcome of a request that started at 'started'"""
+        now = time.monotonic()
+        latency = now - started
+        with self.condition:
+            self.in_flight -= 1
+            if ok:
+                # Let the baseline drift up slowly, so it follows a server that gets slower overall
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * 0.01
+            if not ok or latency > self.baseline * self.tolerance:
+                if started > self.last_decrease:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Holds a place under the limit for the duration of the block; an exception counts as a failure"""
+        started = self.acquire()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release(started, ok)
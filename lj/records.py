@@ -0,0 +1,132 @@
+"""Compact record types for journal entries and comments
+
+Entry and Comment read (and can be updated) like the dictionaries LJ returns, but keep their
+usual keys in __slots__ instead of a per-record dictionary, intern the short strings that repeat
+across thousands of records (states, poster ids, security levels...), and can hold a Lazy value for
+bodies that are only decoded or loaded when first looked up.  Anything else LJ sends goes into a
+small per-record dictionary.
+
+Pickling or copying a record gives a plain dictionary, so pickled backups never depend on these
+classes.
+"""
+
+import sys
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+_missing = object()
+
+
+class Lazy:
+    """A record value that isn't worked out until it's first looked up
+    load: a callable taking no arguments that returns the real value
+    """
+
+    __slots__ = ('load',)
+
+    def __init__(self, load):
+        self.load = load
+
+
+class Record(MutableMapping):
+    """Base class for compact, dictionary-like records
+    Subclasses list their usual keys in fields (and __slots__), and the keys whose string values
+    should be interned in interned.
+    """
+
+    __slots__ = ('extra',)
+    fields = ()
+    fieldset = frozenset()
+    interned = frozenset()
+
+    def __init__(self, data=(), **kwds):
+        for field in self.fields:
+            setattr(self, field, _missing)
+        self.extra = None
+        if hasattr(data, 'keys'):
+            for key in data.keys():
+                self[key] = data[key]
+        else:
+            for key, value in data:
+                self[key] = value
+        for key, value in kwds.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.fieldset:
+            value = getattr(self, key)
+            if value is _missing:
+                raise KeyError(key)
+            if value.__class__ is Lazy:
+                value = value.load()
+                setattr(self, key, value)
+            return value
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.fieldset:
+            if key in self.interned and value.__class__ is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.fieldset:
+            if getattr(self, key) is _missing:
+                raise KeyError(key)
+            setattr(self, key, _missing)
+        elif self.extra is None:
+            raise KeyError(key)
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        if key in self.fieldset:
+            return getattr(self, key) is not _missing
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for field in self.fields:
+            if getattr(self, field) is not _missing:
+                yield field
+        if self.extra is not None:
+            for key in self.extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for field in self.fields if getattr(self, field) is not _missing) + len(self.extra or ())
+
+    def is_loaded(self, key):
+        """Returns False if 'key' holds a Lazy value that hasn't been looked up yet"""
+        return getattr(self, key, None).__class__ is not Lazy if key in self.fieldset else True
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self))
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class Entry(Record):
+    """A journal entry, as returned by getevents; the event and subject may be Lazy"""
+
+    fields = ('itemid', 'eventtime', 'security', 'allowmask', 'subject', 'event', 'poster', 'props', 'anum', 'url')
+    __slots__ = fields
+    fieldset = frozenset(fields)
+    interned = frozenset(('security', 'poster'))
+
+
+class Comment(Record):
+    """A comment, as returned by fetch_comment_bodies; the body may be Lazy"""
+
+    fields = ('posterid', 'state', 'jitemid', 'parentid', 'date', 'subject', 'body')
+    __slots__ = fields
+    fieldset = frozenset(fields)
+    interned = frozenset(('posterid', 'state', 'jitemid', 'parentid'))
@@ -0,0 +1,114 @@
+"""Sharing session cookies between requests, threads and runs
+
+Comment export pages are fetched with an ljsession cookie, and every sessiongenerate costs two
+authenticated round trips (a challenge and the call).  A SessionManager hands out one cookie per
+user, host and expiration class, shared by every thread and LJServer it's given to and, with a
+file, by later runs too.  A cookie is only replaced when it's close to expiring, or when the server
+turns it down; give the manager to an LJServer (sessions=...) and its comment export requests do
+both without being asked.
+"""
+
+import os
+import pickle
+import threading
+import time
+
+# How long LJ keeps each kind of session, in seconds
+LIFETIMES = {'short': 24 * 3600, 'long': 30 * 24 * 3600}
+
+
+class SessionManager:
+    """Session cookies for each (user, host, expiration class)
+
+    path: file to keep the cookies in between runs, readable only by the user; None keeps them in
+        memory only
+    expiration: the class of session to generate, 'short' or 'long', when none is asked for
+    margin: a cookie this many seconds or less from expiring is replaced rather than used
+
+    Safe to share between threads: when several need a new cookie at once, only one generates it.
+    """
+
+    def __init__(self, path=None, expiration='long', margin=3600):
+        self.path = path
+        self.expiration = expiration
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.generating = {}
+        self.sessions = {}
+        self.generated = 0
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    self.sessions = pickle.load(f)
+            except (IOError, EOFError, pickle.UnpicklingError):
+                self.sessions = {}
+
+    def __key(self, server, expiration):
+        return server.user, server.host, expiration or self.expiration
+
+    def get(self, server, expiration=None):
+        """Returns a session cookie for the user 'server' is logged in as, generating one through
+        'server' if there's none cached that's good for at least another 'margin' seconds
+        """
+        key = self.__key(server, expiration)
+        with self.lock:
+            session = self.__usable(key)
+            if session is not None:
+                return session
+            generating = self.generating.setdefault(key, threading.Lock())
+        with generating:
+            # Another thread may have generated one while we waited
+            with self.lock:
+                session = self.__usable(key)
+            if session is None:
+                session = self.__generate(server, key)
+            return session
+
+    def renew(self, server, rejected, expiration=None):
+        """Returns a new cookie to use in place of 'rejected', which the server turned down
+        If another thread has already replaced it, that replacement is returned rather than
+        generating yet another.
+        """
+        key = self.__key(server, expiration)
+        with self.lock:
+            generating = self.generating.setdefault(key, threading.Lock())
+        with generating:
+            with self.lock:
+                cached = self.sessions.get(key)
+                if cached is not None and cached[0] != rejected and cached[1] - self.margin > time.time():
+                    return cached[0]
+                self.sessions.pop(key, None)
+            return self.__generate(server, key)
+
+    def forget(self, server, expiration=None):
+        """Drops the cached cookie for 'server''s user, and returns it (or None) so it can be expired"""
+        with self.lock:
+            cached = self.sessions.pop(self.__key(server, expiration), None)
+            self.__save()
+        return cached[0] if cached else None
+
+    def __usable(self, key):
+        cached = self.sessions.get(key)
+        if cached is not None and cached[1] - self.margin > time.time():
+            return cached[0]
+        return None
+
+    def __generate(self, server, key):
+        expiration = key[2]
+        started = time.time()
+        session = server.sessiongenerate(expiration)
+        with self.lock:
+            self.sessions[key] = (session, started + LIFETIMES.get(expiration, LIFETIMES['short']))
+            self.generated += 1
+            self.__save()
+        return session
+
+    def __save(self):
+        if not self.path:
+            return
+        temporary = self.path + '.tmp'
+        # The cookies are as good as a password while they last
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'wb') as f:
+            pickle.dump(self.sessions, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
@@ -0,0 +1,654 @@
+"""Storage backends for journal backups
+
+A backup is kept as a JournalStore.  SQLiteStore, the default, keeps entries, comments and poster
+names in tables and only writes what changed; PickleStore keeps the original format, one pickled
+dictionary holding the whole journal, loaded on open and written back on close.
+
+Both can search the entries and comments they hold (JournalStore.search), and keep an index of
+comment threads (JournalStore.thread, subtree, reply_count and recent_comments).  SQLiteStore keeps an
+FTS5 full-text index that's updated along with each entry and comment written; PickleStore has to
+scan the whole journal.
+
+journal backup dictionary structure (PickleStore's file, and what JournalStore.to_journal returns):
+    { 'last_entry': timestamp of the last journal entry sync'd,
+      'last_comment': id of the last comment sync'd,
+      'last_comment_meta': when comment metadata was last refreshed,
+      'login': the dictionary returned by the last login (useful information such as friend groups),
+      'pending_entries': { [entryid]: time of the syncitem for an entry not downloaded yet },
+      'comment_posters': { [posterid]: [postername] }
+      'entries': { [entryid]: {
+          eventtime: timestamp,
+          security: 'private' or 'usemask',
+          allowmask: bitmask of usergroups allowed to see post,
+          subject: subject,
+          event: event text (url-encoded),
+          poster: user who posted the entry (if different from logged-in user),
+          props: dictionary of properties,
+          [other undocumented keys returned in a pseudo-arbitrary fashion by LJ],
+      } }
+      comments: { [commentid]: {
+          'posterid': poster id (map to username with comment_posters),
+          'jitemid': entry id,
+          'parentid': id of parent comment (0 if top-level),
+          'body': text of comment,
+          'date': date comment posted,
+          'subject': subject of comment,
+          [other undocumented keys returned in a pseudo-aritrary fashion by LJ],
+      } }
+    }
+"""
+
+import os
+import os.path
+import pickle
+import re
+import sqlite3
+import contextlib
+import functools
+import logging
+import time
+try:
+    from .records import Record, Entry, Comment, Lazy
+    from .threads import ThreadIndex
+except ImportError:
+    from records import Record, Entry, Comment, Lazy
+    from threads import ThreadIndex
+
+log = logging.getLogger('lj.storage')
+
+# Keys of the journal dictionary that are kept as metadata rather than in their own tables
+META_KEYS = ('last_entry', 'last_comment', 'last_comment_meta', 'login')
+COMMENT_FIELDS = ('posterid', 'state', 'jitemid', 'parentid', 'date', 'subject', 'body')
+# The comment columns SQLiteStore reads to make a records.Comment (whose body is loaded when needed)
+COMMENT_COLUMNS = 'c.id, c.posterid, c.state, c.jitemid, c.parentid, c.date, c.subject, c.extra'
+
+TAG_RE = re.compile(r'<[^>]*>')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def default_journal():
+    return {
+        'last_entry': None,
+        'last_comment': '0',
+        'last_comment_meta': None,
+        'entries': {},
+        'comments': {},
+        'comment_posters': {},
+    }
+
+
+def load_journal(f):
+    # f should be a string referring to a file
+    if os.path.exists(f):
+        try:
+            with open(f, 'rb') as fp:
+                return pickle.load(fp)
+        except EOFError:
+            return default_journal()
+    return default_journal()
+
+
+def plain_text(value):
+    """Returns the text of an entry or comment field, with any HTML tags taken out"""
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    return TAG_RE.sub(' ', str(value))
+
+
+def entry_search_fields(entry):
+    """Returns the (subject, text, tags) of an entry, as indexed for searching"""
+    props = entry.get('props') or {}
+    return plain_text(entry.get('subject')), plain_text(entry.get('event')), plain_text(props.get('taglist'))
+
+
+def comment_search_fields(comment):
+    """Returns the (subject, text, tags) of a comment, as indexed for searching"""
+    return plain_text(comment.get('subject')), plain_text(comment.get('body')), ''
+
+
+def quote_query(query):
+    """Turns free text into an FTS5 query matching every word in it; '' if it has no words"""
+    return ' '.join('"%s"' % word for word in WORD_RE.findall(query))
+
+
+def save_journal(f, journal):
+    # Write to a temporary file first, so a crash part way through never leaves a truncated backup
+    with open(f + '.tmp', 'wb') as fp:
+        pickle.dump(journal, fp)
+    os.replace(f + '.tmp', f)
+
+
+class JournalStore:
+    """What the backup code needs from somewhere to keep a journal
+
+    Metadata (the sync cursors and the last login response) is read and written with get and set.
+    The put_* methods add or replace entries, comments and poster names; wrap the updates for one
+    page of results in a transaction() so they're saved together.
+
+    Entries that syncitems has reported but that haven't been downloaded yet are kept as pending
+    entries, so an interrupted backup knows what it still has to fetch.
+
+    checkpoint_interval: the least number of seconds between checkpoints, which are taken as
+        transactions finish
+    """
+
+    checkpoint_interval = 30
+    last_checkpoint = 0
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def put_entries(self, entries):
+        """Adds or replaces entries, given an iterable of entry dictionaries"""
+        raise NotImplementedError
+
+    def put_comments(self, comments):
+        """Adds or replaces comments, given a dictionary of comment id: comment dictionary"""
+        raise NotImplementedError
+
+    def update_comment_meta(self, meta):
+        """Applies (posterid, state) tuples, keyed by comment id, to comments already stored
+        Returns the number of comments that actually changed.
+        """
+        raise NotImplementedError
+
+    def put_posters(self, usermaps):
+        """Adds or replaces poster names, given a dictionary of posterid: username"""
+        raise NotImplementedError
+
+    def add_pending_entries(self, items):
+        """Records (itemid, time) syncitems whose entries still need downloading"""
+        raise NotImplementedError
+
+    def pending_entries(self):
+        """Returns the pending (itemid, time) syncitems, oldest first"""
+        raise NotImplementedError
+
+    def remove_pending_entries(self, itemids):
+        raise NotImplementedError
+
+    def count_entries(self):
+        raise NotImplementedError
+
+    def count_comments(self):
+        raise NotImplementedError
+
+    def to_journal(self):
+        """Returns the whole backup as a journal dictionary (see the module docstring)"""
+        raise NotImplementedError
+
+    def search(self, query, limit=20):
+        """Finds entries and comments matching 'query', searching their subjects, text and tags
+        Returns a list of up to 'limit' hits, best first, each a dictionary with keys:
+         type - 'entry' or 'comment'
+         id - the itemid or comment id
+         score - how well it matched; higher is better
+         snippet - a bit of the matching text, with the matches in [brackets]
+        """
+        raise NotImplementedError
+
+    def thread(self, jitemid):
+        """Returns the comments on entry 'jitemid' in thread order, as a list of
+        (comment id, depth, comment) tuples; top-level comments have depth 0
+        """
+        raise NotImplementedError
+
+    def subtree(self, id):
+        """Returns comment 'id' and all the replies to it, as thread() does"""
+        raise NotImplementedError
+
+    def reply_count(self, id):
+        """Returns how many replies comment 'id' has, counting replies to replies"""
+        raise NotImplementedError
+
+    def recent_comments(self, jitemid, count=10):
+        """Returns the 'count' most recent comments on entry 'jitemid', newest first, as a list of
+        (comment id, comment) tuples
+        """
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield self
+        self.maybe_checkpoint()
+
+    def maybe_checkpoint(self):
+        if time.time() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+            self.last_checkpoint = time.time()
+
+    def checkpoint(self):
+        """Makes sure everything written so far would survive a crash"""
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PickleStore(JournalStore):
+    """The original backup format: the whole journal dictionary, pickled into one file
+    In memory, entries and comments are kept as records.Entry and records.Comment; they're
+    pickled as plain dictionaries.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal = load_journal(path)
+        self.journal['entries'] = dict((itemid, Entry(entry)) for itemid, entry in self.journal['entries'].items())
+        self.journal['comments'] = dict((id, Comment(comment)) for id, comment in self.journal['comments'].items())
+        self.thread_index = None
+        self.last_checkpoint = time.time()
+
+    def get(self, key, default=None):
+        return self.journal.get(key, default)
+
+    def set(self, key, value):
+        self.journal[key] = value
+
+    def put_entries(self, entries):
+        for entry in entries:
+            self.journal['entries'][entry['itemid']] = entry if isinstance(entry, Record) else Entry(entry)
+
+    def put_comments(self, comments):
+        for id, comment in comments.items():
+            self.journal['comments'][id] = comment if isinstance(comment, Record) else Comment(comment)
+        if self.thread_index is not None:
+            self.thread_index.add(comments)
+
+    def update_comment_meta(self, meta):
+        changed = 0
+        comments = self.journal['comments']
+        for id, (posterid, state) in meta.items():
+            comment = comments.get(id)
+            if comment is not None and (comment.get('posterid'), comment.get('state')) != (posterid, state):
+                comment['posterid'] = posterid
+                comment['state'] = state
+                changed += 1
+        return changed
+
+    def put_posters(self, usermaps):
+        self.journal['comment_posters'].update(usermaps)
+
+    def add_pending_entries(self, items):
+        self.journal.setdefault('pending_entries', {}).update(items)
+
+    def pending_entries(self):
+        return sorted(self.journal.get('pending_entries', {}).items(), key=lambda item: item[1])
+
+    def remove_pending_entries(self, itemids):
+        pending = self.journal.get('pending_entries', {})
+        for itemid in itemids:
+            pending.pop(itemid, None)
+
+    def count_entries(self):
+        return len(self.journal['entries'])
+
+    def count_comments(self):
+        return len(self.journal['comments'])
+
+    def to_journal(self):
+        return self.journal
+
+    def search(self, query, limit=20):
+        # No index here: every entry and comment is scanned, and only plain words are understood
+        words = [word.lower() for word in WORD_RE.findall(query)]
+        if not words:
+            return []
+        documents = [('entry', itemid, entry_search_fields(entry))
+                     for itemid, entry in self.journal['entries'].items()]
+        documents += [('comment', id, comment_search_fields(comment))
+                      for id, comment in self.journal['comments'].items()]
+        hits = []
+        for kind, id, fields in documents:
+            text = ' '.join(fields)
+            lowered = text.lower()
+            if all(word in lowered for word in words):
+                position = lowered.find(words[0])
+                hits.append({'type': kind,
+                             'id': int(id),
+                             'score': sum(lowered.count(word) for word in words),
+                             'snippet': ' '.join(text[max(0, position - 40):position + 60].split())})
+        hits.sort(key=lambda hit: -hit['score'])
+        return hits[:limit]
+
+    def threads(self):
+        # The index is built the first time it's needed, then kept up to date by put_comments
+        if self.thread_index is None:
+            self.thread_index = ThreadIndex(self.journal['comments'])
+        return self.thread_index
+
+    def __comments(self, ids):
+        comments = self.journal['comments']
+        return [(str(id), depth, comments[str(id)]) for id, depth in ids]
+
+    def thread(self, jitemid):
+        return self.__comments(self.threads().thread(jitemid))
+
+    def subtree(self, id):
+        return self.__comments(self.threads().subtree(id))
+
+    def reply_count(self, id):
+        return self.threads().reply_count(id)
+
+    def recent_comments(self, jitemid, count=10):
+        comments = self.journal['comments']
+        return [(str(id), comments[str(id)]) for id in self.threads().recent(jitemid, count)]
+
+    def checkpoint(self):
+        save_journal(self.path, self.journal)
+
+    def close(self):
+        save_journal(self.path, self.journal)
+
+
+class SQLiteStore(JournalStore):
+    """Keeps a backup in an SQLite database, writing only what each update touches
+
+    Entries are stored one row each (pickled, since LJ returns arbitrary keys and types), comments
+    have a column per field, and the sync cursors live in a metadata table.  Every transaction()
+    is committed as a whole, so a page of results is either saved completely or not at all.
+
+    The search table is an FTS5 index of entry and comment subjects, text and tags.  Its rowid is
+    twice the comment id for comments, and twice the itemid plus one for entries, so writing an
+    entry or comment replaces just its own index row.  A database made before the index existed is
+    indexed the first time it's opened.
+
+    The threads table places each comment in its entry's comment tree: path is the ids of the
+    comment's ancestors and its own, each zero-padded and followed by '/', so sorting by path puts
+    a thread in order and a subtree is a range of paths.  depth and size (the number of comments in
+    the subtree) are kept up to date as comments are added.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # A store may be handed between threads (watch mode does), but only used by one at a time
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.depth = 0
+        with self.db:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB);
+                CREATE TABLE IF NOT EXISTS entries (itemid INTEGER PRIMARY KEY, data BLOB);
+                CREATE TABLE IF NOT EXISTS comments (
+                    id INTEGER PRIMARY KEY, posterid TEXT, state TEXT, jitemid INTEGER, parentid INTEGER,
+                    date TEXT, subject TEXT, body TEXT, extra BLOB);
+                CREATE TABLE IF NOT EXISTS posters (posterid TEXT PRIMARY KEY, username TEXT);
+                CREATE TABLE IF NOT EXISTS pending_entries (itemid INTEGER PRIMARY KEY, time TEXT);
+                CREATE INDEX IF NOT EXISTS comments_jitemid ON comments (jitemid, id);
+                CREATE INDEX IF NOT EXISTS comments_parentid ON comments (parentid);
+            """)
+            threaded = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'threads'").fetchone()
+            if not threaded:
+                self.db.executescript("""
+                    CREATE TABLE threads (
+                        id INTEGER PRIMARY KEY, jitemid INTEGER, path TEXT, depth INTEGER, size INTEGER);
+                    CREATE INDEX threads_path ON threads (jitemid, path);
+                """)
+            indexed = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'search'").fetchone()
+            if not indexed:
+                self.db.execute("CREATE VIRTUAL TABLE search USING fts5("
+                                "subject, body, tags, tokenize = 'unicode61 remove_diacritics 2')")
+                # Matches in subjects and tags count for more than matches in the text
+                self.db.execute("INSERT INTO search (search, rank) VALUES ('rank', 'bm25(4.0, 1.0, 2.0)')")
+        if not indexed:
+            self.reindex()
+        if not threaded:
+            with self.transaction():
+                self.__thread(self.db.execute('SELECT id, jitemid, parentid FROM comments').fetchall())
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # Nested transactions are folded into the outermost one
+        self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.depth -= 1
+            if not self.depth:
+                self.db.rollback()
+            raise
+        self.depth -= 1
+        if not self.depth:
+            self.db.commit()
+            self.maybe_checkpoint()
+
+    def __autocommit(self):
+        if not self.depth:
+            self.db.commit()
+
+    def get(self, key, default=None):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                        (key, sqlite3.Binary(pickle.dumps(value))))
+        self.__autocommit()
+
+    def put_entries(self, entries):
+        entries = list(entries)
+        self.db.executemany('INSERT OR REPLACE INTO entries (itemid, data) VALUES (?, ?)',
+                            ((int(entry['itemid']), sqlite3.Binary(pickle.dumps(entry)))
+                             for entry in entries))
+        self.db.executemany('INSERT OR REPLACE INTO search (rowid, subject, body, tags) VALUES (?, ?, ?, ?)',
+                            ((int(entry['itemid']) * 2 + 1,) + entry_search_fields(entry) for entry in entries))
+        self.__autocommit()
+
+    def put_comments(self, comments):
+        rows = []
+        for id, comment in comments.items():
+            extra = dict((k, v) for k, v in comment.items() if k not in COMMENT_FIELDS)
+            rows.append((int(id), comment.get('posterid'), comment.get('state'), int(comment.get('jitemid') or 0),
+                         int(comment.get('parentid') or 0), comment.get('date'), comment.get('subject'),
+                         comment.get('body'), sqlite3.Binary(pickle.dumps(extra)) if extra else None))
+        self.db.executemany('INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.db.executemany('INSERT OR REPLACE INTO search (rowid, subject, body, tags) VALUES (?, ?, ?, ?)',
+                            ((row[0] * 2, plain_text(row[6]), plain_text(row[7]), '') for row in rows))
+        self.__thread([(row[0], row[3], row[4]) for row in rows])
+        self.__autocommit()
+
+    def __thread(self, rows):
+        # Adds (id, jitemid, parentid) comments to the threads table, parents (lower ids) first
+        for id, jitemid, parentid in sorted(rows):
+            if self.db.execute('SELECT 1 FROM threads WHERE id = ?', (id,)).fetchone():
+                continue
+            parent = self.db.execute('SELECT path, depth FROM threads WHERE id = ?', (parentid,)).fetchone()
+            if parent is None:
+                path, depth = '%010d/' % id, 0
+            else:
+                path, depth = parent[0] + '%010d/' % id, parent[1] + 1
+            # Replies stored before this comment were threaded as top-level comments; move them here
+            orphans = self.db.execute('SELECT t.id, t.path, t.size FROM comments c JOIN threads t ON t.id = c.id '
+                                      'WHERE c.parentid = ? AND t.depth = 0', (id,)).fetchall()
+            size = 1 + sum(orphan[2] for orphan in orphans)
+            self.db.execute('INSERT INTO threads (id, jitemid, path, depth, size) VALUES (?, ?, ?, ?, ?)',
+                            (id, jitemid, path, depth, size))
+            for orphan, orphan_path, orphan_size in orphans:
+                self.db.execute('UPDATE threads SET path = ? || path, depth = depth + ? '
+                                'WHERE jitemid = ? AND path >= ? AND path < ?',
+                                (path, depth + 1, jitemid, orphan_path, orphan_path[:-1] + '0'))
+            if parent is not None:
+                ancestors = [int(ancestor) for ancestor in parent[0].split('/')[:-1]]
+                self.db.execute('UPDATE threads SET size = size + ? WHERE id IN (%s)' % ','.join('?' * len(ancestors)),
+                                [size] + ancestors)
+
+    def update_comment_meta(self, meta):
+        cursor = self.db.executemany(
+            'UPDATE comments SET posterid = ?, state = ? WHERE id = ? AND (posterid IS NOT ? OR state IS NOT ?)',
+            ((posterid, state, int(id), posterid, state) for id, (posterid, state) in meta.items()))
+        self.__autocommit()
+        return cursor.rowcount
+
+    def put_posters(self, usermaps):
+        self.db.executemany('INSERT OR REPLACE INTO posters (posterid, username) VALUES (?, ?)',
+                            list(usermaps.items()))
+        self.__autocommit()
+
+    def add_pending_entries(self, items):
+        self.db.executemany('INSERT OR REPLACE INTO pending_entries (itemid, time) VALUES (?, ?)', items)
+        self.__autocommit()
+
+    def pending_entries(self):
+        return self.db.execute('SELECT itemid, time FROM pending_entries ORDER BY time, itemid').fetchall()
+
+    def remove_pending_entries(self, itemids):
+        self.db.executemany('DELETE FROM pending_entries WHERE itemid = ?', [(int(itemid),) for itemid in itemids])
+        self.__autocommit()
+
+    def checkpoint(self):
+        # Each transaction is already durable once committed; this just folds the WAL back into the
+        # database so it doesn't grow without bound during a long backup
+        self.db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def count_entries(self):
+        return self.db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def count_comments(self):
+        return self.db.execute('SELECT COUNT(*) FROM comments').fetchone()[0]
+
+    def iter_entries(self):
+        for itemid, data in self.db.execute('SELECT itemid, data FROM entries ORDER BY itemid'):
+            yield itemid, Entry(pickle.loads(data))
+
+    def iter_comments(self):
+        """Yields (id, records.Comment) for every stored comment, in id order
+        Comment bodies are only read from the database when they're looked up.
+        """
+        for row in self.db.execute('SELECT %s FROM comments c ORDER BY c.id' % COMMENT_COLUMNS):
+            yield str(row[0]), self.__comment(row)
+
+    def __comment(self, row):
+        comment = Comment(zip(COMMENT_FIELDS[:6], row[1:7]))
+        comment['jitemid'] = str(row[3])
+        comment['parentid'] = str(row[4])
+        comment['body'] = Lazy(functools.partial(self.comment_body, row[0]))
+        if row[7] is not None:
+            comment.update(pickle.loads(row[7]))
+        return comment
+
+    def comment_body(self, id):
+        row = self.db.execute('SELECT body FROM comments WHERE id = ?', (int(id),)).fetchone()
+        return row and row[0]
+
+    def search(self, query, limit=20):
+        """See JournalStore.search
+        'query' may use FTS5 query syntax (AND, OR, NOT, "phrases", prefix*, subject:word...);
+        anything that doesn't parse as such is searched for as plain words.  A query with no words
+        in it finds nothing.
+        """
+        sql = ('SELECT rowid, rank, snippet(search, -1, \'[\', \']\', \'...\', 12) FROM search '
+               'WHERE search MATCH ? ORDER BY rank LIMIT ?')
+        words = quote_query(query)
+        if not words:
+            return []
+        try:
+            rows = self.db.execute(sql, (query, limit)).fetchall()
+        except sqlite3.OperationalError:
+            rows = self.db.execute(sql, (words, limit)).fetchall()
+        return [{'type': 'entry' if rowid % 2 else 'comment',
+                 'id': rowid // 2,
+                 'score': -rank,
+                 'snippet': snippet}
+                for rowid, rank, snippet in rows]
+
+    def reindex(self):
+        """Rebuilds the search index from every stored entry and comment"""
+        with self.transaction():
+            self.db.execute('DELETE FROM search')
+            self.db.executemany('INSERT INTO search (rowid, subject, body, tags) VALUES (?, ?, ?, ?)',
+                                ((itemid * 2 + 1,) + entry_search_fields(entry)
+                                 for itemid, entry in self.iter_entries()))
+            self.db.executemany('INSERT INTO search (rowid, subject, body, tags) VALUES (?, ?, ?, ?)',
+                                ((id * 2, plain_text(subject), plain_text(body), '')
+                                 for id, subject, body in self.db.execute('SELECT id, subject, body FROM comments')))
+
+    def __threaded(self, where, parameters):
+        return [(str(row[0]), row[8], self.__comment(row)) for row in self.db.execute(
+            'SELECT %s, t.depth FROM threads t JOIN comments c ON c.id = t.id WHERE %s ORDER BY t.path'
+            % (COMMENT_COLUMNS, where), parameters)]
+
+    def thread(self, jitemid):
+        return self.__threaded('t.jitemid = ?', (int(jitemid),))
+
+    def subtree(self, id):
+        row = self.db.execute('SELECT jitemid, path FROM threads WHERE id = ?', (int(id),)).fetchone()
+        if row is None:
+            return []
+        jitemid, path = row
+        return self.__threaded('t.jitemid = ? AND t.path >= ? AND t.path < ?', (jitemid, path, path[:-1] + '0'))
+
+    def reply_count(self, id):
+        row = self.db.execute('SELECT size FROM threads WHERE id = ?', (int(id),)).fetchone()
+        return row[0] - 1 if row else 0
+
+    def recent_comments(self, jitemid, count=10):
+        return [(str(row[0]), self.__comment(row)) for row in self.db.execute(
+            'SELECT %s FROM comments c WHERE c.jitemid = ? ORDER BY c.id DESC LIMIT ?' % COMMENT_COLUMNS,
+            (int(jitemid), count))]
+
+    def to_journal(self):
+        journal = default_journal()
+        for key, value in self.db.execute('SELECT key, value FROM meta'):
+            journal[key] = pickle.loads(value)
+        journal['entries'] = dict(self.iter_entries())
+        journal['comments'] = dict(self.iter_comments())
+        journal['comment_posters'] = dict(self.db.execute('SELECT posterid, username FROM posters'))
+        journal['pending_entries'] = dict(self.pending_entries())
+        return journal
+
+    def import_journal(self, journal):
+        """Copies a journal dictionary (e.g. from an old pickle backup) into the database"""
+        with self.transaction():
+            for key in META_KEYS:
+                if key in journal:
+                    self.set(key, journal[key])
+            self.put_entries(journal.get('entries', {}).values())
+            self.put_comments(journal.get('comments', {}))
+            self.put_posters(journal.get('comment_posters', {}))
+            self.add_pending_entries(list(journal.get('pending_entries', {}).items()))
+
+    def close(self):
+        self.db.close()
+
+
+def is_sqlite(path):
+    with open(path, 'rb') as fp:
+        return fp.read(16) == b'SQLite format 3\x00'
+
+
+def open_store(path, backend='sqlite'):
+    """Opens the backup at 'path' with the given backend ('sqlite' or 'pickle')
+
+    An existing pickle backup is migrated the first time it's opened with the sqlite backend.  The
+    database goes next to it (backup.pkl becomes backup.sqlite) and the pickle file is left alone.
+    The migration is logged, at INFO level, to the 'lj.storage' logger.
+    """
+    if backend == 'pickle':
+        return PickleStore(path)
+    if backend != 'sqlite':
+        raise ValueError("Unknown storage backend '%s'" % backend)
+    dbpath = path
+    if path.endswith('.pkl'):
+        dbpath = path[:-len('.pkl')] + '.sqlite'
+    elif os.path.exists(path) and not is_sqlite(path):
+        dbpath = path + '.sqlite'
+    migrate = dbpath != path and os.path.exists(path) and not os.path.exists(dbpath)
+    store = SQLiteStore(dbpath)
+    if migrate:
+        log.info("Migrating %s to %s", path, dbpath)
+        store.import_journal(load_journal(path))
+    return store
@@ -0,0 +1,101 @@
+"""Comment thread index
+
+Comments come from LJ as a flat dictionary of id: comment, each naming its entry (jitemid) and
+parent comment (parentid, 0 for a top-level comment).  ThreadIndex arranges them into trees, one
+forest per entry, keeping each comment's depth and the size of its subtree up to date as comments
+are added, so a thread can be walked, or its replies counted, without looking at any other
+comment in the journal.
+
+storage.PickleStore uses a ThreadIndex; storage.SQLiteStore keeps the same information in a table.
+"""
+
+import bisect
+import heapq
+
+
+class ThreadIndex:
+    """In-memory index of comment threads
+
+    comments: optional dictionary of comment id: comment to start with
+
+    Ids are handled as integers.  Replies are kept in id order, which is the order they were
+    posted in.  A comment whose parent isn't known (yet) is treated as a top-level comment until
+    the parent is added, when it's moved, with its replies, under it.
+    """
+
+    def __init__(self, comments=None):
+        self.parent = {}
+        self.entry = {}
+        self.depth = {}
+        self.size = {}
+        self.children = {}
+        self.roots = {}
+        self.by_entry = {}
+        if comments:
+            self.add(comments)
+
+    def add(self, comments):
+        """Adds comments, given a dictionary of comment id: comment
+        Comments already in the index are left where they are.
+        """
+        for id, comment in sorted((int(id), comment) for id, comment in comments.items()):
+            if id in self.parent:
+                continue
+            parentid = int(comment.get('parentid') or 0)
+            jitemid = int(comment.get('jitemid') or 0)
+            self.parent[id] = parentid
+            self.entry[id] = jitemid
+            self.by_entry.setdefault(jitemid, []).append(id)
+            orphans = self.children.get(id, ())
+            size = 1 + sum(self.size[orphan] for orphan in orphans)
+            self.size[id] = size
+            if parentid in self.parent:
+                depth = self.depth[parentid] + 1
+                ancestor = parentid
+                while ancestor in self.parent:
+                    self.size[ancestor] += size
+                    ancestor = self.parent[ancestor]
+            else:
+                depth = 0
+                bisect.insort(self.roots.setdefault(jitemid, []), id)
+            if parentid:
+                # Remembered even if the parent isn't here yet, so it can adopt this comment later
+                bisect.insort(self.children.setdefault(parentid, []), id)
+            self.depth[id] = depth
+            for orphan in orphans:
+                self.roots[self.entry[orphan]].remove(orphan)
+                self.__shift(orphan, depth + 1)
+
+    def __shift(self, id, depth):
+        stack = [(id, depth)]
+        while stack:
+            id, depth = stack.pop()
+            self.depth[id] = depth
+            stack.extend((child, depth + 1) for child in self.children.get(id, ()))
+
+    def walk(self, ids):
+        """Yields (id, depth) for the comments in 'ids' and all their replies, in thread order"""
+        stack = [(id, self.depth[id]) for id in reversed(ids)]
+        while stack:
+            id, depth = stack.pop()
+            yield id, depth
+            stack.extend((child, depth + 1) for child in reversed(self.children.get(id, ())))
+
+    def thread(self, jitemid):
+        """Returns [(id, depth)...] for every comment on entry 'jitemid', in thread order"""
+        return list(self.walk(self.roots.get(int(jitemid), ())))
+
+    def subtree(self, id):
+        """Returns [(id, depth)...] for comment 'id' and all its replies, in thread order"""
+        id = int(id)
+        if id not in self.parent:
+            return []
+        return list(self.walk([id]))
+
+    def reply_count(self, id):
+        """Returns the number of replies to comment 'id', direct or not"""
+        return self.size.get(int(id), 1) - 1
+
+    def recent(self, jitemid, count=10):
+        """Returns the ids of the 'count' most recent comments on entry 'jitemid', newest first"""
+        return heapq.nlargest(count, self.by_entry.get(int(jitemid), ()))
@@ -0,0 +1,284 @@
+"""HTTP plumbing for the LiveJournal client
+
+ConnectionPool keeps HTTP/1.1 connections alive between requests so that a run of calls to the
+same host only pays for the TCP (and TLS) handshake once.  LJServer shares one pool between its
+XML-RPC transport and the cookie-authenticated comment export requests.  DecodedResponse
+decompresses those export pages on the fly.
+"""
+
+import select
+import threading
+import time
+import zlib
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+class ConnectionPool:
+    """A thread-safe pool of kept-alive HTTP connections, grouped by (scheme, host, port)
+
+    maxsize: the most idle connections kept for each host; extra ones are closed when released
+    idle_timeout: seconds a connection may sit idle before it is closed instead of reused
+    timeout: socket timeout for new connections
+    ssl_context: passed to https connections
+    limiter: optional ratelimit.HostRateLimiter; every request waits for its host's turn
+
+    Idle connections the server has already closed are noticed and replaced before they're used.
+    A request that still fails on a reused connection is retried on a fresh one only if it failed
+    while being sent, or if it's idempotent and no response at all came back: a POST may have been
+    carried out by the server before the connection dropped, so sending it again could repeat it.
+
+    hits, misses, reconnects and evictions count, respectively, requests that reused a
+    connection, requests that had to open one, retries after a reset, and idle connections
+    dropped for being too old.
+    """
+
+    def __init__(self, maxsize=4, idle_timeout=60, timeout=None, ssl_context=None, limiter=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.limiter = limiter
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.hits = 0
+        self.misses = 0
+        self.reconnects = 0
+        self.evictions = 0
+
+    def stats(self):
+        """Returns the pool counters, plus the number of idle connections currently held"""
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'reconnects': self.reconnects,
+                    'evictions': self.evictions,
+                    'idle': sum(len(connections) for connections in self.idle.values())}
+
+    def __get(self, key):
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                expired = time.time() - self.idle_timeout
+                while connections and connections[0][1] < expired:
+                    connections.pop(0)[0].close()
+                    self.evictions += 1
+                while connections:
+                    connection = connections.pop()[0]
+                    if dropped(connection):
+                        connection.close()
+                        self.evictions += 1
+                        continue
+                    self.hits += 1
+                    return connection, True
+            self.misses += 1
+        scheme, host, port = key
+        if scheme == 'https':
+            connection = httplib.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        else:
+            connection = httplib.HTTPConnection(host, port, timeout=self.timeout)
+        return connection, False
+
+    def _release(self, key, connection):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.maxsize:
+                connections.append((connection, time.time()))
+                return
+        connection.close()
+
+    def request(self, method, url, body=None, headers=None, idempotent=None):
+        """Makes a request, returning a PooledResponse
+        The connection goes back to the pool when the response is closed, provided it was read to
+        the end; close it as soon as you're done with it.
+        idempotent: whether the request may safely be made twice; by default, true for GET, HEAD
+            and OPTIONS requests
+        """
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        if self.limiter is not None:
+            self.limiter.acquire(parts.hostname)
+        retries = 0
+        while True:
+            connection, reused = self.__get(key)
+            sent = False
+            try:
+                connection.request(method, path, body, headers or {})
+                sent = True
+                response = connection.getresponse()
+            except (ConnectionError, httplib.BadStatusLine) as v:
+                connection.close()
+                # A reset after sending may have come after the server acted on the request
+                if reused and (not sent or (idempotent and no_response(v))):
+                    with self.lock:
+                        self.reconnects += 1
+                    retries += 1
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            pooled = PooledResponse(self, key, connection, response)
+            pooled.bytes_sent = len(body) if body else 0
+            pooled.retries = retries
+            return pooled
+
+    def close(self):
+        """Closes every idle connection"""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for connection, since in connections:
+                connection.close()
+
+
+# HTTP methods that can be sent again without doing anything twice
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def dropped(connection):
+    """Returns whether an idle kept-alive connection has been closed (or written to) by the server"""
+    sock = connection.sock
+    if sock is None:
+        return False
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (ValueError, OSError):
+        return True
+
+
+def no_response(error):
+    """Returns whether a failed getresponse() got nothing at all back from the server"""
+    if isinstance(error, (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)):
+        return True
+    # BadStatusLine stands in "''" for an empty status line
+    return isinstance(error, httplib.BadStatusLine) and error.line in ('', "''")
+
+
+class PooledResponse:
+    """An HTTP response whose connection returns to its ConnectionPool when it's closed
+
+    Reads like http.client.HTTPResponse; bytes_read counts the (still encoded) body bytes read.
+    bytes_sent is the size of the request body, and retries the number of times the request had to
+    be sent again on a new connection.
+    """
+
+    def __init__(self, pool, key, connection, response):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self.bytes_read = 0
+        self.bytes_sent = 0
+        self.retries = 0
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def getheaders(self):
+        return self.response.getheaders()
+
+    def read(self, amt=None):
+        data = self.response.read(amt)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool._release(self.key, connection)
+        else:
+            self.response.close()
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class DecodedResponse:
+    """Wraps a response, undoing a gzip or deflate Content-Encoding as the body is read
+
+    Nothing is buffered beyond the chunk being decompressed, so a compressed page can be fed
+    straight into a parser.  Each read() returns whatever the next chunk from the connection
+    decompresses to, which may be more or less than was asked for; b'' means the end.
+
+    compressed_bytes: body bytes read from the connection so far
+    uncompressed_bytes: decoded bytes returned so far
+    on_close: optional callable, called with this object when it's closed
+    """
+
+    def __init__(self, response, encoding='', on_close=None):
+        self.response = response
+        self.encoding = encoding.strip().lower()
+        self.on_close = on_close
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+        self.finished = False
+        if self.encoding == 'gzip':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self.decompressor = zlib.decompressobj()
+        else:
+            self.decompressor = None
+
+    def __decompress(self, chunk):
+        try:
+            return self.decompressor.decompress(chunk)
+        except zlib.error:
+            if self.encoding != 'deflate' or self.compressed_bytes != len(chunk):
+                raise
+            # Some servers send raw deflate data without the zlib header
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompressor.decompress(chunk)
+
+    def read(self, amt=65536):
+        if amt is None or amt < 0:
+            return b''.join(iter(lambda: self.read(65536), b''))
+        while not self.finished:
+            chunk = self.response.read(amt)
+            self.compressed_bytes += len(chunk)
+            if self.decompressor is None:
+                data = chunk
+            elif chunk:
+                data = self.__decompress(chunk)
+            else:
+                data = self.decompressor.flush()
+            if not chunk:
+                self.finished = True
+            if data:
+                self.uncompressed_bytes += len(data)
+                return data
+        return b''
+
+    def close(self):
+        if self.response is None:
+            return
+        response, self.response = self.response, None
+        response.close()
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
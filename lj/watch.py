@@ -0,0 +1,263 @@
+"""Keeping journal backups up to date continuously
+
+Instead of running backup.py every so often, which logs in, generates a session and opens the
+backup from scratch each time, watch mode keeps one LJServer and one open store per journal and
+polls for changes:
+
+ - syncitems, from the last sync time saved in the store, every 'interval' seconds; new and edited
+   entries, and new comments, are downloaded and saved as soon as they're found
+ - checkfriends, as often as the server's 'interval' allows
+
+Every account's polls share one Scheduler, which runs them on a small pool of worker threads, and
+one ConnectionPool.  Poll times are jittered so many accounts don't all poll at once, and failing
+polls back off exponentially.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from . import lj, storage, backup
+    from .sessions import SessionManager
+    from .transport import ConnectionPool
+except ImportError:
+    import lj
+    import storage
+    import backup
+    from sessions import SessionManager
+    from transport import ConnectionPool
+
+
+class Scheduler:
+    """Runs jobs at set times on a shared pool of worker threads
+
+    workers: how many jobs may run at once
+    retry: seconds to wait before running a job again after it first raises; each further failure
+        in a row doubles it, up to max_backoff
+
+    A job is a callable taking no arguments.  It returns how many seconds to wait before running it
+    again, or None to stop.  A job that raises is reported and run again after a backoff, so one
+    unexpected error doesn't stop it for good.
+    """
+
+    def __init__(self, workers=4, retry=30, max_backoff=3600):
+        self.queue = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.retry = retry
+        self.max_backoff = max_backoff
+        self.failures = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def add(self, job, delay=0):
+        """Runs 'job' in 'delay' seconds"""
+        with self.condition:
+            heapq.heappush(self.queue, (time.monotonic() + delay, next(self.counter), job))
+            self.condition.notify()
+
+    def run(self):
+        """Runs jobs as they fall due, until stop() is called"""
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    wait = self.queue[0][0] - time.monotonic() if self.queue else None
+                    if wait is not None and wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                if self.stopped:
+                    return
+                when, count, job = heapq.heappop(self.queue)
+            self.executor.submit(self.__run, job)
+
+    def __run(self, job):
+        try:
+            delay = job()
+        except Exception:
+            traceback.print_exc()
+            with self.condition:
+                failures = self.failures[job] = self.failures.get(job, 0) + 1
+            delay = min(self.max_backoff, self.retry * 2 ** (failures - 1))
+        else:
+            with self.condition:
+                self.failures.pop(job, None)
+        if delay is not None:
+            self.add(job, delay)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def shutdown(self):
+        """Stops, and waits for any jobs that are running to finish"""
+        self.stop()
+        self.executor.shutdown(wait=True)
+
+
+class Watcher:
+    """Keeps one journal's backup up to date
+
+    user, password: the account to log in as
+    store: an open storage.JournalStore holding the backup
+    server: the LJServer to use; backup.new_server() makes one by default
+    interval: seconds between syncitems polls
+    jitter: poll delays are randomly lengthened or shortened by up to this fraction
+    retry: seconds to wait after a first failed poll; each further failure doubles it, up to max_backoff
+    workers, meta_pages, meta_recent: as for backup.backup
+    meta_interval: seconds after which the comment metadata is walked again even if nothing new
+        has turned up, to catch older comments being screened, unscreened or deleted
+
+    Each sync first checks syncitems and the first page of comment metadata after the last comment
+    saved; only if either has something new (or meta_interval has passed) does it walk the recent
+    comment metadata and download new comments.
+
+    The Watcher's polls never run at the same time as each other, so the store is only ever used by
+    one thread at a time.  A poll that falls due while another is running doesn't wait for it,
+    tying up a scheduler worker, but is put off for busy_retry seconds.
+    """
+
+    busy_retry = 5
+
+    def __init__(self, user, password, store, server=None, interval=600, jitter=0.1, retry=30, max_backoff=3600,
+                 workers=2, meta_pages=2, meta_recent=1000, meta_interval=86400):
+        self.user = user
+        self.password = password
+        self.store = store
+        self.server = server or backup.new_server()
+        self.interval = interval
+        self.jitter = jitter
+        self.retry = retry
+        self.max_backoff = max_backoff
+        self.workers = workers
+        self.meta_pages = meta_pages
+        self.meta_recent = meta_recent
+        self.meta_interval = meta_interval
+        self.meta_checked = None
+        self.lock = threading.Lock()
+        self.logged_in = False
+        self.session = None
+        self.failures = {}
+
+    def start(self, scheduler):
+        """Schedules this journal's polls, spread over the first poll interval"""
+        scheduler.add(self.sync, random.uniform(0, self.jitter * self.interval))
+        scheduler.add(self.checkfriends, random.uniform(0, self.jitter * self.interval))
+
+    def __jittered(self, delay):
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def __failed(self, poll, error):
+        if not isinstance(error, (lj.LJException, IOError)):
+            # Not the server's doing (e.g. the store is locked, or a response made no sense)
+            traceback.print_exc()
+        failures = self.failures[poll] = self.failures.get(poll, 0) + 1
+        delay = self.__jittered(min(self.max_backoff, self.retry * 2 ** (failures - 1)))
+        print("%s: %s failed (%s), trying again in %d seconds" % (self.user, poll, error, delay))
+        return delay
+
+    def __login(self):
+        if not self.logged_in:
+            self.store.set('login', self.server.login(self.user, self.password, getpickws=True, getpickwurls=True))
+            self.server.lastupdate = self.store.get('friends_lastupdate')
+            self.logged_in = True
+
+    def __comments_due(self):
+        """Returns whether there are new comments, or it's time to re-check the old ones anyway"""
+        if self.meta_checked is None or time.monotonic() - self.meta_checked >= self.meta_interval:
+            return True
+        last_comment = int(self.store.get('last_comment', '0'))
+        highest, maxid, changed = backup.fetch_meta_page(self.server, last_comment + 1, self.session, self.store)
+        return maxid > last_comment
+
+    def sync(self):
+        """Downloads whatever's new since the last sync; returns the delay until the next one"""
+        if not self.lock.acquire(False):
+            return self.__jittered(self.busy_retry)
+        try:
+            self.__login()
+            entries = backup.update_journal_entries(self.server, self.store, self.workers)
+            if self.session is None and self.server.sessions is None:
+                self.session = self.server.sessiongenerate('long')
+            comments = 0
+            if entries or self.__comments_due():
+                comments = backup.update_journal_comments(self.server, self.store, self.meta_pages,
+                                                          self.meta_recent, self.workers, self.session)
+                self.meta_checked = time.monotonic()
+            self.failures['sync'] = 0
+        except Exception as e:
+            # The session may be what's wrong; get a new one next time
+            self.session = None
+            return self.__failed('sync', e)
+        finally:
+            self.lock.release()
+        if entries or comments:
+            print("%s: %d new or edited entries, %d new comments" % (self.user, entries, comments))
+        return self.__jittered(self.interval)
+
+    def checkfriends(self):
+        """Polls checkfriends; returns the delay the server asks for before the next poll"""
+        if not self.lock.acquire(False):
+            return self.__jittered(self.busy_retry)
+        try:
+            self.__login()
+            response = self.server.checkfriends()
+            self.store.set('friends_lastupdate', response['lastupdate'])
+            self.failures['checkfriends'] = 0
+        except Exception as e:
+            return self.__failed('checkfriends', e)
+        finally:
+            self.lock.release()
+        if response.get('new'):
+            print("%s: friends page updated at %s" % (self.user, response['lastupdate']))
+        return self.__jittered(max(int(response.get('interval') or 0), 1))
+
+    def close(self):
+        with self.lock:
+            if self.server.sessions is not None:
+                self.session = self.server.sessions.forget(self.server)
+            if self.session is not None:
+                try:
+                    self.server.sessionexpire(self.session)
+                except (lj.LJException, IOError):
+                    pass
+                self.session = None
+            self.store.close()
+
+
+def watch_accounts(accounts, interval=600, workers=4, metrics=None, login_cache=None, sessions=None):
+    """Keeps the backups of several journals up to date until interrupted
+    accounts: a list of dictionaries as returned by backup.account_options
+    interval: seconds between syncitems polls for each journal
+    workers: how many polls may run at once, across all the journals
+    metrics, login_cache, sessions: as for backup.backup_accounts; by default session cookies are
+        shared between the journals' polls, but not kept between runs
+    """
+    pool = ConnectionPool()
+    if sessions is None:
+        sessions = SessionManager()
+    scheduler = Scheduler(workers)
+    watchers = []
+    try:
+        for account in accounts:
+            store = storage.open_store(account['file'], account['backend'])
+            watcher = Watcher(account['username'], account['password'], store,
+                              backup.new_server(pool, host=account.get('host'), metrics=metrics,
+                                                login_cache=login_cache, sessions=sessions),
+                              interval, workers=account['workers'], meta_pages=account['meta_pages'],
+                              meta_recent=account['meta_recent'])
+            watchers.append(watcher)
+            watcher.start(scheduler)
+        print("Watching %d journals" % len(watchers))
+        scheduler.run()
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        scheduler.shutdown()
+        for watcher in watchers:
+            watcher.close()
+        pool.close()
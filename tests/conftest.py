@@ -0,0 +1,41 @@
+"""Fixtures for the tests, which run the library against lj.fakeserver.FakeLJServer
+
+Page sizes are kept small so that even a small journal takes several pages of everything.
+"""
+
+import pytest
+
+from lj import lj, fakeserver
+
+
+def logged_in(fake, **options):
+    """Returns an LJServer for 'fake', logged in as test/test"""
+    server = lj.LJServer('Python-lj.py/0.0.1', 'lj.py tests', fake.url, fast_decode=True, **options)
+    server.login('test', 'test')
+    return server
+
+
+@pytest.fixture
+def new_server():
+    """Gives tests that need a server for another FakeLJServer, or other options, logged_in"""
+    return logged_in
+
+
+@pytest.fixture
+def fake():
+    with fakeserver.FakeLJServer(entries=120, comments=1500, meta_page=1000, body_page=200, sync_page=50,
+                                 events_page=20) as fake:
+        yield fake
+
+
+@pytest.fixture
+def server(fake):
+    return logged_in(fake)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Makes time.sleep return at once, for code that backs off before retrying"""
+    slept = []
+    monkeypatch.setattr('time.sleep', slept.append)
+    return slept
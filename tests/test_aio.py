@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from lj import aio, lj
+
+
+async def dropping_server(received):
+    """Starts a server that answers the first request on each connection, and hangs up on the
+    second after reading it; returns the server and its url
+    """
+    async def handle(reader, writer):
+        answered = False
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except asyncio.IncompleteReadError:
+                break
+            length = [int(line.split(b':')[1]) for line in head.split(b'\r\n')
+                      if line.lower().startswith(b'content-length:')]
+            received.append(await reader.readexactly(length[0]) if length else head.split(b' ')[0])
+            if answered:
+                break
+            answered = True
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+            await writer.drain()
+        writer.close()
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    return server, 'http://127.0.0.1:%d/' % server.sockets[0].getsockname()[1]
+
+
+def test_posts_are_never_sent_twice():
+    received = []
+
+    async def run():
+        server, url = await dropping_server(received)
+        transport = aio.AsyncHTTPTransport()
+        try:
+            assert (await transport.request('POST', url, b'postevent-1'))[2] == b'ok'
+            with pytest.raises(ConnectionError):
+                await transport.request('POST', url, b'postevent-2')
+        finally:
+            await transport.close()
+            server.close()
+    asyncio.run(run())
+    assert received == [b'postevent-1', b'postevent-2']
+
+
+def test_idempotent_requests_are_sent_again():
+    received = []
+
+    async def run():
+        server, url = await dropping_server(received)
+        transport = aio.AsyncHTTPTransport()
+        try:
+            assert (await transport.request('GET', url))[2] == b'ok'
+            assert (await transport.request('GET', url))[2] == b'ok'
+            assert (await transport.request('POST', url, b'getevents', idempotent=True))[2] == b'ok'
+        finally:
+            await transport.close()
+            server.close()
+    asyncio.run(run())
+    assert received == [b'GET', b'GET', b'GET', b'getevents', b'getevents']
+
+
+def test_server_calls(fake):
+    async def run():
+        server = aio.AsyncLJServer('Python-lj.py/0.0.1', 'lj.py tests', fake.url, fast_decode=True)
+        try:
+            await server.login('test', 'test')
+            entries = await asyncio.gather(*[server.getevents_one(itemid) for itemid in range(1, 11)])
+            posted = await server.postevent('Posted from asyncio', 'Hello')
+        finally:
+            await server.close()
+        return entries, posted
+    entries, posted = asyncio.run(run())
+    assert [entry['events'][0]['itemid'] for entry in entries] == list(range(1, 11))
+    assert fake.journals['test'].changed[posted['itemid']]['event'] == 'Posted from asyncio'
+
+
+def test_server_errors(fake):
+    async def run():
+        server = aio.AsyncLJServer('Python-lj.py/0.0.1', 'lj.py tests', fake.url)
+        try:
+            with pytest.raises(lj.LJException):
+                await server.login('test', 'wrong')
+            assert server.client.user is None
+            await server.login('test', 'test')
+            fake.fail('getevents')
+            with pytest.raises(lj.LJRateLimited):
+                await server.getevents_one(1)
+        finally:
+            await server.close()
+    asyncio.run(run())
@@ -0,0 +1,91 @@
+import pytest
+
+from lj import lj, backup, storage
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = storage.open_store(str(tmp_path / 'backup.db'), 'sqlite')
+    yield store
+    store.close()
+
+
+def states(store, *ids):
+    rows = store.db.execute('SELECT id, state FROM comments WHERE id IN (%s)' % ','.join('?' * len(ids)), ids)
+    return dict(rows.fetchall())
+
+
+def test_full_backup(server, store):
+    entries, comments = backup.update_journal(server, store, {})
+    assert (entries, comments) == (120, 1500)
+    assert store.count_entries() == 120
+    assert store.count_comments() == 1500
+    assert store.pending_entries() == []
+    assert store.get('last_comment') == '1500'
+
+
+def test_incremental_backup_fetches_only_what_changed(fake, server, store):
+    backup.update_journal(server, store, {})
+    assert backup.update_journal(server, store, {}) == (0, 0)
+
+    server.postevent('A new entry', 'New')
+    fake.add_comments(30)
+    getevents = fake.calls['getevents']
+    bodies = fake.calls['comment_body']
+    assert backup.update_journal(server, store, {}) == (1, 30)
+    assert store.count_entries() == 121
+    assert store.count_comments() == 1530
+    assert fake.calls['getevents'] == getevents + 1
+    assert fake.calls['comment_body'] == bodies + 1
+
+
+def test_interrupted_backup_resumes(fake, server, store):
+    fake.fail('getevents', times=1, status=500)
+    with pytest.raises(lj.LJException):
+        backup.update_journal(server, store, {})
+    assert store.pending_entries()
+
+    backup.update_journal(server, store, {})
+    assert store.count_entries() == 120
+    assert store.pending_entries() == []
+    assert store.count_comments() == 1500
+
+
+def test_comment_metadata_is_only_rewritten_when_it_changes(fake, server, store, capsys):
+    backup.update_journal(server, store, {})
+    backup.update_journal(server, store, {})
+    assert 'Updated metadata' not in capsys.readouterr().out
+
+    fake.set_comment_state(1490, 'S')
+    fake.set_comment_state(10, 'D')
+    backup.update_journal_comments(server, store, meta_pages=2, meta_recent=100)
+    assert 'Updated metadata for 2 comments' in capsys.readouterr().out
+    assert states(store, 10, 1490) == {10: 'D', 1490: 'S'}
+
+
+def test_pickle_backups_are_migrated(server, tmp_path, caplog):
+    path = str(tmp_path / 'backup.pkl')
+    old = backup.load_journal(path)
+    assert old == backup.DEFAULT_JOURNAL
+    old['entries'][1] = {'itemid': 1, 'subject': 'Kept', 'event': 'From the pickle'}
+    old['last_comment'] = '0'
+    backup.save_journal(path, old)
+    with caplog.at_level('INFO', 'lj.storage'):
+        store = storage.open_store(path)
+    try:
+        assert 'Migrating' in caplog.text
+        assert store.to_journal()['entries'][1]['subject'] == 'Kept'
+    finally:
+        store.close()
+    assert (tmp_path / 'backup.sqlite').exists()
+
+
+def test_deprecated_helpers(server):
+    journal = dict(backup.DEFAULT_JOURNAL)
+    with pytest.deprecated_call():
+        items = backup.built_syncitems_list(server, journal)
+    assert sorted(itemid for itemid, when in items) == list(range(1, 121))
+    assert journal['last_entry'] == max(when for itemid, when in items)
+    with pytest.deprecated_call():
+        comments = backup.get_bodies_since('1000', '1500', server, server.sessiongenerate())
+    assert sorted(int(id) for id in comments) == list(range(1001, 1501))
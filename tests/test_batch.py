@@ -0,0 +1,96 @@
+import pytest
+
+from lj import lj, fakeserver, metrics
+
+
+def test_batch_sends_calls_together(fake, new_server):
+    recorded = metrics.Metrics()
+    server = new_server(fake, metrics=recorded)
+    with server.batch() as batch:
+        calls = [batch.getevents_one(itemid) for itemid in (1, 2, 3)]
+    assert [call.result()['events'][0]['itemid'] for call in calls] == [1, 2, 3]
+    assert all(call.sent for call in calls)
+    summary = recorded.summary()
+    assert summary['system.multicall']['requests'] == 2  # the challenges, then the calls
+    assert 'getevents' not in summary
+
+
+def test_batch_falls_back_to_one_call_at_a_time(new_server):
+    with fakeserver.FakeLJServer(entries=10, comments=0, multicall=False) as fake:
+        server = new_server(fake)
+        with server.batch() as batch:
+            calls = [batch.getevents_one(itemid) for itemid in (1, 2, 3)]
+        assert [call.result()['events'][0]['itemid'] for call in calls] == [1, 2, 3]
+        assert server.multicall_supported is False
+        assert fake.calls['getevents'] == 3
+
+
+def test_faults_belong_to_their_own_call(server):
+    batch = server.batch()
+    good = batch.getevents_one(1)
+    bad = batch.postevent('')
+    batch.execute()
+    assert good.result()['events'][0]['itemid'] == 1
+    assert bad.sent is True
+    with pytest.raises(lj.LJException):
+        bad.result()
+
+
+def test_fallback_stops_at_a_failed_call(new_server):
+    with fakeserver.FakeLJServer(entries=10, comments=0, multicall=False) as fake:
+        server = new_server(fake)
+        batch = server.batch()
+        first = batch.postevent('First')
+        second = batch.postevent('Second')
+        fake.fail('getevents')
+        failing = batch.getevents_one(1)
+        last = batch.postevent('Last')
+        with pytest.raises(lj.LJRateLimited):
+            batch.execute()
+        # The calls before the failure were carried out, and say so
+        assert first.result()['itemid'] and second.result()['itemid']
+        assert failing.done and failing.sent is None and isinstance(failing.error, lj.LJRateLimited)
+        assert last.done and last.sent is False
+        assert sorted(entry['event'] for entry in fake.journals['test'].changed.values()) == ['First', 'Second']
+
+
+@pytest.mark.parametrize('pool', [False, True])
+def test_failed_challenges_fail_every_call(fake, server, pool):
+    if pool:
+        server.enable_challenge_pool(size=3, low_water=1)
+        server.challenges.challenges.clear()
+    fake.fail('getchallenge')
+    batch = server.batch()
+    calls = [batch.postevent('Entry %d' % number) for number in range(3)]
+    with pytest.raises(lj.LJRateLimited):
+        batch.execute()
+    for call in calls:
+        assert call.done and call.sent is False
+        with pytest.raises(lj.LJRateLimited):
+            call.result()
+    assert not fake.journals['test'].changed
+
+
+def test_other_multicall_faults_dont_turn_multicall_off(fake, server):
+    multicall = fake.dispatcher.funcs['system.multicall']
+    faults = []
+
+    def flaky(calls):
+        if faults:
+            raise faults.pop()
+        return multicall(calls)
+    fake.dispatcher.funcs['system.multicall'] = flaky
+    # Fill the pool first, so that the fault is the one for the calls themselves
+    server.enable_challenge_pool(size=10).get()
+    for attempt in range(2):
+        batch = server.batch()
+        calls = [batch.getevents_one(itemid) for itemid in (1, 2)]
+        faults.append(lj.xmlrpclib.Fault(500, 'Temporarily unavailable'))
+        with pytest.raises(lj.LJException):
+            batch.execute()
+        assert all(call.done and call.sent is None for call in calls)
+        assert server.multicall_supported is not False
+    with server.batch() as batch:
+        calls = [batch.getevents_one(itemid) for itemid in (1, 2)]
+    assert [call.result()['events'][0]['itemid'] for call in calls] == [1, 2]
+    assert server.multicall_supported is True
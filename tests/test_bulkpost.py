@@ -0,0 +1,79 @@
+import collections
+import json
+
+import pytest
+
+from lj import bulkpost, fakeserver
+
+
+def entries(count, subject='Entry %d'):
+    return [{'id': str(number), 'event': 'Event %d' % number, 'subject': subject % number,
+             'e_datetime': '2020-01-%02d 12:%02d' % (1 + number % 28, number % 60)} for number in range(count)]
+
+
+def posts(fake):
+    """Returns how many times each event was posted"""
+    return collections.Counter(entry['event'] for entry in fake.journals['test'].changed.values())
+
+
+@pytest.fixture
+def empty():
+    with fakeserver.FakeLJServer(entries=0, comments=0) as fake:
+        yield fake
+
+
+@pytest.fixture
+def sequential():
+    with fakeserver.FakeLJServer(entries=0, comments=0, multicall=False) as fake:
+        yield fake
+
+
+def test_posts_every_entry_once_and_resumes(empty, tmp_path, new_server):
+    server = new_server(empty)
+    path = str(tmp_path / 'progress.jsonl')
+    summary = bulkpost.bulk_post(server, entries(40), path, workers=2, batch=7, progress=0)
+    assert (summary['posted'], summary['failed'], summary['uncertain']) == (40, 0, 0)
+    summary = bulkpost.bulk_post(server, entries(45), path, workers=2, batch=7, progress=0)
+    assert (summary['posted'], summary['skipped']) == (5, 40)
+    assert set(posts(empty).values()) == {1} and len(posts(empty)) == 45
+
+
+def test_failed_challenges_are_not_counted_as_posted(empty, tmp_path, no_sleep, new_server):
+    server = new_server(empty)
+    empty.fail('getchallenge', times=2)
+    summary = bulkpost.bulk_post(server, entries(30), str(tmp_path / 'progress.jsonl'), workers=1, batch=10,
+                                 progress=0)
+    assert summary['posted'] == 30
+    assert len(posts(empty)) == 30 and set(posts(empty).values()) == {1}
+
+
+def test_sequential_fallback_never_reposts(sequential, tmp_path, no_sleep, new_server):
+    server = new_server(sequential)
+    path = str(tmp_path / 'progress.jsonl')
+    sequential.fail('postevent', times=3)
+    bulkpost.bulk_post(server, entries(40), path, workers=1, batch=10, progress=0)
+    bulkpost.bulk_post(server, entries(40), path, workers=1, batch=10, progress=0)
+    assert len(posts(sequential)) == 40 and set(posts(sequential).values()) == {1}
+
+
+def test_uncertain_entries_are_found_rather_than_reposted(empty, tmp_path, new_server):
+    server = new_server(empty)
+    path = str(tmp_path / 'progress.jsonl')
+    # Subjects longer than LJ takes are cut short, and must still be recognised
+    batch = entries(20, subject='A rather long subject, repeated until it is too long for LJ ' * 3 + '%d')
+    bulkpost.bulk_post(server, batch, path, batch=5, progress=0)
+    # As if the responses to some posts never arrived
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    with open(path, 'a') as f:
+        for record in records:
+            if record['state'] == 'posting' and record['key'] in ('3', '11', '19'):
+                f.write(json.dumps(record) + '\n')
+    journal = bulkpost.PostJournal(path)
+    try:
+        assert sorted(journal.pending) == ['11', '19', '3']
+        summary = bulkpost.BulkPoster(server, journal, progress=0).run(batch)
+    finally:
+        journal.close()
+    assert (summary['posted'], summary['skipped']) == (0, 20)
+    assert set(posts(empty).values()) == {1}
@@ -0,0 +1,41 @@
+import datetime
+
+from lj import lj
+
+try:
+    import xmlrpc.client as xmlrpclib
+except ImportError:
+    import xmlrpclib
+
+
+def getevents_response():
+    return xmlrpclib.dumps(({'events': [{
+        'itemid': 1,
+        'eventtime': xmlrpclib.DateTime(datetime.datetime(2007, 1, 1, 12)),
+        'subject': xmlrpclib.Binary(u'Тема'.encode('utf-8')),
+        'event': xmlrpclib.Binary(b'\xff not UTF-8'),
+        'props': {'taglist': 'one, two'},
+    }]},), methodresponse=True).encode('utf-8')
+
+
+def test_fast_loads_gives_builtin_types():
+    event = lj.fast_loads(getevents_response())[0]['events'][0]
+    assert event['subject'] == u'Тема'.encode('utf-8')
+    assert event['eventtime'] == datetime.datetime(2007, 1, 1, 12)
+    assert event['props'] == {'taglist': 'one, two'}
+
+
+def test_entry_records_decode_text_when_looked_up():
+    entry = lj.entry_record(lj.fast_loads(getevents_response())[0]['events'][0])
+    assert not entry.is_loaded('subject')
+    assert entry['subject'] == u'Тема'
+    assert entry.is_loaded('subject')
+    assert entry['event'] == b'\xff not UTF-8'
+    assert dict(entry)['itemid'] == 1
+
+
+def test_fast_decode_server(fake):
+    server = lj.LJServer('Python-lj.py/0.0.1', 'lj.py tests', fake.url, fast_decode=True)
+    server.login('test', 'test')
+    event = server.getevents_one(1)['events'][0]
+    assert event['itemid'] == 1 and isinstance(event['event'], str)
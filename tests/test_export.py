@@ -0,0 +1,19 @@
+from lj import export, storage
+
+
+def test_export_saves_spans_in_order(server, tmp_path, capsys):
+    store = storage.open_store(str(tmp_path / 'backup.db'))
+    saved = []
+
+    def progress(exporter, downloaded):
+        saved.append((downloaded, store.get('last_comment')))
+    try:
+        exporter = export.CommentExporter(server, server.sessiongenerate(), workers=3, span=300, progress=progress)
+        assert exporter.export('100', '1500', store) == 1400
+        assert store.count_comments() == 1400
+    finally:
+        store.close()
+    assert saved == [(min(1400, 300 * n), str(min(1500, 100 + 300 * n))) for n in range(1, 6)]
+    assert exporter.comments == 1400 and exporter.pages >= 7
+    # Progress is the caller's to report
+    assert capsys.readouterr().out == ''
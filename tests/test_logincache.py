@@ -0,0 +1,73 @@
+import pickle
+import time
+
+import pytest
+
+from lj import lj, logincache
+
+
+@pytest.fixture
+def logins(fake):
+    """Records the arguments of every login the fake server gets"""
+    seen = []
+    login = fake.dispatcher.funcs['LJ.XMLRPC.login']
+
+    def recorded(args):
+        seen.append(args)
+        return login(args)
+    fake.dispatcher.funcs['LJ.XMLRPC.login'] = recorded
+    return seen
+
+
+def cached_login(fake, cache, **options):
+    server = lj.LJServer('Python-lj.py/0.0.1', 'lj.py tests', fake.url, login_cache=cache)
+    return server.login('test', 'test', **options)
+
+
+def test_only_new_moods_are_fetched(fake, logins):
+    cache = logincache.LoginCache()
+    first = cached_login(fake, cache, getmoods=0)
+    second = cached_login(fake, cache, getmoods=0)
+    assert logins[1]['getmoods'] == max(int(mood['id']) for mood in first['moods'])
+    assert second['moods'] == first['moods']
+
+
+def test_cached_pickws_are_used_while_fresh(fake, logins):
+    cache = logincache.LoginCache()
+    first = cached_login(fake, cache, getpickws=True, getpickwurls=True)
+    second = cached_login(fake, cache, getpickws=True, getpickwurls=True)
+    assert 'getpickws' in logins[0] and 'getpickws' not in logins[1]
+    assert second['pickws'] == first['pickws'] and second['pickwurls'] == first['pickwurls']
+
+
+def test_each_key_has_its_own_age(fake, logins):
+    cache = logincache.LoginCache(ttl=60)
+    cached_login(fake, cache, getpickws=True)
+    updated = cache.get('test', fake.url)['updated']
+    # Age the pickws, then log in for menus only: that mustn't make the pickws fresh again
+    cache.entries[('test', fake.url)]['updated'] = dict(updated, pickws=time.time() - 120)
+    cached_login(fake, cache, getmenus=True)
+    assert not cache.fresh('test', fake.url, 'pickws')
+    assert cache.fresh('test', fake.url, 'menus')
+    cached_login(fake, cache, getpickws=True)
+    assert logins[2].get('getpickws')
+    assert cache.fresh('test', fake.url, 'pickws')
+
+
+def test_fetched_keys_the_server_left_out_are_dropped():
+    cache = logincache.LoginCache()
+    cache.update('test', 'example.com', {'pickws': ['cat'], 'pickwurls': ['http://example.com/cat.png']})
+    entry = cache.update('test', 'example.com', {'pickws': ['dog']}, ['pickws', 'pickwurls'])
+    assert entry['pickws'] == ['dog'] and 'pickwurls' not in entry
+
+
+def test_old_caches_are_stale(tmp_path):
+    path = str(tmp_path / 'logins')
+    # Caches used to keep one time for the whole entry
+    with open(path, 'wb') as f:
+        pickle.dump({('test', 'example.com'): {'pickws': ['cat'], 'updated': time.time()}}, f)
+    cache = logincache.LoginCache(path)
+    assert not cache.fresh('test', 'example.com', 'pickws')
+    cache.update('test', 'example.com', {'pickws': ['dog']})
+    assert cache.fresh('test', 'example.com', 'pickws')
+    assert logincache.LoginCache(path).get('test', 'example.com')['pickws'] == ['dog']
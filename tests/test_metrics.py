@@ -0,0 +1,64 @@
+import pytest
+
+from lj import lj, metrics
+
+
+def test_quantiles_interpolate_within_buckets():
+    histogram = metrics.Histogram(buckets=(1, 2, 3))
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 1.5, 1.5, 2.5):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert histogram.quantile(1) == pytest.approx(3)
+    histogram.observe(100)
+    assert histogram.quantile(1) == 3
+
+
+def test_requests_are_counted_by_method(fake, new_server):
+    recorded = metrics.Metrics()
+    server = new_server(fake, metrics=recorded)
+    server.getevents_one(1)
+    server.getevents_one(2)
+    summary = recorded.summary()
+    assert summary['getevents']['requests'] == 2
+    assert summary['getevents']['bytes_sent'] > 0 and summary['getevents']['bytes_received'] > 0
+    assert summary['getevents']['p50'] <= summary['getevents']['p95']
+    assert 'errors' not in summary['getevents']
+    assert 'challenge_seconds' in [name for name, labels in recorded.snapshot()]
+
+
+def test_errors_are_counted_by_class(fake, new_server):
+    recorded = metrics.Metrics()
+    server = new_server(fake, metrics=recorded)
+    fake.fail('getevents')
+    with pytest.raises(lj.LJRateLimited):
+        server.getevents_one(1)
+    with pytest.raises(lj.LJException):
+        server.postevent('')
+    assert recorded.summary()['getevents']['errors'] == 1
+    assert recorded.counters[('request_errors_total', (('error', 'fault'), ('method', 'postevent')))] == 1
+    assert recorded.counters[('request_errors_total', (('error', 'rate_limited'), ('method', 'getevents')))] == 1
+
+
+def test_prometheus_format(fake, new_server):
+    recorded = metrics.Metrics(buckets=(0.5, 60), prefix='test_')
+    server = new_server(fake, metrics=recorded)
+    server.getevents_one(1)
+    lines = recorded.prometheus().splitlines()
+    assert '# TYPE test_request_seconds histogram' in lines
+    assert 'test_request_seconds_bucket{method="getevents",le="60"} 1' in lines
+    assert 'test_request_seconds_bucket{method="getevents",le="+Inf"} 1' in lines
+    assert 'test_request_seconds_count{method="getevents"} 1' in lines
+    assert '# TYPE test_bytes_sent_total counter' in lines
+    assert metrics.format_labels((('method', 'a"b\\c\n'),)) == '{method="a\\"b\\\\c\\n"}'
+
+
+def test_error_classes():
+    assert lj.error_class(lj.LJRateLimited('slow down')) == 'rate_limited'
+    assert lj.error_class(lj.LJException(lj.xmlrpclib.Fault(101, 'Invalid password'))) == 'fault'
+    assert lj.error_class(lj.xmlrpclib.ProtocolError('url', 500, 'Server error', {})) == 'http'
+    assert lj.error_class(lj.xmlrpclib.ProtocolError('url', 503, 'Unavailable', {})) == 'rate_limited'
+    assert lj.error_class(lj.LJException(ConnectionResetError())) == 'network'
+    assert lj.error_class(lj.LJException('HTTP error 404 Not Found fetching url')) == 'http'
+    assert lj.error_class(ValueError()) == 'ValueError'
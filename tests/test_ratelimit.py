@@ -0,0 +1,109 @@
+import threading
+
+import pytest
+
+from lj import ratelimit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A clock that only moves when told to, or when something sleeps"""
+    now = [100.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+    monkeypatch.setattr('time.monotonic', lambda: now[0])
+    monkeypatch.setattr('time.sleep', sleep)
+    return now
+
+
+def test_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = ratelimit.TokenBucket(rate=2, burst=3)
+    assert [bucket.try_acquire() for i in range(4)] == [True, True, True, False]
+    clock[0] += 0.5
+    assert bucket.try_acquire() and not bucket.try_acquire()
+
+
+def test_bucket_waiters_take_turns(clock):
+    bucket = ratelimit.TokenBucket(rate=4, burst=1)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.25)
+    # The second waiter reserved its token, so the next waits for the one after
+    clock[0] -= 0.25
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_hosts_have_their_own_buckets(clock):
+    limiter = ratelimit.HostRateLimiter(rate=1, rates={'slow.example': 0.5})
+    assert limiter.acquire('a.example') == 0
+    assert limiter.acquire('b.example') == 0
+    assert limiter.acquire('a.example') == pytest.approx(1)
+    assert limiter.bucket('slow.example').rate == 0.5
+    assert limiter.waited == pytest.approx(1)
+
+
+def test_method_limits_add_to_host_limits(clock):
+    limiter = ratelimit.RequestLimiter(host_rate=10, method_rates={'postevent': 1}, burst=1)
+    assert limiter.acquire('h', 'postevent') == 0
+    assert limiter.acquire('h', 'postevent') == pytest.approx(1)
+    # getevents is only held to the host's rate, whose last token the second postevent took
+    assert limiter.acquire('h', 'getevents') == pytest.approx(0.1)
+    assert ratelimit.RequestLimiter().acquire('h', 'postevent') == 0
+
+
+def test_concurrency_grows_while_requests_are_fast(clock):
+    concurrency = ratelimit.AdaptiveConcurrency(initial=2, maximum=3)
+    for i in range(10):
+        started = concurrency.acquire()
+        clock[0] += 0.1
+        concurrency.release(started)
+    assert concurrency.limit == 3
+    assert concurrency.baseline == pytest.approx(0.1)
+
+
+def test_concurrency_drops_on_failures_and_slow_responses(clock):
+    concurrency = ratelimit.AdaptiveConcurrency(initial=8, minimum=2)
+    started = concurrency.acquire()
+    clock[0] += 0.1
+    concurrency.release(started)
+    started = concurrency.acquire()
+    clock[0] += 0.5  # more than twice the baseline
+    concurrency.release(started)
+    assert int(concurrency.limit) == 4
+    for expected in (2, 2):
+        clock[0] += 0.01
+        started = concurrency.acquire()
+        clock[0] += 0.1
+        concurrency.release(started, ok=False)
+        assert int(concurrency.limit) == expected
+
+
+def test_a_burst_of_failures_cuts_the_limit_once(clock):
+    concurrency = ratelimit.AdaptiveConcurrency(initial=8)
+    starts = [concurrency.acquire() for i in range(4)]
+    clock[0] += 0.1
+    for started in starts:
+        concurrency.release(started, ok=False)
+    assert concurrency.limit == 4
+    assert concurrency.in_flight == 0
+
+
+def test_slots_wait_for_room_and_count_exceptions_as_failures():
+    concurrency = ratelimit.AdaptiveConcurrency(initial=1)
+    entered = threading.Event()
+
+    def second():
+        with concurrency.slot():
+            entered.set()
+    with concurrency.slot():
+        waiting = threading.Thread(target=second)
+        waiting.start()
+        waiting.join(0.1)
+        assert not entered.is_set()
+    waiting.join(1)
+    assert entered.is_set()
+    concurrency = ratelimit.AdaptiveConcurrency(initial=4)
+    with pytest.raises(ValueError):
+        with concurrency.slot():
+            raise ValueError()
+    assert concurrency.limit == 2 and concurrency.in_flight == 0
@@ -0,0 +1,57 @@
+import copy
+import pickle
+import sys
+
+import pytest
+
+from lj.records import Comment, Entry, Lazy
+
+
+def test_usual_keys_live_in_slots():
+    comment = Comment({'posterid': '5', 'state': 'A', 'jitemid': '7', 'parentid': '0', 'body': 'Hi',
+                       'poster_ip': '127.0.0.1'})
+    assert not hasattr(comment, '__dict__')
+    assert comment.extra == {'poster_ip': '127.0.0.1'}
+    assert comment['state'] == 'A' and comment['poster_ip'] == '127.0.0.1'
+    assert len(comment) == 6
+    assert 'subject' not in comment and comment.get('subject') is None
+    with pytest.raises(KeyError):
+        comment['subject']
+
+
+def test_repeated_strings_are_interned():
+    states = [''.join(['S', '']) for i in range(2)]
+    first, second = Comment(state=states[0]), Comment(state=states[1])
+    assert first['state'] is second['state'] is sys.intern('S')
+
+
+def test_records_update_like_dictionaries():
+    entry = Entry(itemid=1, subject='Before')
+    entry['subject'] = 'After'
+    entry['mood'] = 'ok'
+    del entry['itemid']
+    assert dict(entry) == {'subject': 'After', 'mood': 'ok'}
+    del entry['mood']
+    assert entry.extra == {}
+    with pytest.raises(KeyError):
+        del entry['itemid']
+
+
+def test_lazy_values_load_once():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return 'The body'
+    comment = Comment(body=Lazy(load))
+    assert not comment.is_loaded('body')
+    assert comment['body'] == 'The body' and comment['body'] == 'The body'
+    assert comment.is_loaded('body') and loads == [1]
+
+
+def test_copies_and_pickles_are_plain_dictionaries():
+    entry = Entry(itemid=1, event=Lazy(lambda: 'Text'), props={'taglist': 'a'}, url='http://example.com/1.html')
+    for copied in (pickle.loads(pickle.dumps(entry)), copy.copy(entry)):
+        assert type(copied) is dict
+        assert copied == {'itemid': 1, 'event': 'Text', 'props': {'taglist': 'a'}, 'url': 'http://example.com/1.html'}
+    assert entry == dict(entry)
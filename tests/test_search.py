@@ -0,0 +1,38 @@
+import pytest
+
+from lj import backup, storage
+
+
+@pytest.fixture(params=['sqlite', 'pickle'])
+def store(request, tmp_path):
+    store = storage.open_store(str(tmp_path / 'backup'), request.param)
+    store.put_entries([
+        {'itemid': 1, 'subject': 'Lighthouse keeping', 'event': 'The <b>lamp</b> needs oil', 'props': {}},
+        {'itemid': 2, 'subject': 'Gardening', 'event': 'Tomatoes and beans', 'props': {'taglist': 'garden'}},
+    ])
+    store.put_comments({'7': {'jitemid': '2', 'parentid': '0', 'posterid': '1', 'state': 'A',
+                              'body': 'How are the tomatoes?', 'subject': '', 'date': '2007-01-01T00:00:00Z'}})
+    yield store
+    store.close()
+
+
+def test_search_finds_entries_and_comments(store):
+    assert [(hit['type'], hit['id']) for hit in store.search('lamp')] == [('entry', 1)]
+    assert sorted((hit['type'], hit['id']) for hit in store.search('tomatoes')) == [('comment', 7), ('entry', 2)]
+    assert store.search('lamp tomatoes') == []
+
+
+@pytest.mark.parametrize('query', ['', '   ', '!!!', '"', '- * ('])
+def test_queries_without_words_find_nothing(store, query):
+    assert store.search(query) == []
+
+
+def test_unparseable_queries_are_searched_as_words(store):
+    assert [hit['id'] for hit in store.search('lamp!')] == [1]
+
+
+def test_search_command_with_a_blank_query(tmp_path, capsys):
+    path = str(tmp_path / 'backup.sqlite')
+    storage.open_store(path).close()
+    backup.search_backup(path, '')
+    assert capsys.readouterr().out.startswith('0 matches')
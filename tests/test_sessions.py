@@ -0,0 +1,56 @@
+import os
+import stat
+import time
+
+from lj import sessions
+
+
+def test_servers_share_a_session(fake, new_server):
+    manager = sessions.SessionManager()
+    first = new_server(fake, sessions=manager)
+    second = new_server(fake, sessions=manager)
+    assert first.fetch_comment_meta()['comments']
+    assert second.fetch_comment_meta()['comments']
+    assert manager.get(first) == manager.get(second)
+    assert manager.generated == 1
+    assert fake.calls['sessiongenerate'] == 1
+
+
+def test_sessions_are_kept_between_runs(fake, server, tmp_path):
+    path = str(tmp_path / 'sessions')
+    session = sessions.SessionManager(path).get(server)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    again = sessions.SessionManager(path)
+    assert again.get(server) == session
+    assert again.generated == 0
+
+
+def test_sessions_close_to_expiring_are_replaced(server):
+    manager = sessions.SessionManager(margin=3600)
+    session = manager.get(server)
+    key, (cookie, expires) = next(iter(manager.sessions.items()))
+    manager.sessions[key] = (cookie, time.time() + 60)
+    assert manager.get(server) != session
+    assert manager.generated == 2
+
+
+def test_renew_and_forget(server):
+    manager = sessions.SessionManager()
+    session = manager.get(server)
+    renewed = manager.renew(server, session)
+    assert renewed != session
+    # Another thread turning down the old cookie gets the replacement
+    assert manager.renew(server, session) == renewed
+    assert manager.forget(server) == renewed
+    assert manager.forget(server) is None
+    assert manager.generated == 2
+
+
+def test_rejected_sessions_are_renewed(fake, new_server):
+    manager = sessions.SessionManager()
+    server = new_server(fake, sessions=manager)
+    session = manager.get(server)
+    fake.sessions.clear()
+    assert server.fetch_comment_meta()['comments']
+    assert manager.get(server) != session
+    assert manager.generated == 2
@@ -0,0 +1,103 @@
+import io
+
+import pytest
+
+from lj import lj, fakeserver
+
+META_PAGE = b'''<?xml version="1.0" encoding='utf-8'?>
+<livejournal>
+<maxid>3</maxid>
+<comments>
+<comment id="1" posterid="5" />
+<comment id="2" posterid="5" state="S" />
+<comment id="3" posterid="0" state="D" />
+</comments>
+<usermaps>
+<usermap id="5" user="bob" />
+</usermaps>
+</livejournal>
+'''
+
+BODY_PAGE = u'''<?xml version="1.0" encoding='utf-8'?>
+<livejournal>
+<comments>
+<comment id="1" posterid="5" jitemid="7" parentid="0">
+<subject>Hello</subject>
+<body>Привет, &lt;b&gt;world&lt;/b&gt;</body>
+<date>2007-01-01T00:00:00Z</date>
+</comment>
+<comment id="2" posterid="5" state="S" jitemid="7" parentid="1">
+<body>Reply</body>
+<date>2007-01-02T00:00:00Z</date>
+</comment>
+</comments>
+</livejournal>
+'''.encode('utf-8')
+
+
+class Trickle(io.BytesIO):
+    """Hands out at most a few bytes per read, as a slow connection would"""
+
+    def read(self, amt=-1):
+        return io.BytesIO.read(self, 5)
+
+
+def test_meta_pages_parse_a_little_at_a_time():
+    items = list(lj.iterparse_comment_meta(Trickle(META_PAGE)))
+    assert items == [('maxid', None, '3'),
+                     ('comment', '1', ('5', 'A')),
+                     ('comment', '2', ('5', 'S')),
+                     ('comment', '3', ('0', 'D')),
+                     ('usermap', '5', 'bob')]
+    assert lj.parse_comment_meta(io.BytesIO(META_PAGE)) == {
+        'maxid': '3', 'comments': {'1': ('5', 'A'), '2': ('5', 'S'), '3': ('0', 'D')}, 'usermaps': {'5': 'bob'}}
+
+
+def test_body_pages_parse_a_little_at_a_time():
+    comments = dict(lj.iterparse_comment_bodies(Trickle(BODY_PAGE)))
+    assert comments['1']['body'] == u'Привет, <b>world</b>'
+    assert comments['1']['state'] == 'A' and comments['1']['subject'] == 'Hello'
+    assert comments['2']['state'] == 'S' and comments['2']['parentid'] == '1' and comments['2']['subject'] == ''
+    assert lj.parse_comment_bodies(io.BytesIO(BODY_PAGE)) == comments
+
+
+def test_prefetched_raises_where_the_item_would_have_been():
+    def items():
+        yield 1
+        yield 2
+        raise ValueError('Third')
+    seen = []
+    with pytest.raises(ValueError):
+        for item in lj.prefetched(items()):
+            seen.append(item)
+    assert seen == [1, 2]
+
+
+def test_iter_syncitems(fake, server):
+    items = list(server.iter_syncitems())
+    assert sorted(int(item['item'][2:]) for item in items) == list(range(1, 121))
+    assert [item['time'] for item in items] == sorted(item['time'] for item in items)
+    assert list(server.iter_syncitems(items[-1]['time'], prefetch=False)) == []
+    assert fake.calls['syncitems'] >= 120 // 50 + 1
+
+
+def test_iter_events_since(server):
+    entries = list(server.iter_events_since(window=30))
+    assert sorted(entry['itemid'] for entry in entries) == list(range(1, 121))
+    last = max(item['time'] for item in server.iter_syncitems())
+    server.postevent('Late entry', 'Late')
+    assert [entry['subject'] for entry in server.iter_events_since(last, prefetch=False)] == ['Late']
+
+
+@pytest.mark.parametrize('gzip', [False, True])
+def test_iter_comments(gzip):
+    with fakeserver.FakeLJServer(entries=20, comments=450, body_page=100, meta_page=200, gzip=gzip) as fake:
+        server = lj.LJServer('Python-lj.py/0.0.1', 'lj.py tests', fake.url)
+        server.login('test', 'test')
+        ids = [int(id) for id, comment in server.iter_comments(51)]
+        assert ids == list(range(51, 451))
+        pages = list(server.iter_comment_meta_pages(prefetch=False))
+        assert sum(len(page['comments']) for page in pages) == 450
+        assert pages[-1]['maxid'] == '450'
+        # A session was generated for each walk, and expired afterwards
+        assert fake.calls['sessionexpire'] == 2
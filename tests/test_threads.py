@@ -0,0 +1,48 @@
+import pytest
+
+from lj import storage
+from lj.threads import ThreadIndex
+
+
+def comment(jitemid, parentid):
+    return {'jitemid': str(jitemid), 'parentid': str(parentid), 'posterid': '1', 'state': 'A',
+            'body': 'Comment', 'subject': '', 'date': '2007-01-01T00:00:00Z'}
+
+
+COMMENTS = {'1': comment(7, 0), '2': comment(7, 1), '3': comment(7, 2), '4': comment(7, 1),
+            '5': comment(7, 0), '6': comment(8, 0), '7': comment(7, 5)}
+
+
+def test_threads_are_walked_in_order():
+    index = ThreadIndex(COMMENTS)
+    assert index.thread(7) == [(1, 0), (2, 1), (3, 2), (4, 1), (5, 0), (7, 1)]
+    assert index.thread(8) == [(6, 0)]
+    assert index.subtree(2) == [(2, 1), (3, 2)]
+    assert index.subtree(99) == []
+    assert [index.reply_count(id) for id in (1, 2, 3, 5)] == [3, 1, 0, 1]
+    assert index.recent(7, 3) == [7, 5, 4]
+
+
+def test_orphans_are_adopted_when_their_parent_arrives():
+    index = ThreadIndex()
+    index.add({'3': COMMENTS['3'], '4': COMMENTS['4']})
+    assert index.thread(7) == [(3, 0), (4, 0)]
+    index.add({'2': COMMENTS['2']})
+    assert index.thread(7) == [(2, 0), (3, 1), (4, 0)]
+    index.add({'1': COMMENTS['1']})
+    assert index.thread(7) == [(1, 0), (2, 1), (3, 2), (4, 1)]
+    assert index.reply_count(1) == 3
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'pickle'])
+def test_stores_index_threads_alike(tmp_path, backend):
+    store = storage.open_store(str(tmp_path / 'backup'), backend)
+    try:
+        store.put_comments(dict((id, c) for id, c in COMMENTS.items() if id != '1'))
+        store.put_comments({'1': COMMENTS['1']})
+        assert [(int(id), depth) for id, depth, c in store.thread(7)] == ThreadIndex(COMMENTS).thread(7)
+        assert [id for id, depth, c in store.subtree(2)] == ['2', '3']
+        assert store.reply_count(1) == 3
+        assert [id for id, c in store.recent_comments(7, 2)] == ['7', '5']
+    finally:
+        store.close()
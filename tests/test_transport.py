@@ -0,0 +1,151 @@
+import gzip
+import socket
+import threading
+import zlib
+
+try:
+    import http.client as httplib
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    import httplib
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+import pytest
+
+from lj import lj, transport
+
+
+class DroppingHandler(BaseHTTPRequestHandler):
+    """Answers the first request on each connection, and hangs up on the second without answering"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        self.answered = False
+        BaseHTTPRequestHandler.handle(self)
+
+    def reply(self):
+        self.server.requests.append(self.command)
+        if self.answered:
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.answered = True
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def do_GET(self):
+        self.reply()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.reply()
+
+
+class DroppingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def dropping():
+    httpd = DroppingServer(('127.0.0.1', 0), DroppingHandler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def fetch(pool, method, url):
+    response = pool.request(method, url, b'x' if method == 'POST' else None)
+    try:
+        return response.read()
+    finally:
+        response.close()
+
+
+def test_get_is_sent_again_on_a_new_connection(dropping):
+    pool = transport.ConnectionPool()
+    url = 'http://127.0.0.1:%d/' % dropping.server_port
+    assert fetch(pool, 'GET', url) == b'ok'
+    assert fetch(pool, 'GET', url) == b'ok'
+    assert dropping.requests == ['GET', 'GET', 'GET']
+    assert pool.stats()['reconnects'] == 1
+    pool.close()
+
+
+def test_post_is_never_sent_twice(dropping):
+    pool = transport.ConnectionPool()
+    url = 'http://127.0.0.1:%d/' % dropping.server_port
+    assert fetch(pool, 'POST', url) == b'ok'
+    with pytest.raises((ConnectionError, httplib.BadStatusLine)):
+        fetch(pool, 'POST', url)
+    assert dropping.requests == ['POST', 'POST']
+    pool.close()
+
+
+def challenges(count, lifetime=60):
+    return [{'challenge': 'c%d' % number, 'server_time': 100, 'expire_time': 100 + lifetime}
+            for number in range(count)]
+
+
+def test_pool_copes_with_short_refills():
+    pool = lj.ChallengePool(lambda wanted: challenges(1), size=10, low_water=3)
+    assert pool.get() == 'c0'
+    assert pool.get() == 'c0'
+    with pytest.raises(lj.LJException):
+        lj.ChallengePool(lambda wanted: []).get()
+
+
+def test_pool_margin_is_clamped_to_short_lifetimes():
+    pool = lj.ChallengePool(lambda wanted: challenges(wanted, lifetime=4), size=5, low_water=1, margin=30)
+    assert pool.get() == 'c0'
+    assert len(pool) == 4
+
+
+class Body:
+    """Stands in for a response, handing its body out a few bytes at a time"""
+
+    def __init__(self, data, chunk=7):
+        self.data = data
+        self.chunk = chunk
+        self.closed = False
+
+    def read(self, amt=None):
+        data, self.data = self.data[:self.chunk], self.data[self.chunk:]
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('encoding', ['', 'gzip', 'deflate', 'raw deflate'])
+def test_decoded_response(encoding):
+    data = b''.join(b'<comment id="%d">Some text</comment>' % number for number in range(500))
+    if encoding == 'gzip':
+        encoded = gzip.compress(data)
+    elif encoding == 'deflate':
+        encoded = zlib.compress(data)
+    elif encoding == 'raw deflate':
+        compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        encoded = compressor.compress(data) + compressor.flush()
+        encoding = 'deflate'
+    else:
+        encoded = data
+    body = Body(encoded)
+    closed = []
+    response = transport.DecodedResponse(body, encoding, closed.append)
+    assert b''.join(iter(response.read, b'')) == data
+    assert response.compressed_bytes == len(encoded)
+    assert response.uncompressed_bytes == len(data)
+    response.close()
+    response.close()
+    assert body.closed and closed == [response]
@@ -0,0 +1,111 @@
+import sqlite3
+import threading
+import time
+
+from lj import watch, storage
+
+
+def test_scheduler_backs_off_failing_jobs():
+    scheduler = watch.Scheduler(workers=1, retry=0.02, max_backoff=0.08)
+    runs = []
+
+    def failing():
+        runs.append(time.monotonic())
+        raise ValueError('Not today')
+    scheduler.add(failing)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.4)
+    scheduler.shutdown()
+    thread.join()
+    gaps = [later - earlier for earlier, later in zip(runs, runs[1:])]
+    assert len(runs) >= 4
+    assert gaps[0] < gaps[1] < gaps[2]
+    assert max(gaps) < 0.2
+
+
+def test_scheduler_forgets_failures_once_a_job_succeeds():
+    scheduler = watch.Scheduler(workers=1, retry=0.01)
+    outcomes = [ValueError('Once'), None]
+
+    def flaky():
+        outcome = outcomes.pop(0)
+        if outcome is not None:
+            raise outcome
+        return 10
+    scheduler.add(flaky)
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    time.sleep(0.1)
+    scheduler.shutdown()
+    thread.join()
+    assert outcomes == []
+    assert scheduler.failures == {}
+
+
+def watcher(fake, path):
+    return watch.Watcher('test', 'test', storage.open_store(path, 'sqlite'),
+                         watch.lj.LJServer('Python-lj.py/0.0.1', 'lj.py tests', fake.url), retry=10, jitter=0)
+
+
+def test_unexpected_errors_back_off(fake, tmp_path):
+    poller = watcher(fake, str(tmp_path / 'watch.db'))
+    saved = poller.store.set
+
+    def locked(*args):
+        raise sqlite3.OperationalError('database is locked')
+    poller.store.set = locked
+    try:
+        assert poller.checkfriends() == 10
+        assert poller.checkfriends() == 20
+        poller.store.set = saved
+        assert poller.checkfriends() == 90
+        assert poller.failures['checkfriends'] == 0
+    finally:
+        poller.close()
+
+
+def test_polls_dont_wait_for_a_busy_journal(fake, tmp_path):
+    poller = watcher(fake, str(tmp_path / 'watch.db'))
+    try:
+        with poller.lock:
+            started = time.monotonic()
+            assert poller.sync() == poller.busy_retry
+            assert poller.checkfriends() == poller.busy_retry
+            assert time.monotonic() - started < 1
+        assert fake.calls.get('syncitems') is None
+    finally:
+        poller.close()
+
+
+def test_idle_polls_only_check_for_changes(fake, tmp_path):
+    poller = watcher(fake, str(tmp_path / 'watch.db'))
+    try:
+        poller.sync()
+        assert poller.store.count_comments() == 1500
+        meta = fake.calls['comment_meta']
+        bodies = fake.calls['comment_body']
+        poller.sync()
+        assert fake.calls['comment_meta'] == meta + 1
+        assert fake.calls['comment_body'] == bodies
+
+        fake.add_comments(5)
+        poller.sync()
+        assert poller.store.count_comments() == 1505
+        assert fake.calls['comment_body'] == bodies + 1
+        assert poller.failures['sync'] == 0
+    finally:
+        poller.close()
+
+
+def test_metadata_is_rechecked_after_meta_interval(fake, tmp_path):
+    poller = watcher(fake, str(tmp_path / 'watch.db'))
+    poller.meta_interval = 0
+    try:
+        poller.sync()
+        fake.set_comment_state(1490, 'S')
+        poller.sync()
+        rows = poller.store.db.execute('SELECT state FROM comments WHERE id = 1490').fetchall()
+        assert rows == [('S',)]
+    finally:
+        poller.close()